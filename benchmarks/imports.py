@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Import-time benchmarks for the hipchat package.
+
+Worker start-up, management commands and logging configuration all pay
+for whatever the hipchat modules import. Each target below is imported
+in a fresh interpreter (several times, taking the fastest run), and
+checked against a budget:
+
+    - the time taken to import it must be under max_ms;
+    - none of the 'heavy' modules listed may have been imported.
+
+    $ python benchmarks/imports.py
+    $ python benchmarks/imports.py --runs 10 --output imports.json
+
+The exit code is 1 if any budget is exceeded. (On Python 3.7+ use
+`python -X importtime -c 'import hipchat'` to see where the time goes -
+this script measures wall-clock time, as Python 2.7 has no equivalent.)
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must only be imported on first use
+HEAVY = ('requests', 'jwt', 'django.conf', 'django.db', 'hipchat.notifications')
+
+# (name, setup statement, statement to time, max_ms, forbidden modules)
+BUDGETS = (
+    ('hipchat', '', 'import hipchat', 10, HEAVY),
+    ('hipchat.logger', '', 'import hipchat.logger', 10, HEAVY),
+    (
+        'django.setup',
+        'import django',
+        'django.setup()',
+        # the Django apps themselves dominate this, the budget is generous
+        1000,
+        ('requests', 'jwt', 'hipchat.notifications'),
+    ),
+)
+
+CHILD = """
+import json
+import sys
+from timeit import default_timer
+%(setup)s
+start = default_timer()
+%(statement)s
+elapsed = default_timer() - start
+print(json.dumps({
+    'ms': elapsed * 1000,
+    'imported': [m for m in %(forbidden)r if m in sys.modules],
+}))
+"""
+
+
+def run_once(setup, statement, forbidden):
+    """Time the statement in a fresh interpreter, returning the child output."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='settings')
+    code = CHILD % {'setup': setup, 'statement': statement, 'forbidden': tuple(forbidden)}
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, env=env)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(name, setup, statement, max_ms, forbidden, runs):
+    """Return a dict of the fastest import time, and any forbidden imports."""
+    results = [run_once(setup, statement, forbidden) for _ in range(runs)]
+    best = min(r['ms'] for r in results)
+    imported = sorted(set(m for r in results for m in r['imported']))
+    return {
+        'name': name,
+        'runs': runs,
+        'ms': best,
+        'max_ms': max_ms,
+        'imported': imported,
+    }
+
+
+def check(result):
+    """Return a list of the budget failures for a result."""
+    failures = []
+    if result['ms'] > result['max_ms']:
+        failures.append(
+            "%s: import took %.1fms (budget %sms)" %
+            (result['name'], result['ms'], result['max_ms'])
+        )
+    for module in result['imported']:
+        failures.append("%s: imports %s" % (result['name'], module))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the hipchat import-time budgets.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--filter', default='', help="Only run targets containing this string.")
+    parser.add_argument('--output', help="Write JSON results to this file (default stdout).")
+    args = parser.parse_args(argv)
+
+    results = [
+        measure(name, setup, statement, max_ms, forbidden, args.runs)
+        for name, setup, statement, max_ms, forbidden in BUDGETS
+        if args.filter in name
+    ]
+    output = json.dumps({'results': results}, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+    failures = [f for result in results for f in check(result)]
+    for failure in failures:
+        sys.stderr.write("OVER BUDGET %s\n" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
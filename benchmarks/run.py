@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks for the hipchat add-on hot paths.
+
+Runs offline, against a throwaway test database (created using the test
+project settings) and a local fake HTTP server in place of the HipChat
+API (see hipchat.testing). Results are written as JSON, and can be compared against a previous
+run to catch performance regressions:
+
+    $ python benchmarks/run.py --output bench.json
+    $ python benchmarks/run.py --baseline bench.json --tolerance 0.2
+
+The comparison fails (exit code 1) if any benchmark's median time has
+increased by more than the tolerance, or if it makes more DB queries.
+
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+import django  # noqa
+django.setup()
+
+from django.conf import settings  # noqa
+from django.core.cache import cache  # noqa
+from django.db import connection  # noqa
+from django.test.client import RequestFactory  # noqa
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa
+
+import jwt  # noqa
+
+from hipchat import models, notifications, signed_requests, views  # noqa
+from hipchat.profiling import percentile  # noqa
+from hipchat.testing import FakeHipChatServer  # noqa
+
+BENCHMARKS = []
+
+# used to generate unique keys / ids for benchmark data
+sequence = itertools.count()
+
+
+def benchmark(func):
+    """Register a benchmark function.
+
+    Each benchmark function sets up its data, and returns a zero-argument
+    callable that exercises the hot path once.
+
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def create_addon(num_scopes=1, num_glances=1):
+    """Create an Addon with the given number of scopes and glances."""
+    app = models.Addon(key="bench-%s" % next(sequence)).save()
+    for i in range(num_scopes):
+        app.scopes.add(models.Scope(name="scope-%s" % next(sequence)).save())
+    for i in range(num_glances):
+        models.Glance(app=app, key="glance-%s" % i).save()
+    return app
+
+
+def signed_request(install):
+    """Return a signed JWT token for the install."""
+    return jwt.encode(
+        {'iss': install.oauth_id, 'exp': int(time.time()) + 3600},
+        install.oauth_secret
+    )
+
+
+def create_install(app):
+    """Create an Install for the app."""
+    return models.Install(
+        app=app,
+        oauth_id="bench-%s" % next(sequence),
+        oauth_secret="secret",
+        group_id=1
+    ).save()
+
+
+@benchmark
+def descriptor_1_scope_1_glance():
+    app = create_addon(1, 1)
+    return app.descriptor
+
+
+@benchmark
+def descriptor_10_scopes_5_glances():
+    app = create_addon(10, 5)
+    return app.descriptor
+
+
+@benchmark
+def descriptor_30_scopes_20_glances():
+    app = create_addon(30, 20)
+    return app.descriptor
+
+
+@benchmark
+def glance_update_content():
+    glance = create_addon(1, 1).glances.get()
+
+    def run():
+        return models.GlanceUpdate(
+            glance=glance,
+            label_value="<b>4</b> open tickets",
+            lozenge=models.Lozenge(models.LOZENGE_DEFAULT, "new"),
+            icons=models.Icon('https://example.com/1.png', 'https://example.com/2.png'),
+        ).content()
+    return run
+
+
+@benchmark
+def glance_content_value():
+    def run():
+        return models.GlanceContent(
+            "<b>4</b> open tickets",
+            lozenge=models.Lozenge(models.LOZENGE_DEFAULT, "new"),
+            icons=models.Icon('https://example.com/1.png', 'https://example.com/2.png'),
+        ).content()
+    return run
+
+
+@benchmark
+def view_descriptor_cached():
+    app = create_addon(10, 5)
+    request = RequestFactory().get('/')
+    return lambda: views.descriptor(request, app_id=app.id)
+
+
+@benchmark
+def view_descriptor_uncached():
+    app = create_addon(10, 5)
+    request = RequestFactory().get('/')
+
+    def run():
+        cache.clear()
+        return views.descriptor(request, app_id=app.id)
+    return run
+
+
+@benchmark
+def view_glance():
+    app = create_addon(1, 1)
+    glance = app.glances.get()
+    install = create_install(app)
+    request = RequestFactory().get('/', {'signed_request': signed_request(install)})
+    return lambda: views.glance(request, glance_id=glance.id)
+
+
+@benchmark
+def validate_jwt_token_warm():
+    install = create_install(create_addon())
+    request = RequestFactory().get('/', {'signed_request': signed_request(install)})
+    return lambda: views.validate_jwt_token(request)
+
+
+@benchmark
+def validate_jwt_token_cold():
+    install = create_install(create_addon())
+    request = RequestFactory().get('/', {'signed_request': signed_request(install)})
+
+    def run():
+        signed_requests.secrets_cache.clear()
+        signed_requests.tokens_cache.clear()
+        return views.validate_jwt_token(request)
+    return run
+
+
+@benchmark
+def call_api_fake_server():
+    server = FakeHipChatServer().start()
+    url = server.url + 'room/1/notification'
+    return lambda: notifications._call_api(url, "Hello", auth_token="token")
+
+
+def measure(name, func, iterations):
+    """Run a benchmark, returning a dict of timings (in ms) and query count."""
+    func()  # warm up
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    timings = []
+    for _ in range(iterations):
+        start = default_timer()
+        func()
+        timings.append((default_timer() - start) * 1000)
+    timings.sort()
+    return {
+        'name': name,
+        'iterations': iterations,
+        'queries': len(queries),
+        'min_ms': timings[0],
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline, returning a list of regressions."""
+    previous = {r['name']: r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get(result['name'])
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(
+                "%s: queries increased from %s to %s" %
+                (result['name'], base['queries'], result['queries'])
+            )
+        if result['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(
+                "%s: median increased from %.3fms to %.3fms" %
+                (result['name'], base['p50_ms'], result['p50_ms'])
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hipchat hot paths.")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--filter', default='', help="Only run benchmarks containing this string.")
+    parser.add_argument('--output', help="Write JSON results to this file (default stdout).")
+    parser.add_argument('--baseline', help="JSON results file to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed fractional slowdown against the baseline.")
+    args = parser.parse_args(argv)
+
+    # debug logging is disabled in production, and would skew the results
+    logging.disable(logging.INFO)
+    setup_test_environment()
+    settings.DEBUG = True
+    settings.HIPCHAT_RUN_TASKS_SYNC = True
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = []
+        for func in BENCHMARKS:
+            if args.filter in func.__name__:
+                results.append(measure(func.__name__, func(), args.iterations))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    output = json.dumps({'results': results}, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            sys.stderr.write("REGRESSION %s\n" % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
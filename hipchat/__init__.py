@@ -1,58 +1,23 @@
 # -*- coding: utf-8 -*-
-import logging
+"""HipChat add-on app.
 
-from hipchat.notifications import send_room_message
+This module is imported before any hipchat submodule, so it must stay
+cheap - it doesn't import Django settings, requests, or the rest of the
+app. See benchmarks/imports.py for the import-time budgets.
 
+"""
+from hipchat.logger import LogHandler  # noqa
 
-class LogHandler(logging.Handler):
+default_app_config = 'hipchat.apps.HipChatConfig'
 
-    """Log handler used to send notifications to HipChat."""
 
-    DEFAULT_COLOURS = {
-        'DEBUG': 'gray',     # background noise
-        'INFO': 'yellow',    # default stuff
-        'WARNING': 'green',  # used for good things we want to know about
-        'ERROR': 'red',      # things we don't like
-    }
+def send_room_message(*args, **kwargs):
+    """Send a message to a room - see hipchat.notifications.send_room_message."""
+    from hipchat.notifications import send_room_message
+    return send_room_message(*args, **kwargs)
 
-    def __init__(self, token, room, sender='Django', notify=False,
-                 color='yellow', colors=DEFAULT_COLOURS, async=False):
-        """
-        Initialise log handler.
 
-        Args:
-            token: the auth token for access to the API - see hipchat.com
-            room: the numerical id of the room to send the message to
-
-        Kwargs:
-            sender (optional): the 'from' property of the message - appears in the HipChat window
-            notify (optional): if True, HipChat pings / bleeps / flashes when message is received
-            color (optional): sets the background color of the message in the HipChat window
-            colors (optional): a dict of level:color pairs (e.g. {'DEBUG:'red'} used to
-                override the default color)
-            async (optional): if True, then writes will be queued using Redis (
-                defaults to False.)
-
-        """
-        logging.Handler.__init__(self)
-        self.token = token
-        self.room = room
-        self.sender = sender
-        self.notify = notify
-        self.color = color
-        self.colors = colors
-        self.async = async
-        self.queue = None
-
-    def emit(self, record):
-        """Send the record info to HipChat."""
-        assert self.token is not None, u"HipChat logger must have a token configured."
-        send_room_message(
-            self.room,
-            record.getMessage(),
-            auth_token=self.token,
-            color=self.colors.get(record.levelname, self.color),
-            sender=self.sender,
-            notify=self.notify,
-            message_format='html'
-        )
+def send_room_template(*args, **kwargs):
+    """Send a templated message to a room - see hipchat.notifications.send_room_template."""
+    from hipchat.notifications import send_room_template
+    return send_room_template(*args, **kwargs)
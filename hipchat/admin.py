@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 import json
 
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
 from django.utils.safestring import mark_safe
 
-from hipchat.models import Addon, Install, Glance, GlanceUpdate
+from hipchat import webhooks
+from hipchat.models import Addon, Install, Glance, GlanceUpdate, Webhook, WebhookEvent
 
 
 def pretty_print(data):
@@ -44,6 +49,14 @@ class GlanceInline(admin.StackedInline):
     max_num = 1
 
 
+class WebhookInline(admin.TabularInline):
+
+    """Inline admin for viewing / adding Addon webhooks."""
+
+    model = Webhook
+    extra = 0
+
+
 class AddonAdmin(DescriptorMixin, admin.ModelAdmin):
 
     """Admin model for Addon objects."""
@@ -57,7 +70,7 @@ class AddonAdmin(DescriptorMixin, admin.ModelAdmin):
         'install_link'
     )
     readonly_fields = ('pretty_descriptor',)
-    inlines = (GlanceInline,)
+    inlines = (GlanceInline, WebhookInline)
 
     def install_link(self, obj):
         """Return link to install direct."""
@@ -72,12 +85,27 @@ class AddonAdmin(DescriptorMixin, admin.ModelAdmin):
 
 def get_access_tokens(modeladmin, request, queryset):
     """Refresh API access tokens for selected installs."""
-    for obj in queryset:
-        obj.get_access_token()
+    Install.get_access_tokens(queryset)
 
 get_access_tokens.short_description = "Get access tokens for selected installs."
 
 
+class InstallChangeList(ChangeList):
+
+    """ChangeList that fetches the page's cached tokens in one go.
+
+    Each Install on the page has its cached token (or None) set as
+    the _cached_token attribute, using a single cache.get_many call.
+
+    """
+
+    def get_results(self, request):
+        super(InstallChangeList, self).get_results(request)
+        tokens = Install.get_cached_tokens(self.result_list)
+        for obj in self.result_list:
+            obj._cached_token = tokens.get(obj.oauth_id)
+
+
 class InstallAdmin(admin.ModelAdmin):
 
     """Admin model of Install objects."""
@@ -87,8 +115,11 @@ class InstallAdmin(admin.ModelAdmin):
         'group_id',
         'room_id',
         'oauth_short',
-        'has_access_token'
+        'token_status',
+        'has_access_token',
+        'token_ttl'
     )
+    list_select_related = ('app',)
     readonly_fields = (
         'app',
         'oauth_id',
@@ -96,6 +127,9 @@ class InstallAdmin(admin.ModelAdmin):
         'group_id',
         'room_id',
         'installed_at',
+        'token_status',
+        'token_status_message',
+        'token_status_at',
         'access_token'
     )
     actions = (get_access_tokens,)
@@ -104,11 +138,25 @@ class InstallAdmin(admin.ModelAdmin):
         return obj.oauth_id[:8]
     oauth_short.short_description = "OAuth Id (truncated)"
 
+    def get_changelist(self, request, **kwargs):
+        return InstallChangeList
+
+    def cached_token(self, obj):
+        """Return the token fetched by InstallChangeList, else from the cache."""
+        try:
+            return obj._cached_token
+        except AttributeError:
+            return obj.get_access_token(auto_refresh=False)
+
     def has_access_token(self, obj):
-        return obj.get_access_token(auto_refresh=False) is not None
+        return self.cached_token(obj) is not None
     has_access_token.short_description = "Has cached access token"
     has_access_token.boolean = True
 
+    def token_ttl(self, obj):
+        return Install.token_ttl(self.cached_token(obj))
+    token_ttl.short_description = "Token TTL (seconds)"
+
     def access_token(self, obj):
         return pretty_print(obj.get_access_token(auto_refresh=False))
 
@@ -126,16 +174,92 @@ class GlanceAdmin(DescriptorMixin, admin.ModelAdmin):
     readonly_fields = ('pretty_descriptor',)
 
 
+def count_limit():
+    """Return the max number of rows counted by EstimatedCountPaginator."""
+    return getattr(settings, 'HIPCHAT_ADMIN_COUNT_LIMIT', 10000)
+
+
+class EstimatedCountPaginator(Paginator):
+
+    """Paginator that avoids a full COUNT(*) on very large tables.
+
+    On PostgreSQL the planner's row estimate is used for an unfiltered
+    table; otherwise rows are counted up to HIPCHAT_ADMIN_COUNT_LIMIT
+    (so the count is bounded, and later pages are reached by filtering).
+
+    """
+
+    def _get_count(self):
+        if self._count is None:
+            limit = count_limit()
+            estimate = self.estimate_count()
+            if estimate is not None and estimate > limit:
+                self._count = estimate
+            else:
+                self._count = self.object_list.order_by()[:limit].count()
+        return self._count
+    count = property(_get_count)
+
+    def estimate_count(self):
+        """Return the planner's estimated row count, or None."""
+        queryset = self.object_list
+        if queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+
+class LatestPerGlanceFilter(admin.SimpleListFilter):
+
+    """Show only the most recent update for each glance."""
+
+    title = "history"
+    parameter_name = 'history'
+
+    def lookups(self, request, model_admin):
+        return (('latest', "Latest per glance"),)
+
+    def queryset(self, request, queryset):
+        if self.value() == 'latest':
+            return queryset.latest_per_glance()
+        return queryset
+
+
 class GlanceUpdateAdmin(admin.ModelAdmin):
 
-    """Admin model of Glance objects."""
+    """Admin model of GlanceUpdate objects.
+
+    The update history is expected to grow without bound, so the
+    changelist is ordered by id, doesn't count the whole table (see
+    EstimatedCountPaginator), and only filters on indexed columns.
+
+    """
 
     list_display = (
+        'id',
         'glance',
+        'created_at',
         'label',
         'lozenge',
         'icon'
     )
+    list_filter = (
+        LatestPerGlanceFilter,
+        ('created_at', admin.DateFieldListFilter),
+        'glance'
+    )
+    list_select_related = ('glance__app',)
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def lozenge(self, obj):
         if obj.has_lozenge:
@@ -151,7 +275,48 @@ class GlanceUpdateAdmin(admin.ModelAdmin):
             return None
 
 
+def reprocess_events(modeladmin, request, queryset):
+    """Mark selected events as pending, and schedule processing."""
+    queryset.update(status=WebhookEvent.STATUS_PENDING, claim='', processed_at=None)
+    webhooks.schedule_processing()
+
+reprocess_events.short_description = "Reprocess selected events."
+
+
+class WebhookEventAdmin(admin.ModelAdmin):
+
+    """Admin model of WebhookEvent objects.
+
+    As with GlanceUpdate, the table is expected to grow without bound.
+
+    """
+
+    list_display = (
+        'id',
+        'webhook',
+        'oauth_id',
+        'status',
+        'received_at',
+        'processed_at'
+    )
+    list_filter = ('status', 'webhook')
+    list_select_related = ('webhook',)
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = (reprocess_events,)
+    readonly_fields = ('pretty_payload',)
+
+    def pretty_payload(self, obj):
+        try:
+            return pretty_print(obj.data)
+        except ValueError:
+            return obj.payload
+    pretty_payload.short_description = "Payload (formatted)"
+
+
 admin.site.register(Addon, AddonAdmin)
 admin.site.register(Install, InstallAdmin)
 admin.site.register(Glance, GlanceAdmin)
 admin.site.register(GlanceUpdate, GlanceUpdateAdmin)
+admin.site.register(WebhookEvent, WebhookEventAdmin)
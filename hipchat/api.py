@@ -1,7 +1,18 @@
 # -*- coding: utf-8 -*-
-"""HipChat API interations."""
-import json
-import requests
+"""HipChat API interations.
+
+NB requests is imported when the first request is made, rather than at
+import time, as this module is imported by the models (i.e. whenever
+Django starts up) - see benchmarks/imports.py.
+
+"""
+from django.conf import settings
+
+from hipchat import dispatch
+from hipchat import metrics
+from hipchat import serialization
+
+API_V2_ROOT = 'https://api.hipchat.com/v2/'
 
 
 class HipChatError(Exception):
@@ -15,7 +26,7 @@ class HipChatError(Exception):
 
     def __unicode__(self):
         message = (
-            json.loads(self.error_message)
+            serialization.loads(self.error_message)
             .get('error', {})
             .get('message')
         )
@@ -25,6 +36,19 @@ class HipChatError(Exception):
         return unicode(self).decode('utf-8')
 
 
+def api_url(path):
+    """Return the full API URL for a relative path.
+
+    The API root can be overridden using the HIPCHAT_API_ROOT setting,
+    e.g. to point at hipchat.testing.FakeHipChatServer.
+
+    >>> api_url('room/123/notification')
+    'https://api.hipchat.com/v2/room/123/notification'
+
+    """
+    return getattr(settings, 'HIPCHAT_API_ROOT', API_V2_ROOT) + path
+
+
 def auth_headers(auth_token):
     """Return HTTP authentication headers for API requests.
 
@@ -44,7 +68,7 @@ def auth_headers(auth_token):
     }
 
 
-def post_json(url, auth_token, payload):
+def post_json(url, auth_token, payload, session=None):
     """POST payload to API.
 
     Args:
@@ -52,15 +76,41 @@ def post_json(url, auth_token, payload):
         auth_token: string, a valid API access token.
         payload: dict, the data to post.
 
+    Kwargs:
+        session: a requests.Session, used to reuse connections across
+            many requests - defaults to a new connection per request.
+
     Returns the response object. Raises HipChatError if response code
     is not 2xx.
 
     """
-    resp = requests.post(
+    import requests
+    resp = metrics.timed_request(
         url,
-        json=payload,
+        (session or requests).post,
+        data=serialization.dumps(payload),
         headers=auth_headers(auth_token)
     )
+    dispatch.rate_limit.update(resp)
     if str(resp.status_code)[:1] != '2':
         raise HipChatError(resp.status_code, resp.text)
     return resp
+
+
+def get_json(url, auth_token):
+    """GET JSON from the API.
+
+    Args:
+        url: string, the API endpoint.
+        auth_token: string, a valid API access token.
+
+    Returns the decoded response. Raises HipChatError if response code
+    is not 2xx.
+
+    """
+    import requests
+    resp = metrics.timed_request(url, requests.get, headers=auth_headers(auth_token))
+    dispatch.rate_limit.update(resp)
+    if str(resp.status_code)[:1] != '2':
+        raise HipChatError(resp.status_code, resp.text)
+    return serialization.loads(resp.text)
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""hipchat app configuration."""
+from django.apps import AppConfig
+
+
+class HipChatConfig(AppConfig):
+
+    """AppConfig for the hipchat app."""
+
+    name = 'hipchat'
+    verbose_name = "HipChat"
+
+    def ready(self):
+        """Connect the cache invalidation signal receivers."""
+        from hipchat import receivers  # noqa
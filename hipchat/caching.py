@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""In-process caching helpers.
+
+The Django cache is used for data that must be shared across processes
+(e.g. API access tokens), but it still costs a network round trip per
+lookup. The BoundedCache in this module is used for small, hot, values
+that are read on every request (e.g. install secrets), and which can be
+safely held in process memory for a short time.
+
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class BoundedCache(object):
+
+    """Thread-safe LRU cache with optional per-entry expiry.
+
+    Entries are evicted on a least-recently-used basis once the cache
+    holds maxsize entries. Entries set with a timeout are treated as
+    missing once they have expired.
+
+    """
+
+    def __init__(self, maxsize=1000, timeout=None):
+        """Initialise cache.
+
+        Kwargs:
+            maxsize: int, the maximum number of entries to hold.
+            timeout: int, default number of seconds for which entries
+                are valid - None means that entries do not expire.
+
+        """
+        assert maxsize > 0, u"BoundedCache maxsize must be positive."
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __repr__(self):
+        return "<BoundedCache size=%s maxsize=%s>" % (len(self), self.maxsize)
+
+    def get(self, key, default=None):
+        """Return cached value, or default if missing or expired."""
+        with self._lock:
+            try:
+                value, expires_at = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at <= time.time():
+                return default
+            # re-insert to mark as most recently used
+            self._data[key] = (value, expires_at)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """Add value to the cache, evicting the oldest entry if full.
+
+        Kwargs:
+            timeout: int, number of seconds for which the value is valid,
+                defaults to the cache timeout.
+
+        """
+        timeout = self.timeout if timeout is None else timeout
+        expires_at = None if timeout is None else time.time() + timeout
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove an entry from the cache."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._data.clear()
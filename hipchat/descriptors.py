@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Cached, pre-serialized, add-on descriptors.
+
+HipChat fetches the descriptor each time an add-on is installed or
+refreshed, and building it is expensive (Site, scopes, glances and
+webhooks are all queried). The serialized JSON is cached (using the
+Django cache) along with a content hash that is used as the response
+ETag, so that repeated fetches are a single cache read.
+
+The cache entries are invalidated whenever an Addon, Glance, Webhook,
+Scope or Site is changed - see hipchat.receivers. Each add-on's cache key
+includes a generation, which invalidation replaces, so a descriptor built
+from the old rows by a concurrent request (the receivers run before the
+change is committed) is written under a key that is no longer read. The
+generation is replaced again once the transaction commits (on Django 1.9+,
+which has transaction.on_commit) - on Django 1.8 a descriptor built in
+that window can be served until HIPCHAT_DESCRIPTOR_CACHE_TIMEOUT, so the
+default is 300 seconds.
+
+For building descriptors in bulk (e.g. for export or validation) use
+iter_descriptors, which makes a fixed number of queries regardless of
+the number of add-ons.
+
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from hipchat import serialization
+
+CACHE_KEY_MASK = "hipchat-descriptor:{app_id}:{generation}"
+GENERATION_KEY_MASK = "hipchat-descriptor-generation:{app_id}"
+
+
+def cache_timeout():
+    """Return the number of seconds for which descriptors are cached."""
+    return getattr(settings, 'HIPCHAT_DESCRIPTOR_CACHE_TIMEOUT', 300)
+
+
+def generation_key(app_id):
+    """Return the cache key for an add-on's current descriptor generation."""
+    return GENERATION_KEY_MASK.format(app_id=app_id)
+
+
+def get_generation(app_id):
+    """Return the current descriptor generation for an add-on."""
+    key = generation_key(app_id)
+    generation = cache.get(key)
+    if generation is None:
+        # add, rather than set, so that concurrent requests agree
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def cache_key(app_id):
+    """Return the cache key for an add-on descriptor (current generation)."""
+    return CACHE_KEY_MASK.format(app_id=app_id, generation=get_generation(app_id))
+
+
+def serialize(descriptor):
+    """Return 2-tuple of (JSON, ETag) for a descriptor dict."""
+    content = serialization.dumps(descriptor)
+    etag = '"%s"' % hashlib.md5(content).hexdigest()
+    return content, etag
+
+
+def get_serialized_descriptor(app_id, base_url=None):
+    """Return the serialized descriptor for an add-on, using the cache.
+
+    The cache entry for an add-on is a dict of serialized descriptors
+    keyed on the base URL, so that sites served on multiple domains (see
+    models.get_base_url) share a single entry, and a single invalidation.
+
+    Kwargs:
+        base_url: string, the scheme and domain used for callback URLs,
+            defaults to the value returned by models.get_base_url().
+
+    Returns a 2-tuple of (JSON, ETag). Raises Addon.DoesNotExist if the
+    add-on cannot be found.
+
+    """
+    # avoid circular import
+    from hipchat.models import Addon, get_base_url
+    base_url = base_url or get_base_url()
+    key = cache_key(app_id)
+    cached = cache.get(key) or {}
+    if base_url not in cached:
+        descriptor = Addon.objects.get(id=app_id).descriptor(base_url=base_url)
+        cached[base_url] = serialize(descriptor)
+        cache.set(key, cached, cache_timeout())
+    return cached[base_url]
+
+
+def _new_generations(app_ids):
+    cache.set_many({generation_key(app_id): uuid.uuid4().hex for app_id in app_ids}, None)
+
+
+def invalidate(*app_ids):
+    """Invalidate cached descriptors for the given add-ons.
+
+    The generation is replaced now, and again when the current transaction
+    commits (if the Django version supports transaction.on_commit).
+
+    """
+    if not app_ids:
+        return
+    _new_generations(app_ids)
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is not None:
+        on_commit(lambda: _new_generations(app_ids))
+
+
+def invalidate_all():
+    """Remove all cached descriptors."""
+    from hipchat.models import Addon
+    invalidate(*Addon.objects.values_list('id', flat=True))
+
+
+def iter_descriptors(queryset=None, base_url=None):
+    """Yield (addon, descriptor) 2-tuples for many add-ons.
+
+    Scopes, glances and webhooks are prefetched, and the base URL is
+    resolved once, so this makes the same number of queries however many
+    add-ons there are (add-ons, scopes, glances, webhooks and - if
+    base_url is None - Site).
+
+    Kwargs:
+        queryset: an Addon queryset, defaults to all add-ons.
+        base_url: string, the scheme and domain used for callback URLs,
+            defaults to the value returned by models.get_base_url().
+
+    """
+    from hipchat.models import Addon, get_base_url
+    if queryset is None:
+        queryset = Addon.objects.all()
+    base_url = base_url or get_base_url()
+    for addon in queryset.order_by('id').prefetch_related('scopes', 'glances', 'webhooks'):
+        yield addon, addon.descriptor(base_url=base_url)
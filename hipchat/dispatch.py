@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""Dispatch backends for outbound HipChat API calls.
+
+Messages (send_room_message, send_user_message, the LogHandler) and
+glance pushes are sent via the backend configured by the
+HIPCHAT_DISPATCH_BACKEND setting, which lets each deployment choose its
+own latency / durability trade-off:
+
+    hipchat.dispatch.SyncBackend (default)
+        Calls are made inline - the caller waits for the response, and
+        any HipChatError is raised to the caller.
+
+    hipchat.dispatch.ThreadPoolBackend
+        Calls are queued in memory and made by a pool of daemon threads.
+        The caller never waits, but queued calls are lost if the process
+        dies, and calls are shed if the queue is full.
+
+    hipchat.dispatch.RQBackend
+        Calls are enqueued as RQ jobs (using django_rq if installed), to
+        be run by an rq worker. Durable, at the cost of running Redis.
+
+Backend kwargs can be set using HIPCHAT_DISPATCH_OPTIONS, e.g.
+
+    HIPCHAT_DISPATCH_BACKEND = 'hipchat.dispatch.ThreadPoolBackend'
+    HIPCHAT_DISPATCH_OPTIONS = {'workers': 2, 'max_queue_size': 500}
+
+Priorities
+----------
+
+Each call has a priority - HIGH, NORMAL or LOW - derived from the message
+colour (see priority_for_color), the log level (priority_for_level), or
+passed explicitly. Queued backends run HIGH priority calls first, and shed
+LOW priority calls first:
+
+    - when the queue is full, a queued call of lower priority is dropped
+      to make room (else the new call is dropped);
+    - when the HipChat rate limit is nearly used up (fewer than
+      HIPCHAT_DISPATCH_RATE_LIMIT_RESERVE requests left in the current
+      period), LOW priority calls are dropped instead of being made.
+
+The RQBackend uses a queue per priority - run the worker with the queues
+in priority order, e.g. `rq worker hipchat-high hipchat hipchat-low`.
+
+"""
+import heapq
+import itertools
+import logging
+import Queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# lower values are higher priority (they sort first)
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+COLOR_PRIORITIES = {
+    'red': HIGH,
+    'gray': LOW,
+}
+
+LEVEL_PRIORITIES = (
+    (logging.ERROR, HIGH),
+    (logging.INFO, NORMAL),
+    (logging.NOTSET, LOW),
+)
+
+
+def priority_for_color(color):
+    """Return the priority of a message of the given colour."""
+    return COLOR_PRIORITIES.get(color, NORMAL)
+
+
+def priority_for_level(levelno):
+    """Return the priority of a log message of the given level."""
+    for level, priority in LEVEL_PRIORITIES:
+        if levelno >= level:
+            return priority
+    return LOW
+
+
+class RateLimitState(object):
+
+    """The most recent HipChat rate limit headers seen by this process."""
+
+    def __init__(self):
+        self.remaining = None
+        self.reset_at = None
+
+    def update(self, response):
+        """Record the rate limit headers from an API response."""
+        headers = getattr(response, 'headers', None) or {}
+        try:
+            remaining = int(headers['X-Ratelimit-Remaining'])
+            reset_at = int(headers['X-Ratelimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            if getattr(response, 'status_code', None) != 429:
+                return
+            remaining, reset_at = 0, int(time.time()) + 1
+        self.remaining, self.reset_at = remaining, reset_at
+
+    def clear(self):
+        self.remaining = self.reset_at = None
+
+    def saturated(self):
+        """Return True if the remaining requests are within the reserve."""
+        if self.remaining is None or self.reset_at <= time.time():
+            return False
+        return self.remaining < getattr(settings, 'HIPCHAT_DISPATCH_RATE_LIMIT_RESERVE', 10)
+
+
+rate_limit = RateLimitState()
+
+
+def perform(func, args, kwargs, priority=NORMAL):
+    """Make a dispatched call, unless it is shed due to the rate limit.
+
+    This runs in the backend's worker (a thread, or an rq worker).
+
+    """
+    if priority >= LOW and rate_limit.saturated():
+        logger.warning("HipChat rate limit nearly reached, dropping call to %s", func)
+        return None
+    return func(*args, **kwargs)
+
+
+class BaseBackend(object):
+
+    """Base class for dispatch backends."""
+
+    def submit(self, func, args=(), kwargs=None, priority=NORMAL):
+        """Call func(*args, **kwargs), now or later."""
+        raise NotImplementedError()
+
+    def dispatch(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) with NORMAL priority."""
+        return self.submit(func, args, kwargs)
+
+
+class SyncBackend(BaseBackend):
+
+    """Call the function immediately, returning its result."""
+
+    def submit(self, func, args=(), kwargs=None, priority=NORMAL):
+        return func(*args, **(kwargs or {}))
+
+
+class SheddingPriorityQueue(Queue.PriorityQueue):
+
+    """Bounded priority queue that sheds the lowest priority item when full.
+
+    Items are (priority, sequence, ...) tuples, so the 'largest' item is
+    the most recent of the lowest priority.
+
+    """
+
+    def offer(self, item):
+        """Add an item without blocking.
+
+        If the queue is full, the largest item is removed to make room if
+        it is of lower priority than the new item. Returns 2-tuple of
+        (queued, shed), where shed is the removed item (or None).
+
+        """
+        with self.not_full:
+            shed = None
+            if 0 < self.maxsize <= self._qsize():
+                worst = max(self.queue)
+                if worst[0] <= item[0]:
+                    return False, None
+                self.queue.remove(worst)
+                heapq.heapify(self.queue)
+                self.unfinished_tasks -= 1
+                shed = worst
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return True, shed
+
+
+class ThreadPoolBackend(BaseBackend):
+
+    """Queue calls in memory, to be made by a pool of worker threads.
+
+    Kwargs:
+        workers: int, the number of worker threads.
+        max_queue_size: int, the max number of queued calls - see the
+            module docstring for how calls are shed when it is full.
+
+    """
+
+    def __init__(self, workers=4, max_queue_size=1000):
+        self.num_workers = workers
+        self.queue = SheddingPriorityQueue(maxsize=max_queue_size)
+        self.threads = []
+        self.sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads (called on first dispatch)."""
+        with self._lock:
+            if self.threads:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(
+                    target=self.worker,
+                    name="hipchat-dispatch-%s" % i
+                )
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, func, args=(), kwargs=None, priority=NORMAL):
+        if not self.threads:
+            self.start()
+        item = (priority, next(self.sequence), func, args, kwargs or {})
+        queued, shed = self.queue.offer(item)
+        if shed is not None:
+            logger.warning("HipChat dispatch queue is full, dropping call to %s", shed[2])
+        if not queued:
+            logger.warning("HipChat dispatch queue is full, dropping call to %s", func)
+        return queued
+
+    def worker(self):
+        while True:
+            priority, _, func, args, kwargs = self.queue.get()
+            try:
+                perform(func, args, kwargs, priority)
+            except Exception:
+                logger.exception("Error dispatching call to %s", func)
+            finally:
+                # each thread has its own connection, which must be closed.
+                connection.close()
+                self.queue.task_done()
+
+    def join(self):
+        """Block until all queued calls have been made."""
+        self.queue.join()
+
+
+class RQBackend(BaseBackend):
+
+    """Enqueue calls as RQ jobs, on a queue per priority.
+
+    Kwargs:
+        queue_name: string, the name of the NORMAL priority queue - the
+            HIGH and LOW queues have '-high' and '-low' suffixes.
+        queue: the queue(s) to use - either an object with the rq.Queue
+            enqueue_call method (used for all priorities), or the dotted
+            path to a class that is instantiated with each queue name
+            (e.g. the fake queue in hipchat.testing). If None,
+            django_rq.get_queue is used if django_rq is installed, else
+            rq.Queue connected to the HIPCHAT_REDIS_URL setting.
+        max_low_queue_size: int, LOW priority calls are dropped if the
+            LOW queue has this many jobs waiting (None for no limit).
+
+    """
+
+    def __init__(self, queue_name='hipchat', queue=None, max_low_queue_size=None):
+        self.queue_names = {
+            HIGH: queue_name + '-high',
+            NORMAL: queue_name,
+            LOW: queue_name + '-low',
+        }
+        if isinstance(queue, basestring):
+            queue = import_string(queue)
+        self.queue_factory = queue if isinstance(queue, type) else None
+        self.max_low_queue_size = max_low_queue_size
+        self._queues = {}
+        if queue is not None and self.queue_factory is None:
+            self._queues = {priority: queue for priority in self.queue_names}
+
+    @property
+    def queue(self):
+        """The NORMAL priority queue."""
+        return self.get_queue(NORMAL)
+
+    def get_queue(self, priority):
+        if priority not in self._queues:
+            name = self.queue_names[priority]
+            if self.queue_factory is not None:
+                self._queues[priority] = self.queue_factory(name)
+            else:
+                self._queues[priority] = self.get_rq_queue(name)
+        return self._queues[priority]
+
+    def get_rq_queue(self, name):
+        try:
+            import django_rq
+        except ImportError:
+            from redis import StrictRedis
+            from rq import Queue as RQueue
+            url = getattr(settings, 'HIPCHAT_REDIS_URL', 'redis://localhost:6379/0')
+            return RQueue(name, connection=StrictRedis.from_url(url))
+        return django_rq.get_queue(name)
+
+    def submit(self, func, args=(), kwargs=None, priority=NORMAL):
+        queue = self.get_queue(priority)
+        if (
+            priority >= LOW and
+            self.max_low_queue_size is not None and
+            queue.count >= self.max_low_queue_size
+        ):
+            logger.warning("HipChat low priority queue is full, dropping call to %s", func)
+            return None
+        # the job is wrapped in perform, so that LOW priority calls can be
+        # shed by the worker if the rate limit is saturated.
+        return queue.enqueue_call(
+            perform,
+            args=(func, args, kwargs or {}),
+            kwargs={'priority': priority}
+        )
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured dispatch backend (a process-wide instance)."""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'HIPCHAT_DISPATCH_BACKEND', 'hipchat.dispatch.SyncBackend')
+        options = getattr(settings, 'HIPCHAT_DISPATCH_OPTIONS', {})
+        _backend = import_string(path)(**options)
+    return _backend
+
+
+def reset_backend():
+    """Discard the current backend, so that it is recreated on next use."""
+    global _backend
+    _backend = None
+
+
+def submit(func, args=(), kwargs=None, priority=NORMAL):
+    """Call func(*args, **kwargs) with a priority, using the configured backend."""
+    return get_backend().submit(func, args, kwargs, priority=priority)
+
+
+def dispatch(func, *args, **kwargs):
+    """Call func(*args, **kwargs) using the configured backend."""
+    return get_backend().dispatch(func, *args, **kwargs)
@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from hipchat.notifications import send_room_message
-
 
 class LogHandler(logging.Handler):
 
@@ -30,8 +28,8 @@ class LogHandler(logging.Handler):
             color (optional): sets the background color of the message in the HipChat window
             colors (optional): a dict of level:color pairs (e.g. {'DEBUG:'red'} used to
                 override the default color)
-            async (optional): if True, then writes will be queued using Redis (
-                defaults to False.)
+            async (optional): ignored - messages are sent using the dispatch
+                backend set by HIPCHAT_DISPATCH_BACKEND (see hipchat.dispatch).
 
         """
         logging.Handler.__init__(self)
@@ -46,6 +44,10 @@ class LogHandler(logging.Handler):
 
     def emit(self, record):
         """Send the record info to HipChat."""
+        # imported here, so that configuring logging doesn't import the
+        # dispatch / API stack (and Django settings) - see benchmarks/imports.py
+        from hipchat.dispatch import priority_for_level
+        from hipchat.notifications import send_room_message
         assert self.token is not None, u"HipChat logger must have a token configured."
         send_room_message(
             self.room,
@@ -54,5 +56,6 @@ class LogHandler(logging.Handler):
             color=self.colors.get(record.levelname, self.color),
             sender=self.sender,
             notify=self.notify,
-            message_format='html'
+            message_format='html',
+            priority=priority_for_level(record.levelno)
         )
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Export add-on descriptors as JSON."""
+import json
+from optparse import make_option
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from hipchat.descriptors import iter_descriptors
+from hipchat.models import Addon
+
+
+class Command(BaseCommand):
+
+    """Write add-on descriptors as NDJSON, or as one JSON file per add-on.
+
+    Descriptors are streamed as they are built, and the number of DB queries
+    is independent of the number of add-ons.
+
+    """
+
+    help = "Export add-on descriptors as JSON."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--addon',
+            action='append',
+            dest='keys',
+            default=[],
+            help="Key of the add-on to export (defaults to all)."
+        ),
+        make_option(
+            '--output-dir',
+            dest='output_dir',
+            default=None,
+            help="Write one '<key>.json' file per add-on into this directory, "
+                 "instead of NDJSON to stdout."
+        ),
+        make_option(
+            '--base-url',
+            dest='base_url',
+            default=None,
+            help="Scheme and domain used in callback URLs (defaults to the current Site)."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        queryset = Addon.objects.all()
+        if options['keys']:
+            queryset = queryset.filter(key__in=options['keys'])
+        output_dir = options['output_dir']
+        if output_dir and not os.path.isdir(output_dir):
+            raise CommandError("Output directory does not exist: %s" % output_dir)
+
+        count = 0
+        for addon, descriptor in iter_descriptors(queryset, base_url=options['base_url']):
+            if output_dir:
+                path = os.path.join(output_dir, "%s.json" % addon.key)
+                with open(path, 'w') as f:
+                    json.dump(descriptor, f, cls=DjangoJSONEncoder, indent=4)
+            else:
+                self.stdout.write(json.dumps(descriptor, cls=DjangoJSONEncoder))
+            count += 1
+        if output_dir:
+            self.stdout.write("Exported %s descriptors to %s" % (count, output_dir))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Export GlanceUpdate history as NDJSON or CSV."""
+import csv
+import datetime
+import gzip
+from optparse import make_option
+import os
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from hipchat import serialization
+from hipchat.models import GlanceUpdate
+
+# exported columns - GlanceUpdate.values() lookups
+FIELDS = (
+    'id',
+    'created_at',
+    'glance_id',
+    'glance__key',
+    'glance__app__key',
+    'label_value',
+    'lozenge_type',
+    'lozenge_value',
+    'icon_url',
+    'icon_url2',
+    'metadata',
+)
+FORMATS = ('ndjson', 'csv')
+
+
+def parse_timestamp(value):
+    """Parse a --since / --until value as a datetime."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError("Invalid date / datetime: %s" % value)
+        parsed = datetime.datetime.combine(date, datetime.time())
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+
+def state_path(path):
+    """Return the path of the file recording the last exported id."""
+    return path + '.last_id'
+
+
+def read_last_id(path):
+    """Return the last exported id recorded for an output file, or 0."""
+    try:
+        with open(state_path(path)) as f:
+            return int(f.read().strip() or 0)
+    except IOError:
+        return 0
+
+
+def write_last_id(path, last_id):
+    """Record the last exported id for an output file."""
+    with open(state_path(path), 'w') as f:
+        f.write(str(last_id))
+
+
+def format_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+class Command(BaseCommand):
+
+    """Stream GlanceUpdate history to stdout, or a (gzipped) file.
+
+    The table is read in keyset-paginated chunks (id > last id, ordered by
+    id), using values() and iterator(), and each chunk is written (and
+    flushed) before the next is read - so memory use is independent of
+    the size of the table, and no chunk query gets slower as the export
+    progresses (unlike OFFSET pagination).
+
+    Output files whose name ends '.gz' are gzip-compressed. After each
+    chunk the last exported id is recorded in '<output>.last_id', and
+    --resume appends to the file from that id - so an interrupted export
+    can be continued (rows in a chunk that was written, but not recorded,
+    are exported again).
+
+    """
+
+    help = "Export GlanceUpdate history as NDJSON or CSV."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--format',
+            dest='format',
+            default='ndjson',
+            help="Output format, one of %s (default ndjson)." % ', '.join(FORMATS)
+        ),
+        make_option(
+            '--output',
+            dest='output',
+            default=None,
+            help="File to write to (gzipped if it ends '.gz'), defaults to stdout."
+        ),
+        make_option(
+            '--glance',
+            action='append',
+            type='int',
+            dest='glances',
+            default=[],
+            help="Id of the glance to export updates for (defaults to all)."
+        ),
+        make_option(
+            '--since',
+            dest='since',
+            default=None,
+            help="Only export updates created at or after this date / datetime."
+        ),
+        make_option(
+            '--until',
+            dest='until',
+            default=None,
+            help="Only export updates created before this date / datetime."
+        ),
+        make_option(
+            '--after-id',
+            type='int',
+            dest='after_id',
+            default=0,
+            help="Only export updates with an id greater than this."
+        ),
+        make_option(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help="Append to --output, continuing from the last exported id."
+        ),
+        make_option(
+            '--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=1000,
+            help="Number of rows read (and written) at a time."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        if fmt not in FORMATS:
+            raise CommandError("Invalid format: %s" % fmt)
+        if options['chunk_size'] < 1:
+            raise CommandError("Chunk size must be positive.")
+        path = options['output']
+        if options['resume'] and path is None:
+            raise CommandError("--resume requires --output.")
+
+        queryset = GlanceUpdate.objects.all()
+        if options['glances']:
+            queryset = queryset.filter(glance_id__in=options['glances'])
+        if options['since']:
+            queryset = queryset.filter(created_at__gte=parse_timestamp(options['since']))
+        if options['until']:
+            queryset = queryset.filter(created_at__lt=parse_timestamp(options['until']))
+
+        last_id = options['after_id']
+        append = False
+        if options['resume']:
+            last_id = max(last_id, read_last_id(path))
+            append = os.path.exists(path) and os.path.getsize(path) > 0
+
+        if path is None:
+            out = None
+        elif path.endswith('.gz'):
+            out = gzip.open(path, 'ab' if append else 'wb')
+        else:
+            out = open(path, 'ab' if append else 'wb')
+
+        count = 0
+        try:
+            if fmt == 'csv' and not append:
+                self.write(out, self.format_csv([FIELDS]))
+            for rows in self.chunks(queryset, last_id, options['chunk_size']):
+                if fmt == 'csv':
+                    data = self.format_csv([[row[f] for f in FIELDS] for row in rows])
+                else:
+                    data = self.format_ndjson(rows)
+                self.write(out, data)
+                count += len(rows)
+                last_id = rows[-1]['id']
+                if path is not None:
+                    write_last_id(path, last_id)
+        finally:
+            if out is not None:
+                out.close()
+        if path is not None:
+            self.stdout.write("Exported %s glance updates to %s (last id %s)" % (count, path, last_id))
+
+    def chunks(self, queryset, last_id, chunk_size):
+        """Yield lists of row dicts, using keyset pagination on id."""
+        while True:
+            rows = [
+                {key: format_value(value) for key, value in row.iteritems()}
+                for row in (
+                    queryset
+                    .filter(id__gt=last_id)
+                    .order_by('id')
+                    .values(*FIELDS)[:chunk_size]
+                    .iterator()
+                )
+            ]
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1]['id']
+
+    def format_ndjson(self, rows):
+        return ''.join(serialization.dumps(row) + '\n' for row in rows)
+
+    def format_csv(self, rows):
+        buf = StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow([
+                v.encode('utf-8') if isinstance(v, unicode) else v for v in row
+            ])
+        return buf.getvalue()
+
+    def write(self, out, data):
+        """Write, and flush, a chunk of output."""
+        if out is None:
+            self.stdout.write(data, ending='')
+        else:
+            out.write(data)
+        (out or self.stdout).flush()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Report timings for the initialise_glance signal receivers."""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hipchat import profiling
+from hipchat import signals
+from hipchat.models import Glance, GlanceUpdate
+
+
+class Command(BaseCommand):
+
+    """Dispatch the initialise_glance signal and report receiver timings.
+
+    Receiver stats are held in-process, so this command cannot report
+    the stats collected by the running server (use profiling.receiver_stats
+    in that process for those). Instead it exercises the receivers itself -
+    sending the signal for each glance the requested number of times - and
+    then prints out the per-receiver percentiles.
+
+    NB the receivers are the live ones, so any calls they make to their
+    data providers (and any side effects) happen for real.
+
+    """
+
+    help = (
+        "Time the initialise_glance signal receivers, by sending the signal "
+        "for each glance --iterations times in this process (it does not read "
+        "the running server's stats). WARNING: this calls the live receivers, "
+        "including any provider calls and side effects they make."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--glance',
+            action='append',
+            dest='glances',
+            default=[],
+            help="Id of the glance to send the signal for (defaults to all)."
+        ),
+        make_option(
+            '--iterations',
+            type='int',
+            dest='iterations',
+            default=10,
+            help="Number of times to send the signal for each glance."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        glances = Glance.objects.all()
+        if options['glances']:
+            glances = glances.filter(id__in=options['glances'])
+        glances = list(glances)
+        if not glances:
+            raise CommandError("No glances found.")
+
+        self.stderr.write(
+            "Warning: calling the live initialise_glance receivers %s times "
+            "for each of %s glances." % (options['iterations'], len(glances))
+        )
+        profiling.reset_stats()
+        for glance in glances:
+            for _ in range(options['iterations']):
+                try:
+                    profiling.send_timed(
+                        signals.initialise_glance,
+                        GlanceUpdate,
+                        sender=None,
+                        glance=glance
+                    )
+                except Exception as ex:
+                    self.stderr.write("Receiver error: %r" % ex)
+
+        self.stdout.write(
+            "%-60s %6s %6s %6s %9s %9s %9s" %
+            ('receiver', 'calls', 'update', 'errors', 'p50 (ms)', 'p95 (ms)', 'max (ms)')
+        )
+        for stats in profiling.receiver_stats():
+            self.stdout.write(
+                "%-60s %6s %6s %6s %9.2f %9.2f %9.2f" % (
+                    stats['receiver'],
+                    stats['calls'],
+                    stats['updates'],
+                    stats['errors'],
+                    stats['p50'] * 1000,
+                    stats['p95'] * 1000,
+                    stats['max'] * 1000,
+                )
+            )
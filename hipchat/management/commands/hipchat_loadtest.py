@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""Concurrent load test for the HipChat callback views."""
+from collections import defaultdict
+import itertools
+import json
+import logging
+from optparse import make_option
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from timeit import default_timer
+
+import jwt
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from hipchat import models
+from hipchat import views
+from hipchat.profiling import percentile
+from hipchat.testing import FakeHipChatServer
+
+VIEWS = ('glance', 'descriptor', 'install', 'delete')
+DEFAULT_MIX = 'glance=80,descriptor=10,install=5,delete=5'
+
+
+def parse_mix(mix):
+    """Parse a 'view=weight,...' string into a dict of weights."""
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in VIEWS:
+            raise CommandError("Invalid view in request mix: %s" % name)
+        try:
+            weights[name] = int(weight)
+        except ValueError:
+            raise CommandError("Invalid weight in request mix: %s" % item)
+    if sum(weights.values()) <= 0:
+        raise CommandError("Request mix weights must be positive.")
+    return weights
+
+
+class LoadTest(object):
+
+    """Drives the views from a pool of threads, recording timings."""
+
+    def __init__(self, num_installs=10):
+        self.factory = RequestFactory()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.results = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.app = models.Addon(key="loadtest").save()
+        self.app.scopes.add(*models.Scope.objects.all()[:3])
+        self.glance = models.Glance(app=self.app, key="loadtest").save()
+        self.installs = [self.create_install() for _ in range(num_installs)]
+        # installs created by the 'install' requests, used by 'delete'
+        self.deletable = []
+
+    def create_install(self):
+        return models.Install(
+            app=self.app,
+            oauth_id=self.next_oauth_id(),
+            oauth_secret="secret",
+            group_id=1
+        ).save()
+
+    def next_oauth_id(self):
+        return "load-%s" % next(self.sequence)
+
+    def signed_request(self, install):
+        return jwt.encode(
+            {'iss': install.oauth_id, 'exp': int(time.time()) + 3600},
+            install.oauth_secret
+        )
+
+    def request_glance(self):
+        install = random.choice(self.installs)
+        request = self.factory.get('/', {'signed_request': self.signed_request(install)})
+        return views.glance(request, glance_id=self.glance.id)
+
+    def request_descriptor(self):
+        return views.descriptor(self.factory.get('/'), app_id=self.app.id)
+
+    def request_install(self):
+        oauth_id = self.next_oauth_id()
+        data = {
+            "capabilitiesUrl": "https://api.hipchat.com/v2/capabilities",
+            "oauthId": oauth_id,
+            "oauthSecret": "secret",
+            "groupId": 1,
+        }
+        request = self.factory.post('/', json.dumps(data), content_type='application/json')
+        response = views.install(request, app_id=self.app.id)
+        with self.lock:
+            self.deletable.append(oauth_id)
+        return response
+
+    def request_delete(self):
+        with self.lock:
+            oauth_id = self.deletable.pop() if self.deletable else None
+        if oauth_id is None:
+            return self.request_install()
+        request = self.factory.delete('/')
+        return views.delete(request, app_id=self.app.id, oauth_id=oauth_id)
+
+    def run_one(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            start = default_timer()
+            try:
+                response = getattr(self, 'request_%s' % name)()
+                failed = response.status_code >= 400 and response.status_code != 422
+            except Exception:
+                failed = True
+            duration = default_timer() - start
+        with self.lock:
+            self.results[name].append((duration, len(queries)))
+            if failed:
+                self.errors[name] += 1
+
+    def worker(self, schedule):
+        try:
+            while True:
+                with self.lock:
+                    if not schedule:
+                        return
+                    name = schedule.pop()
+                self.run_one(name)
+        finally:
+            connection.close()
+
+    def run(self, num_requests, concurrency, weights):
+        names = list(weights.keys())
+        schedule = [
+            self.choose(names, weights) for _ in range(num_requests)
+        ]
+        threads = [
+            threading.Thread(target=self.worker, args=(schedule,))
+            for _ in range(concurrency)
+        ]
+        start = default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return default_timer() - start
+
+    def choose(self, names, weights):
+        point = random.uniform(0, sum(weights.values()))
+        for name in names:
+            point -= weights[name]
+            if point <= 0:
+                return name
+        return names[-1]
+
+    def summary(self, elapsed):
+        rows = []
+        for name in VIEWS:
+            results = self.results.get(name)
+            if not results:
+                continue
+            timings = sorted(r[0] * 1000 for r in results)
+            rows.append({
+                'view': name,
+                'requests': len(results),
+                'errors': self.errors[name],
+                'p50_ms': percentile(timings, 50),
+                'p95_ms': percentile(timings, 95),
+                'p99_ms': percentile(timings, 99),
+                'queries_per_request': sum(r[1] for r in results) / float(len(results)),
+            })
+        total = sum(r['requests'] for r in rows)
+        return {
+            'elapsed_s': elapsed,
+            'requests': total,
+            'throughput_rps': total / elapsed if elapsed else None,
+            'views': rows
+        }
+
+
+class Command(BaseCommand):
+
+    """Load test the install, delete, glance and descriptor views.
+
+    The views are called in-process (using RequestFactory) from a pool of
+    threads, against a throwaway test database and a fake HipChat API (see
+    hipchat.testing), so this is safe to run anywhere. Glance requests are
+    signed with valid JWT tokens for a set of fixture installs.
+
+    """
+
+    help = "Load test the HipChat callback views."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--requests',
+            type='int',
+            dest='requests',
+            default=1000,
+            help="Total number of requests to make."
+        ),
+        make_option(
+            '--concurrency',
+            type='int',
+            dest='concurrency',
+            default=4,
+            help="Number of concurrent worker threads."
+        ),
+        make_option(
+            '--mix',
+            dest='mix',
+            default=DEFAULT_MIX,
+            help="Request mix as view=weight pairs (default '%s')." % DEFAULT_MIX
+        ),
+        make_option(
+            '--installs',
+            type='int',
+            dest='installs',
+            default=10,
+            help="Number of fixture installs used to sign glance requests."
+        ),
+        make_option(
+            '--json',
+            action='store_true',
+            dest='json',
+            default=False,
+            help="Output the results as JSON."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        weights = parse_mix(options['mix'])
+        if options['concurrency'] < 1:
+            raise CommandError("Concurrency must be at least 1.")
+
+        # debug logging is disabled in production, and would skew the results
+        logging.disable(logging.INFO)
+        test_db = self.create_test_db()
+        try:
+            with FakeHipChatServer() as server:
+                with override_settings(HIPCHAT_API_ROOT=server.url, DEBUG=False):
+                    loadtest = LoadTest(num_installs=options['installs'])
+                    elapsed = loadtest.run(
+                        options['requests'], options['concurrency'], weights
+                    )
+        finally:
+            self.destroy_test_db(test_db)
+            logging.disable(logging.NOTSET)
+
+        summary = loadtest.summary(elapsed)
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=4, sort_keys=True))
+        else:
+            self.write_summary(summary)
+
+    def create_test_db(self):
+        """Create a throwaway database - file-based for sqlite, so threads share it."""
+        if connection.vendor == 'sqlite':
+            path = os.path.join(tempfile.mkdtemp(), 'hipchat_loadtest.sqlite3')
+            connection.settings_dict['TEST']['NAME'] = path
+        return connection.creation.create_test_db(verbosity=0, serialize=False)
+
+    def destroy_test_db(self, old_name):
+        test_name = connection.settings_dict['NAME']
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if connection.vendor == 'sqlite':
+            shutil.rmtree(os.path.dirname(test_name), ignore_errors=True)
+
+    def write_summary(self, summary):
+        self.stdout.write(
+            "%s requests in %.2fs (%.1f requests/sec)" %
+            (summary['requests'], summary['elapsed_s'], summary['throughput_rps'])
+        )
+        self.stdout.write(
+            "%-12s %8s %6s %9s %9s %9s %8s" %
+            ('view', 'requests', 'errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'queries')
+        )
+        for row in summary['views']:
+            self.stdout.write(
+                "%-12s %8s %6s %9.2f %9.2f %9.2f %8.1f" % (
+                    row['view'],
+                    row['requests'],
+                    row['errors'],
+                    row['p50_ms'],
+                    row['p95_ms'],
+                    row['p99_ms'],
+                    row['queries_per_request'],
+                )
+            )
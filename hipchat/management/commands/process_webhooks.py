@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Process pending webhook events."""
+from optparse import make_option
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from hipchat import webhooks
+from hipchat.models import WebhookEvent
+
+
+class Command(BaseCommand):
+
+    """Send pending webhook events to the webhook_events receivers.
+
+    Events are normally processed in the background as they arrive (see
+    hipchat.webhooks) - this command picks up any that were left pending,
+    or left 'processing' by a process that died, and can retry failed
+    events. It is safe to run from cron: it exits if a processing task
+    already holds the scheduled marker, and events are claimed before
+    they are sent, so no event is sent twice.
+
+    """
+
+    help = "Process pending webhook events."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--retry-failed',
+            action='store_true',
+            dest='retry_failed',
+            default=False,
+            help="Mark failed events as pending, so that they are processed again."
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            dest='batch_size',
+            default=None,
+            help="Number of events per batch (defaults to HIPCHAT_WEBHOOK_BATCH_SIZE)."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if not cache.add(webhooks.SCHEDULED_CACHE_KEY, True, webhooks.schedule_timeout()):
+            self.stdout.write("Webhook events are already being processed")
+            return
+        released = webhooks.release_stale()
+        if released:
+            self.stdout.write("Released %s stale webhook events" % released)
+        if options['retry_failed']:
+            WebhookEvent.objects.filter(status=WebhookEvent.STATUS_FAILED).update(
+                status=WebhookEvent.STATUS_PENDING, claim='', processed_at=None
+            )
+        # process_events clears the marker when it has finished
+        count = webhooks.process_events(limit=options['batch_size'])
+        self.stdout.write("Processed %s webhook events" % count)
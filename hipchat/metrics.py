@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""Metrics for outbound calls to the HipChat API.
+
+All outbound HTTP calls (notifications, glance pushes, token requests)
+report into this module, which records per-endpoint latency histograms,
+response status counts and cache hit / miss counts.
+
+Metrics are sent to a pluggable backend, configured in settings:
+
+    HIPCHAT_METRICS_BACKEND - dotted path to the backend class, defaults
+        to 'hipchat.metrics.InMemoryBackend'. Set to None to disable.
+    HIPCHAT_STATSD_HOST / HIPCHAT_STATSD_PORT / HIPCHAT_STATSD_PREFIX -
+        used by the StatsdBackend.
+    HIPCHAT_METRICS_VIEW_ENABLED - if True, the in-memory metrics are
+        exposed in the Prometheus text format by views.metrics.
+
+>>> from hipchat import metrics
+>>> metrics.get_backend().render()
+'# TYPE hipchat_api_request_duration_seconds histogram\\n...'
+
+"""
+from collections import defaultdict
+import logging
+import socket
+import threading
+from timeit import default_timer
+from urlparse import urlparse
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# metric names
+REQUEST_DURATION = 'hipchat_api_request_duration_seconds'
+RESPONSES = 'hipchat_api_responses_total'
+CACHE_REQUESTS = 'hipchat_cache_requests_total'
+
+# histogram buckets (seconds), as per the Prometheus client defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class BaseBackend(object):
+
+    """Interface for metrics backends."""
+
+    def timing(self, name, value, **labels):
+        """Record a duration (in seconds)."""
+        raise NotImplementedError()
+
+    def increment(self, name, value=1, **labels):
+        """Increment a counter."""
+        raise NotImplementedError()
+
+
+class NullBackend(BaseBackend):
+
+    """Backend that discards all metrics."""
+
+    def timing(self, name, value, **labels):
+        pass
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+
+class Histogram(object):
+
+    """Cumulative bucketed histogram, as used by Prometheus."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _format_labels(labels, **extra):
+    """Format a label tuple as Prometheus label text."""
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, unicode(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in items
+    )
+
+
+class InMemoryBackend(BaseBackend):
+
+    """Backend that holds metrics in process memory.
+
+    This is the default backend - it can be rendered in the Prometheus
+    text exposition format (see views.metrics), and is useful in tests.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(dict)
+        self.counters = defaultdict(dict)
+
+    def timing(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms[name].get(key)
+            if histogram is None:
+                histogram = self.histograms[name][key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.counters[name][key] = self.counters[name].get(key, 0) + value
+
+    def get_counter(self, name, **labels):
+        """Return the current value of a counter."""
+        return self.counters[name].get(tuple(sorted(labels.items())), 0)
+
+    def get_histogram(self, name, **labels):
+        """Return a Histogram, or None if nothing has been recorded."""
+        return self.histograms[name].get(tuple(sorted(labels.items())))
+
+    def reset(self):
+        """Clear all recorded metrics."""
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self.histograms):
+                lines.append('# TYPE %s histogram' % name)
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('%s_bucket%s %s' % (
+                            name, _format_labels(labels, le=bound), count
+                        ))
+                    lines.append('%s_bucket%s %s' % (
+                        name, _format_labels(labels, le='+Inf'), histogram.count
+                    ))
+                    lines.append('%s_sum%s %s' % (name, _format_labels(labels), histogram.sum))
+                    lines.append('%s_count%s %s' % (name, _format_labels(labels), histogram.count))
+            for name in sorted(self.counters):
+                lines.append('# TYPE %s counter' % name)
+                for labels, value in sorted(self.counters[name].items()):
+                    lines.append('%s%s %s' % (name, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdBackend(BaseBackend):
+
+    """Backend that sends metrics to statsd over UDP.
+
+    Labels are appended to the metric name, as statsd has no concept of
+    tags, e.g. 'hipchat.hipchat_api_responses_total.room_id_notification.200'.
+
+    """
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (
+            host or getattr(settings, 'HIPCHAT_STATSD_HOST', 'localhost'),
+            port or getattr(settings, 'HIPCHAT_STATSD_PORT', 8125)
+        )
+        self.prefix = prefix or getattr(settings, 'HIPCHAT_STATSD_PREFIX', 'hipchat')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def metric_name(self, name, labels):
+        parts = [self.prefix, name]
+        for _, value in sorted(labels.items()):
+            parts.append(
+                ''.join(c if c.isalnum() else '_' for c in unicode(value)).strip('_')
+            )
+        return '.'.join(parts)
+
+    def send(self, data):
+        try:
+            self.socket.sendto(data.encode('utf-8'), self.address)
+        except socket.error:
+            logger.debug("Unable to send metric to statsd: %s", data)
+
+    def timing(self, name, value, **labels):
+        self.send('%s:%d|ms' % (self.metric_name(name, labels), value * 1000))
+
+    def increment(self, name, value=1, **labels):
+        self.send('%s:%s|c' % (self.metric_name(name, labels), value))
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured metrics backend (a process-wide instance)."""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'HIPCHAT_METRICS_BACKEND', 'hipchat.metrics.InMemoryBackend')
+        _backend = import_string(path)() if path else NullBackend()
+    return _backend
+
+
+def reset_backend():
+    """Discard the current backend, so that it is recreated on next use."""
+    global _backend
+    _backend = None
+
+
+def endpoint_name(url):
+    """Return a low-cardinality endpoint label for an API URL.
+
+    Room and user ids / names are replaced with '{id}', so that
+    'https://api.hipchat.com/v2/room/123/notification' becomes
+    'room/{id}/notification'.
+
+    """
+    parts = urlparse(url).path.strip('/').split('/')
+    if parts and parts[0] == 'v2':
+        parts = parts[1:]
+    for i in range(1, len(parts)):
+        if parts[i - 1] in ('room', 'user'):
+            parts[i] = '{id}'
+    return '/'.join(parts)
+
+
+def record_request(endpoint, duration, status):
+    """Record the latency and response status of an API request."""
+    backend = get_backend()
+    backend.timing(REQUEST_DURATION, duration, endpoint=endpoint)
+    backend.increment(RESPONSES, endpoint=endpoint, status=status)
+
+
+def record_cache(cache_name, hit):
+    """Record a cache lookup as a hit or miss."""
+    get_backend().increment(CACHE_REQUESTS, cache=cache_name, result='hit' if hit else 'miss')
+
+
+def timed_request(url, func, *args, **kwargs):
+    """Call func(url, *args, **kwargs) and record latency and status.
+
+    The status is the response status_code, or 'error' if the call
+    raised an exception (e.g. a connection error), which is re-raised.
+
+    """
+    endpoint = endpoint_name(url)
+    start = default_timer()
+    try:
+        response = func(url, *args, **kwargs)
+    except Exception:
+        record_request(endpoint, default_timer() - start, 'error')
+        raise
+    record_request(endpoint, default_timer() - start, response.status_code)
+    return response
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hipchat', '0008_auto_20151221_1552'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='install',
+            name='capabilities',
+            field=models.TextField(help_text=b'JSON fetched from the capabilities_url (if enabled).', blank=True),
+        ),
+        migrations.AddField(
+            model_name='install',
+            name='capabilities_url',
+            field=models.URLField(help_text=b'Value returned from the app install postback.', blank=True),
+        ),
+        migrations.AddField(
+            model_name='install',
+            name='token_status',
+            field=models.CharField(default=b'pending', help_text=b'Status of the post-install access token request.', max_length=10, choices=[(b'pending', b'Pending'), (b'acquired', b'Acquired'), (b'failed', b'Failed')]),
+        ),
+        migrations.AddField(
+            model_name='install',
+            name='token_status_at',
+            field=models.DateTimeField(help_text=b'Set when the token_status is updated.', null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='install',
+            name='token_status_message',
+            field=models.CharField(help_text=b'Error message if the access token request failed.', max_length=200, blank=True),
+        ),
+    ]
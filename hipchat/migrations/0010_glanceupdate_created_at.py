@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hipchat', '0009_install_token_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='glanceupdate',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text=b'Set when the update is created.', db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='glanceupdate',
+            index_together=set([('glance', 'id')]),
+        ),
+    ]
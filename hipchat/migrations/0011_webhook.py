@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hipchat', '0010_glanceupdate_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Webhook',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('key', models.CharField(help_text=b'Unique key (in the context of the integration) to identify this webhook.', max_length=40)),
+                ('name', models.CharField(help_text=b'The display name of the webhook.', max_length=100, blank=True)),
+                ('event', models.CharField(help_text=b'The room event that triggers the webhook.', max_length=30, choices=[(b'room_archived', b'room archived'), (b'room_created', b'room created'), (b'room_deleted', b'room deleted'), (b'room_enter', b'user enters room'), (b'room_exit', b'user exits room'), (b'room_file_upload', b'file uploaded to room'), (b'room_message', b'room message'), (b'room_notification', b'room notification'), (b'room_topic_change', b'room topic changed'), (b'room_unarchived', b'room unarchived')])),
+                ('pattern', models.CharField(help_text=b'Regex that room messages must match (room_message events only).', max_length=200, blank=True)),
+                ('app', models.ForeignKey(related_name='webhooks', to='hipchat.Addon', help_text=b'The app this webhook belongs to.')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('oauth_id', models.CharField(help_text=b'The oauthId of the Install that sent the event (the JWT issuer).', max_length=36)),
+                ('payload', models.TextField(help_text=b'The JSON posted by HipChat.')),
+                ('status', models.CharField(default=b'pending', max_length=10, choices=[(b'pending', b'pending'), (b'processed', b'processed'), (b'failed', b'failed')])),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, help_text=b'Set when the event is received.')),
+                ('processed_at', models.DateTimeField(help_text=b'Set when the event is processed (or fails).', null=True, blank=True)),
+                ('webhook', models.ForeignKey(related_name='events', to='hipchat.Webhook', help_text=b'The Webhook that received the event.')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='webhookevent',
+            index_together=set([('status', 'id')]),
+        ),
+    ]
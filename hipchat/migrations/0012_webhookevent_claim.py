@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hipchat', '0011_webhook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='claim',
+            field=models.CharField(help_text=b'Identifies the batch that claimed the event for processing.', max_length=32, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='processed_at',
+            field=models.DateTimeField(help_text=b'Set when the event is claimed for processing, and when it is processed (or fails).', null=True, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='status',
+            field=models.CharField(default=b'pending', max_length=10, choices=[(b'pending', b'pending'), (b'processing', b'processing'), (b'processed', b'processed'), (b'failed', b'failed')]),
+        ),
+    ]
@@ -6,20 +6,27 @@ https://ecosystem.atlassian.net/wiki/display/HIPDEV/Server-side+installation+flo
 """
 from collections import namedtuple
 # import datetime
-import json
 import logging
+from multiprocessing.pool import ThreadPool
+import time
 from urlparse import urljoin
 
-import requests
-from requests.auth import HTTPBasicAuth
-
-from django.db import models
+from django.db import models, connections, transaction, IntegrityError
+from django.db.models.signals import post_save
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
 from django.core.cache import cache
 from django.utils.timezone import now as tz_now
 
+from hipchat import dispatch
+from hipchat import metrics
+from hipchat import resolver
+from hipchat import serialization
+from hipchat.api import HipChatError, api_url, post_json
+from hipchat.caching import BoundedCache
+
+# NB this is fixed at import time - use get_scheme() instead.
 SCHEME = "https://" if getattr(settings, 'USE_SSL', True) else "http://"
 
 logger = logging.getLogger(__name__)
@@ -34,19 +41,73 @@ LOZENGE_NEW = 'new'
 LOZENGE_MOVED = 'moved'
 
 
+# SITE_ID -> the current Site domain, see get_domain()
+domain_cache = BoundedCache(maxsize=10)
+
+# app_id -> space-separated scope names, see Addon.get_scope_string()
+scope_strings_cache = BoundedCache(
+    maxsize=getattr(settings, 'HIPCHAT_SCOPE_CACHE_SIZE', 1000),
+    timeout=getattr(settings, 'HIPCHAT_SCOPE_CACHE_TIMEOUT', 300)
+)
+
+
 def get_domain():
     """Return the current domain as specified in the Sites app.
 
     This has been pulled out into a function to make it easy to mock
-    out in tests.
+    out in tests. The domain is held in process memory for
+    HIPCHAT_DOMAIN_CACHE_TIMEOUT seconds (default 60), so that a change
+    made in another process is picked up within that time. Saving or
+    deleting a Site calls clear_domain_cache, which only reaches the
+    current process.
 
     """
-    return Site.objects.get_current().domain
+    site_id = getattr(settings, 'SITE_ID', None)
+    domain = domain_cache.get(site_id)
+    if domain is None:
+        domain = Site.objects.get_current().domain
+        domain_cache.set(
+            site_id,
+            domain,
+            timeout=getattr(settings, 'HIPCHAT_DOMAIN_CACHE_TIMEOUT', 60)
+        )
+    return domain
+
+
+def clear_domain_cache():
+    """Clear the cached domain used by get_domain() - in this process only."""
+    domain_cache.clear()
+
+
+def get_scheme():
+    """Return the URL scheme, using the USE_SSL setting."""
+    return "https://" if getattr(settings, 'USE_SSL', True) else "http://"
 
 
-def get_full_url(path):
-    """Return the full URL (scheme, domain, path) for a relative path."""
-    return urljoin(SCHEME + get_domain(), path)
+def get_base_url(request=None):
+    """Return the scheme and domain used to build full URLs.
+
+    Kwargs:
+        request: an HttpRequest - if the HIPCHAT_BASE_URL_FROM_REQUEST
+            setting is True, the scheme and host are taken from the
+            request rather than the Sites app (for multi-domain sites).
+
+    """
+    if request is not None and getattr(settings, 'HIPCHAT_BASE_URL_FROM_REQUEST', False):
+        return "%s://%s" % (request.scheme, request.get_host())
+    return get_scheme() + get_domain()
+
+
+def get_full_url(path, base_url=None):
+    """Return the full URL (scheme, domain, path) for a relative path.
+
+    Kwargs:
+        base_url: string, the scheme and domain to use, defaults to the
+            value returned by get_base_url(). Pass this in when building
+            many URLs at once.
+
+    """
+    return urljoin(base_url or get_base_url(), path)
 
 
 class NoValidAccessToken(Exception):
@@ -158,30 +219,74 @@ class Addon(models.Model):
     def get_absolute_url(self):
         return reverse('hipchat:descriptor', kwargs={'app_id': self.id})
 
-    def descriptor_url(self):
+    def descriptor_url(self, base_url=None):
         """Format the fully-qualified URL for the descriptor."""
         if self.id is None:
             return None
-        return get_full_url(self.get_absolute_url())
+        return get_full_url(self.get_absolute_url(), base_url=base_url)
 
-    def install_url(self):
+    def install_url(self, base_url=None):
         """Format the fully-qualified URL for the descriptor."""
         if self.id is None:
             return None
-        return get_full_url(reverse('hipchat:install', kwargs={'app_id': self.id}))
+        return get_full_url(
+            reverse('hipchat:install', kwargs={'app_id': self.id}),
+            base_url=base_url
+        )
 
     def scopes_as_list(self):
-        """Return related scopes as a list."""
+        """Return related scopes as a list.
+
+        NB this uses scopes.all(), so that prefetched scopes are used.
+
+        """
         return sorted([s.name for s in self.scopes.all()])
 
     def scopes_as_string(self):
         """Return related scopes as a space-separated string."""
         return ' '.join(self.scopes_as_list())
 
-    def descriptor(self):
-        """Return the object formatted as the HipChat add-on descriptor."""
+    @staticmethod
+    def get_scope_string(app_id):
+        """Return scopes_as_string() for an add-on, memoized per process.
+
+        This is used by every access token request, so the value is held
+        in an in-process cache (for HIPCHAT_SCOPE_CACHE_TIMEOUT seconds),
+        which is invalidated when the add-on scopes change - see
+        hipchat.receivers. (Invalidation only reaches the current process.)
+
+        """
+        scopes = scope_strings_cache.get(app_id)
+        if scopes is None:
+            names = Scope.objects.filter(addon__id=app_id).values_list('name', flat=True)
+            scopes = ' '.join(sorted(names))
+            scope_strings_cache.set(app_id, scopes)
+        return scopes
+
+    @staticmethod
+    def invalidate_scope_strings(*app_ids):
+        """Remove memoized scope strings - all of them if no ids are passed."""
+        if not app_ids:
+            scope_strings_cache.clear()
+        for app_id in app_ids:
+            scope_strings_cache.delete(app_id)
+
+    def descriptor(self, base_url=None):
+        """Return the object formatted as the HipChat add-on descriptor.
+
+        Kwargs:
+            base_url: string, the scheme and domain used for the callback
+                URLs - see get_full_url.
+
+        This uses only scopes.all(), glances.all() and webhooks.all(), so
+        when called on an object fetched with prefetch_related('scopes',
+        'glances', 'webhooks') and an explicit base_url it makes no DB
+        queries.
+
+        """
         if self.id is None:
             return None
+        base_url = base_url or get_base_url()
         descriptor = {
             "key": self.key,
             "name": self.name,
@@ -191,21 +296,29 @@ class Addon(models.Model):
                 "url": self.vendor_url
             },
             "links": {
-                "self": self.descriptor_url(),
+                "self": self.descriptor_url(base_url=base_url),
             },
             "capabilities": {
                 "hipchatApiConsumer": {
                     "scopes": self.scopes_as_list()
                 },
                 "installable": {
-                    "callbackUrl": self.install_url(),
+                    "callbackUrl": self.install_url(base_url=base_url),
                     "allowGlobal": self.allow_global,
                     "allowRoom": self.allow_room
                 },
             },
         }
-        if self.glances.exists():
-            descriptor["capabilities"]["glance"] = [g.descriptor() for g in self.glances.all()]
+        glances = self.glances.all()
+        if glances:
+            descriptor["capabilities"]["glance"] = [
+                g.descriptor(base_url=base_url) for g in glances
+            ]
+        webhooks = self.webhooks.all()
+        if webhooks:
+            descriptor["capabilities"]["webhook"] = [
+                w.descriptor(base_url=base_url) for w in webhooks
+            ]
         return descriptor
 
     def save(self, *args, **kwargs):
@@ -213,6 +326,95 @@ class Addon(models.Model):
         return self
 
 
+class InstallManager(models.Manager):
+
+    """Custom manager for Install objects."""
+
+    # fields that are updated when an existing install is posted again
+    UPSERT_FIELDS = ('oauth_secret', 'group_id', 'room_id', 'capabilities_url')
+
+    def upsert(self, install):
+        """Insert an unsaved Install, or update the existing oauth_id match.
+
+        HipChat may post the same install callback more than once, and
+        relying on save() raising an IntegrityError aborts the surrounding
+        transaction (on Postgres). On Postgres 9.5+ this uses a single
+        INSERT ... ON CONFLICT statement; elsewhere it falls back to an
+        UPDATE followed by an INSERT inside a savepoint.
+
+        The post_save signal is sent in both cases, as save() would.
+
+        Returns a 2-tuple of (install, created).
+
+        """
+        assert install.id is None, u"Only unsaved Install objects can be upserted."
+        install.installed_at = install.installed_at or tz_now()
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql' and connection.pg_version >= 90500:
+            return self._upsert_on_conflict(install, connection)
+        return self._upsert_fallback(install)
+
+    def _send_post_save(self, install, created):
+        """Send the post_save signal for an object saved without save()."""
+        post_save.send(
+            sender=self.model, instance=install, created=created,
+            update_fields=None, raw=False, using=self.db
+        )
+
+    def _upsert_on_conflict(self, install, connection):
+        """Upsert using INSERT ... ON CONFLICT (Postgres 9.5+)."""
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        fields = [f for f in opts.concrete_fields if not f.primary_key]
+        columns = [f.column for f in opts.concrete_fields]
+        sql = (
+            "INSERT INTO {table} ({insert_columns}) VALUES ({placeholders}) "
+            "ON CONFLICT ({oauth_id}) DO UPDATE SET {updates} "
+            "RETURNING {columns}, (xmax = 0)"
+        ).format(
+            table=qn(opts.db_table),
+            insert_columns=', '.join(qn(f.column) for f in fields),
+            placeholders=', '.join(['%s'] * len(fields)),
+            oauth_id=qn(opts.get_field('oauth_id').column),
+            updates=', '.join(
+                '{0} = EXCLUDED.{0}'.format(qn(opts.get_field(name).column))
+                for name in self.UPSERT_FIELDS
+            ),
+            columns=', '.join(qn(c) for c in columns)
+        )
+        params = [
+            f.get_db_prep_save(f.pre_save(install, True), connection=connection)
+            for f in fields
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        instance = self.model.from_db(
+            self.db, [f.attname for f in opts.concrete_fields], row[:-1]
+        )
+        created = row[-1]
+        self._send_post_save(instance, created)
+        return instance, created
+
+    def _upsert_fallback(self, install):
+        """Upsert using UPDATE, then INSERT inside a savepoint."""
+        values = {name: getattr(install, name) for name in self.UPSERT_FIELDS}
+        with transaction.atomic(using=self.db):
+            queryset = self.filter(oauth_id=install.oauth_id)
+            if queryset.update(**values) == 0:
+                try:
+                    # the savepoint keeps the outer transaction usable if
+                    # we lose a race with a concurrent callback.
+                    with transaction.atomic(using=self.db):
+                        install.save(using=self.db)
+                    return install, True
+                except IntegrityError:
+                    queryset.update(**values)
+            instance = queryset.get()
+        self._send_post_save(instance, False)
+        return instance, False
+
+
 class Install(models.Model):
 
     """Store data returned from the HipChat API re. an app install.
@@ -224,6 +426,15 @@ class Install(models.Model):
 
     CACHE_KEY_MASK = "hipchat-tokens:{oauth_id}"
 
+    TOKEN_STATUS_PENDING = 'pending'
+    TOKEN_STATUS_ACQUIRED = 'acquired'
+    TOKEN_STATUS_FAILED = 'failed'
+    TOKEN_STATUS_CHOICES = (
+        (TOKEN_STATUS_PENDING, 'Pending'),
+        (TOKEN_STATUS_ACQUIRED, 'Acquired'),
+        (TOKEN_STATUS_FAILED, 'Failed'),
+    )
+
     app = models.ForeignKey(
         Addon,
         help_text="App to which this access info belongs."
@@ -269,9 +480,35 @@ class Install(models.Model):
     #     blank=True, null=True,
     #     help_text="The datetime at which this token will expire."
     # )
+    capabilities_url = models.URLField(
+        blank=True,
+        help_text="Value returned from the app install postback."
+    )
     installed_at = models.DateTimeField(
         help_text="Set when the object is created (post-installation)."
     )
+    # set by the background token request that follows the install
+    token_status = models.CharField(
+        max_length=10,
+        choices=TOKEN_STATUS_CHOICES,
+        default=TOKEN_STATUS_PENDING,
+        help_text="Status of the post-install access token request."
+    )
+    token_status_message = models.CharField(
+        max_length=200,
+        blank=True,
+        help_text="Error message if the access token request failed."
+    )
+    token_status_at = models.DateTimeField(
+        blank=True, null=True,
+        help_text="Set when the token_status is updated."
+    )
+    capabilities = models.TextField(
+        blank=True,
+        help_text="JSON fetched from the capabilities_url (if enabled)."
+    )
+
+    objects = InstallManager()
     # last_updated_at = models.DateTimeField(
     #     help_text="Set when the object is updated.")
     # # included for API completeness only
@@ -311,26 +548,110 @@ class Install(models.Model):
         def extract(json_key, attr_name, func=lambda x: x):
             if json_key in json_data:
                 setattr(self, attr_name, func(json_data[json_key]))
+        extract('capabilitiesUrl', 'capabilities_url')
         extract('oauthId', 'oauth_id')
         extract('oauthSecret', 'oauth_secret')
         extract('groupId', 'group_id', func=int)
         extract('roomId', 'room_id', func=int)
         return self
 
+    def set_token_status(self, status, message=''):
+        """Update the token_status fields - using update(), not save()."""
+        self.token_status = status
+        self.token_status_message = message[:200]
+        self.token_status_at = tz_now()
+        Install.objects.filter(id=self.id).update(
+            token_status=self.token_status,
+            token_status_message=self.token_status_message,
+            token_status_at=self.token_status_at
+        )
+        return self
+
+    def acquire_access_token(self):
+        """Request an access token following installation.
+
+        This is run in the background after the install callback has been
+        acknowledged (see hipchat.tasks). The outcome is recorded in the
+        token_status fields rather than raised. If the setting
+        HIPCHAT_FETCH_CAPABILITIES is True, the capabilities document is
+        fetched and stored as well.
+
+        """
+        try:
+            if self.get_access_token() is None:
+                raise NoValidAccessToken("No access token returned.")
+        except Exception as ex:
+            logger.exception("Unable to acquire access token for %r", self)
+            return self.set_token_status(Install.TOKEN_STATUS_FAILED, unicode(ex))
+        self.set_token_status(Install.TOKEN_STATUS_ACQUIRED)
+        if getattr(settings, 'HIPCHAT_FETCH_CAPABILITIES', False):
+            self.fetch_capabilities()
+        return self
+
+    def fetch_capabilities(self):
+        """Fetch and store the capabilities document for the install."""
+        if self.capabilities_url in (None, ''):
+            return None
+        import requests
+        try:
+            resp = requests.get(self.capabilities_url)
+            resp.raise_for_status()
+        except requests.RequestException:
+            logger.exception("Unable to fetch capabilities for %r", self)
+            return None
+        self.capabilities = resp.text
+        Install.objects.filter(id=self.id).update(capabilities=self.capabilities)
+        return self.capabilities
+
     @property
     def cache_key(self):
         """Return the objects cache key."""
         return Install.CACHE_KEY_MASK.format(oauth_id=self.oauth_id)
 
+    @staticmethod
+    def get_cached_tokens(installs):
+        """Fetch the cached access tokens for many installs at once.
+
+        This makes a single cache.get_many call, and is used to avoid a
+        cache round trip per install (e.g. in the admin changelist).
+
+        Returns a dict of {oauth_id: token_data} - installs with no
+        cached token are not included.
+
+        """
+        keys = {install.cache_key: install.oauth_id for install in installs}
+        tokens = cache.get_many(keys.keys())
+        for key in keys:
+            metrics.record_cache('access_token', hit=key in tokens)
+        return {keys[key]: token for key, token in tokens.items()}
+
+    @staticmethod
+    def token_ttl(token_data):
+        """Return the number of seconds until a cached token expires.
+
+        Returns None if there is no token, or it was cached without an
+        expires_at value.
+
+        """
+        if not token_data or 'expires_at' not in token_data:
+            return None
+        return max(int(token_data['expires_at'] - time.time()), 0)
+
     def http_auth(self):
         """Return HTTPBasicAuth object using oauth_id, secret."""
+        from requests.auth import HTTPBasicAuth
         return HTTPBasicAuth(self.oauth_id, self.oauth_secret)
 
     def token_request_payload(self):
-        """Return JSON data for POSTing to token request API."""
+        """Return JSON data for POSTing to token request API.
+
+        The scopes are memoized per add-on (see Addon.get_scope_string),
+        so this doesn't fetch the app, or its scopes, for each request.
+
+        """
         return {
             'grant_type': 'client_credentials',
-            'scope': self.app.scopes_as_string()
+            'scope': Addon.get_scope_string(self.app_id)
         }
 
     def request_access_token(self):
@@ -339,10 +660,17 @@ class Install(models.Model):
         Returns the output from requests.post(...).json()
 
         """
-        url = "https://api.hipchat.com/v2/oauth/token"
-        resp = requests.post(url, auth=self.http_auth(), data=self.token_request_payload())
+        # requests is imported on first use - see hipchat.api
+        import requests
+        url = api_url("oauth/token")
+        resp = metrics.timed_request(
+            url,
+            requests.post,
+            auth=self.http_auth(),
+            data=self.token_request_payload()
+        )
         token_data = resp.json()
-        logger.debug("Access token data: %s", json.dumps(token_data, indent=4))
+        logger.debug("Access token data: %s", serialization.pretty(token_data))
         return token_data
 
     def get_access_token(self, auto_refresh=True):
@@ -363,24 +691,50 @@ class Install(models.Model):
 
         """
         token = cache.get(self.cache_key)
+        metrics.record_cache('access_token', hit=token is not None)
         if token is None:
             if auto_refresh is True:
-                token_data = self.request_access_token()
-                # we subtract 10 seconds from the expiry to cover latency and
-                # to ensure that our token expires before HipChat expires it
-                # at their end - this way we should never *think* we have a
-                # token when they do not.
-                expires_in = token_data.get('expires_in', 10) - 10
-                token = AccessToken(**token_data)
-                cache.set(self.cache_key, token_data, expires_in)
-                logger.debug("Cached new AccessToken: %r", token)
-                return token
+                return self.refresh_access_token()
             else:
                 return None
         else:
             logger.debug("Found cached AccessToken: %r", token)
             return token
 
+    def refresh_access_token(self):
+        """Request a new access token from HipChat, and cache it."""
+        token_data = self.request_access_token()
+        # we subtract 10 seconds from the expiry to cover latency and
+        # to ensure that our token expires before HipChat expires it
+        # at their end - this way we should never *think* we have a
+        # token when they do not.
+        expires_in = token_data.get('expires_in', 10) - 10
+        token = AccessToken(**token_data)
+        # store the absolute expiry, so that the TTL can be reported
+        cache_data = dict(token_data, expires_at=time.time() + expires_in)
+        cache.set(self.cache_key, cache_data, expires_in)
+        logger.debug("Cached new AccessToken: %r", token)
+        return token
+
+    @staticmethod
+    def get_access_tokens(installs):
+        """Fetch access tokens for many installs, refreshing where necessary.
+
+        Cached tokens are fetched with a single get_many (see
+        get_cached_tokens), and tokens are only requested for installs
+        that don't have one. The scopes sent with each request are
+        memoized per add-on, so installs of the same app share them.
+
+        Returns a dict of {oauth_id: token}.
+
+        """
+        installs = list(installs)
+        tokens = Install.get_cached_tokens(installs)
+        for install in installs:
+            if install.oauth_id not in tokens:
+                tokens[install.oauth_id] = install.refresh_access_token()
+        return tokens
+
 
 # containers for the lozenge, icon tuple data structures
 Lozenge = namedtuple('Lozenge', ['type', 'value'])
@@ -391,6 +745,144 @@ AccessToken = namedtuple(
 )
 
 
+class GlancePushResult(namedtuple('GlancePushResult', ['target', 'content', 'status_code', 'error'])):
+
+    """The outcome of pushing GlanceContent to a room / user.
+
+    status_code is the API response status (None if no response was
+    received), and error is the error message, or None if successful.
+
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def resolve_and_post_json(kind, id_or_name, auth_token, group_id, data):
+    """Resolve a room / user name to an id, then POST glance data to it.
+
+    This is the dispatched call when a glance is pushed to a room / user
+    by name (see Glance._update_recipient), so that the lookup is made by
+    the dispatch worker, not the caller.
+
+    Raises resolver.RecipientNotFound if the room / user is not recognised.
+
+    """
+    target_id = resolver.resolve(kind, id_or_name, auth_token, group_id=group_id)
+    return post_json(api_url("addon/ui/%s/%s" % (kind, target_id)), auth_token, data)
+
+
+def get_token_string(token):
+    """Return the access token string from an AccessToken or cached dict."""
+    if isinstance(token, dict):
+        return token['access_token']
+    return token.access_token
+
+
+class GlanceContent(object):
+
+    """Immutable glance update content, for pushing to HipChat.
+
+    This produces the same label() / status() / content() output as the
+    GlanceUpdate model, without the cost of instantiating a model - use
+    to_model() to convert it when the update is to be recorded.
+
+    """
+
+    __slots__ = ('label_value', 'lozenge', 'icons', 'metadata')
+
+    label_type = 'html'
+
+    def __init__(self, label_value, lozenge=None, icons=None, metadata=''):
+        set_attr = super(GlanceContent, self).__setattr__
+        set_attr('label_value', label_value)
+        set_attr('lozenge', lozenge or Lozenge(LOZENGE_EMPTY, ''))
+        set_attr('icons', icons or Icon('', ''))
+        set_attr('metadata', metadata)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GlanceContent is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("GlanceContent is immutable.")
+
+    def __eq__(self, other):
+        return isinstance(other, GlanceContent) and self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return "<GlanceContent label_value=%r>" % self.label_value
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @property
+    def has_lozenge(self):
+        return self.lozenge.type != LOZENGE_EMPTY
+
+    @property
+    def has_icon(self):
+        return self.icons.url not in (None, '')
+
+    @property
+    def has_metadata(self):
+        return self.metadata not in (None, '')
+
+    def label(self):
+        """Return the glance label as JSON."""
+        return {'type': self.label_type, 'value': self.label_value}
+
+    def status(self):
+        """Return the glance status as JSON."""
+        if self.has_lozenge:
+            return {
+                'type': 'lozenge',
+                'value': {
+                    'type': self.lozenge.type,
+                    'label': self.lozenge.value
+                }
+            }
+        elif self.has_icon:
+            return {
+                'type': 'icon',
+                'value': {
+                    'url': self.icons.url,
+                    'url@2x': self.icons.url2
+                }
+            }
+        return {}
+
+    def content(self):
+        """Return the JSON data to be posted to the API."""
+        content = {
+            'status': self.status(),
+            'label': self.label(),
+        }
+        if content['status'] == {}:
+            del content['status']
+        if self.has_metadata:
+            content['metadata'] = self.metadata
+        return content
+
+    def to_model(self, glance):
+        """Return an (unsaved) GlanceUpdate for the glance."""
+        return GlanceUpdate(
+            glance=glance,
+            label_value=self.label_value,
+            lozenge=self.lozenge,
+            icons=self.icons,
+            metadata=self.metadata
+        )
+
+
 class Glance(models.Model):
 
     """HipChat glance descriptor."""
@@ -439,10 +931,10 @@ class Glance(models.Model):
     def get_absolute_url(self):
         return reverse('hipchat:glance', kwargs={'glance_id': self.id})
 
-    def query_url(self):
+    def query_url(self, base_url=None):
         """Return full URL - including scheme and domain."""
         if self.data_url == '':
-            return get_full_url(self.get_absolute_url())
+            return get_full_url(self.get_absolute_url(), base_url=base_url)
         else:
             return self.data_url
 
@@ -450,13 +942,13 @@ class Glance(models.Model):
         super(Glance, self).save(*args, **kwargs)
         return self
 
-    def descriptor(self):
+    def descriptor(self, base_url=None):
         """Return JSON descriptor for the Glance."""
         return {
             "name": {
                 "value": self.name
             },
-            "queryUrl": self.query_url(),
+            "queryUrl": self.query_url(base_url=base_url),
             "key": self.key,
             "target": self.target,
             "icon": {
@@ -465,24 +957,188 @@ class Glance(models.Model):
             }
         }
 
-    def _update(self, url, access_token, update):
-        """POST glance update to the API."""
-        data = {
+    def get_install(self):
+        """Return the most recent Install of the glance's app.
+
+        Raises NoValidAccessToken if the app has not been installed.
+
+        """
+        install = (
+            Install.objects
+            .filter(app_id=self.app_id)
+            .order_by('-installed_at')
+            .first()
+        )
+        if install is None:
+            raise NoValidAccessToken()
+        return install
+
+    def _update(self, url, content, install=None, record=False):
+        """POST glance content to the API.
+
+        Args:
+            url: string, the API endpoint.
+            content: GlanceContent, the update to push.
+
+        Kwargs:
+            install: the Install whose access token is used - defaults to
+                the app's most recent install (see get_install).
+            record: bool, if True, save the update as a GlanceUpdate.
+
+        The POST is made using the configured dispatch backend (see
+        hipchat.dispatch), so it may happen after this method returns.
+
+        Returns the GlanceContent, or the saved GlanceUpdate if recorded.
+
+        """
+        install = install or self.get_install()
+        dispatch.dispatch(
+            post_json, url, get_token_string(install.get_access_token()), self._payload(content)
+        )
+        if record is True:
+            return content.to_model(self).save()
+        return content
+
+    def _payload(self, content):
+        """Return the API payload for pushing GlanceContent."""
+        return {
             'glance': [
                 {
-                    'content': update.content(),
+                    'content': content.content(),
                     'key': self.key
                 }
             ]
         }
-        print "status", update.status()
-        print "label", update.label()
-        print "content", update.content()
-        from hipchat.api import post_json
-        print post_json(url, self.access_token, data)
+
+    def _update_many(self, kind, targets, label, lozenge, icons,
+                     install, record, workers):
+        """POST glance content to many rooms / users concurrently.
+
+        See update_rooms - kind is 'room' or 'user'.
+
+        """
+        import requests
+        if isinstance(targets, dict):
+            contents = targets.items()
+        else:
+            assert label is not None, u"A label is required if targets is not a dict."
+            content = GlanceContent(label, lozenge=lozenge, icons=icons)
+            contents = [(target, content) for target in targets]
+        if not contents:
+            return []
+        install = install or self.get_install()
+        token = get_token_string(install.get_access_token())
+        workers = min(
+            workers or getattr(settings, 'HIPCHAT_GLANCE_PUSH_WORKERS', 10),
+            len(contents)
+        )
+        # one connection per worker, reused across requests
+        session = requests.Session()
+        for prefix in ('https://', 'http://'):
+            session.mount(prefix, requests.adapters.HTTPAdapter(pool_maxsize=workers))
+
+        def push(item):
+            target, content = item
+            try:
+                target_id = resolver.resolve(kind, target, token, group_id=install.group_id)
+                url = api_url("addon/ui/%s/%s" % (kind, target_id))
+                resp = post_json(url, token, self._payload(content), session=session)
+            except resolver.RecipientNotFound as ex:
+                return GlancePushResult(target, content, None, unicode(ex))
+            except HipChatError as ex:
+                return GlancePushResult(target, content, ex.status_code, ex.error_message)
+            except Exception as ex:
+                logger.exception("Error pushing glance %r to %s %s", self, kind, target)
+                return GlancePushResult(target, content, None, unicode(ex) or repr(ex))
+            return GlancePushResult(target, content, resp.status_code, None)
+
+        pool = ThreadPool(workers)
+        try:
+            results = pool.map(push, contents)
+        finally:
+            pool.close()
+            pool.join()
+            session.close()
+        if record is True:
+            GlanceUpdate.objects.bulk_create(
+                [r.content.to_model(self) for r in results if r.ok]
+            )
+        return results
+
+    def update_rooms(self, rooms, label=None, lozenge=None, icons=None,
+                     install=None, record=False, workers=None):
+        """POST glance updates to many rooms, concurrently.
+
+        The updates are POSTed from a pool of threads (rather than via the
+        dispatch backend, so that the outcome of each can be returned),
+        using a single access token and HTTP session.
+
+        Args:
+            rooms: a list of room ids / names - or a dict of
+                {room: GlanceContent} to push different content to each.
+
+        Kwargs:
+            label: string, the glance label text (if rooms is a list)
+            lozenge: a Lozenge tuple, if this update is altering the lozenge
+            icon: an Icon tuple, if this update is altering the icon
+            install: the Install whose access token is used
+            record: bool, if True the successful updates are saved as
+                GlanceUpdate objects
+            workers: int, the max number of concurrent requests, defaults
+                to the HIPCHAT_GLANCE_PUSH_WORKERS setting (10)
+
+        Returns a list of GlancePushResult tuples, one per room, in order.
+
+        """
+        return self._update_many(
+            resolver.ROOM, rooms, label, lozenge, icons, install, record, workers
+        )
+
+    def update_users(self, users, label=None, lozenge=None, icons=None,
+                     install=None, record=False, workers=None):
+        """POST glance updates to many users, concurrently.
+
+        Args:
+            users: a list of user ids / emails - or a dict of
+                {user: GlanceContent} to push different content to each.
+
+        See update_rooms for the kwargs, and return value.
+
+        """
+        return self._update_many(
+            resolver.USER, users, label, lozenge, icons, install, record, workers
+        )
+
+    def _update_recipient(self, kind, id_or_name, content, install=None, record=False):
+        """POST glance content to a room / user.
+
+        As _update, except that if name resolution is enabled (see
+        hipchat.resolver) the name is resolved by the dispatch worker.
+
+        Args:
+            kind: resolver.ROOM or resolver.USER
+            id_or_name: the room / user to update.
+            content: GlanceContent, the update to push.
+
+        """
+        if not resolver.needs_resolving(id_or_name):
+            url = api_url("addon/ui/%s/%s" % (kind, id_or_name))
+            return self._update(url, content, install=install, record=record)
+        install = install or self.get_install()
+        dispatch.dispatch(
+            resolve_and_post_json,
+            kind,
+            id_or_name,
+            get_token_string(install.get_access_token()),
+            install.group_id,
+            self._payload(content)
+        )
+        if record is True:
+            return content.to_model(self).save()
+        return content
 
     def update_global(self, label,
-                      lozenge=None, icons=None):
+                      lozenge=None, icons=None, install=None, record=False):
         """POST global update to the glance (all users, rooms).
 
         Args:
@@ -491,29 +1147,18 @@ class Glance(models.Model):
         Kwargs:
             lozenge: a Lozenge tuple, if this update is altering the lozenge
             icon: an Icon tuple, if this update is altering the icon
+            install: the Install whose access token is used
+            record: bool, if True the update is saved as a GlanceUpdate
 
-        Returns a GlanceUpdate object.
+        Returns a GlanceContent object (or GlanceUpdate, if recorded).
 
         """
-        url = "https://api.hipchat.com/v2/addon/ui"
-        update = GlanceUpdate(
-            glance=self,
-            label_value=label,
-            lozenge=lozenge or Lozenge(LOZENGE_EMPTY, ''),
-            icons=icons or Icon('', '')
-        )
-        token = (
-            Install.objects
-            .filter(app=self.app)
-            .filter(expires_at__gt=tz_now())
-            .first()
-        )
-        if token is None:
-            raise NoValidAccessToken()
-        return self._update(url, token.access_token, update)
+        url = api_url("addon/ui")
+        content = GlanceContent(label, lozenge=lozenge, icons=icons)
+        return self._update(url, content, install=install, record=record)
 
     def update_room(self, room_id, label,
-                    lozenge=None, icons=None):
+                    lozenge=None, icons=None, install=None, record=False):
         """POST glance update to a specific room.
 
         Args:
@@ -523,21 +1168,21 @@ class Glance(models.Model):
         Kwargs:
             lozenge: a Lozenge tuple, if this update is altering the lozenge
             icon: an Icon tuple, if this update is altering the icon
+            install: the Install whose access token is used
+            record: bool, if True the update is saved as a GlanceUpdate
 
-        Returns a GlanceUpdate object.
+        Returns a GlanceContent object (or GlanceUpdate, if recorded).
+        Room names are resolved by the dispatch worker, which raises
+        resolver.RecipientNotFound if the room is not recognised.
 
         """
-        url = "https://api.hipchat.com/v2/addon/ui/room/%s" % room_id
-        update = GlanceUpdate(
-            glance=self,
-            label_value=label,
-            lozenge=lozenge or Lozenge(LOZENGE_EMPTY, ''),
-            icons=icons or Icon('', '')
+        content = GlanceContent(label, lozenge=lozenge, icons=icons)
+        return self._update_recipient(
+            resolver.ROOM, room_id, content, install=install, record=record
         )
-        return self._update(url, update)
 
     def update_user(self, user_id, label,
-                    lozenge=None, icons=None):
+                    lozenge=None, icons=None, install=None, record=False):
         """POST glance update to a specific user.
 
         Args:
@@ -547,18 +1192,43 @@ class Glance(models.Model):
         Kwargs:
             lozenge: a Lozenge tuple, if this update is altering the lozenge
             icon: an Icon tuple, if this update is altering the icon
+            install: the Install whose access token is used
+            record: bool, if True the update is saved as a GlanceUpdate
+
+        Returns a GlanceContent object (or GlanceUpdate, if recorded).
+        User emails are resolved by the dispatch worker, which raises
+        resolver.RecipientNotFound if the user is not recognised.
+
+        """
+        content = GlanceContent(label, lozenge=lozenge, icons=icons)
+        return self._update_recipient(
+            resolver.USER, user_id, content, install=install, record=record
+        )
+
 
-        Returns a GlanceUpdate object.
+class GlanceUpdateQuerySet(models.QuerySet):
+
+    """Custom queryset for the (potentially very large) GlanceUpdate table."""
+
+    def latest_per_glance(self):
+        """Filter to the most recent update for each Glance.
+
+        This uses a correlated subquery per glance, which is answered from
+        the (glance, id) index, rather than scanning the update history.
 
         """
-        url = "https://api.hipchat.com/v2/addon/ui/user/%s" % user_id
-        update = GlanceUpdate(
-            glance=self,
-            label_value=label,
-            lozenge=lozenge or Lozenge(LOZENGE_EMPTY, ''),
-            icons=icons or Icon('', '')
+        qn = connections[self.db].ops.quote_name
+        sql = (
+            "{table}.{id} IN ("
+            "SELECT (SELECT u.{id} FROM {table} u WHERE u.{glance_id} = g.{id} "
+            "ORDER BY u.{id} DESC LIMIT 1) FROM {glance_table} g)"
+        ).format(
+            table=qn(self.model._meta.db_table),
+            glance_table=qn(Glance._meta.db_table),
+            id=qn('id'),
+            glance_id=qn('glance_id'),
         )
-        return self._update(url, update)
+        return self.extra(where=[sql])
 
 
 class GlanceUpdate(models.Model):
@@ -616,6 +1286,17 @@ class GlanceUpdate(models.Model):
         blank=True,
         help_text="Arbitrary JSON sent as the metadata value."
     )
+    created_at = models.DateTimeField(
+        default=tz_now,
+        db_index=True,
+        help_text="Set when the update is created."
+    )
+
+    objects = GlanceUpdateQuerySet.as_manager()
+
+    class Meta:
+        # supports the latest-per-glance lookup, and filtering by glance
+        index_together = (('glance', 'id'),)
 
     def __init__(self, *args, **kwargs):
         """Initialise using Lozenge and Icon tuples."""
@@ -656,38 +1337,182 @@ class GlanceUpdate(models.Model):
         super(GlanceUpdate, self).save(*args, **kwargs)
         return self
 
+    def to_content(self):
+        """Return the update as a GlanceContent value object."""
+        return GlanceContent(
+            self.label_value,
+            lozenge=self.lozenge,
+            icons=self.icons,
+            metadata=self.metadata
+        )
+
     def label(self):
         """Return the glance label as JSON."""
-        return {'type': self.label_type, 'value': self.label_value}
+        return self.to_content().label()
 
     def status(self):
         """Return the glance status as JSON."""
-        if self.has_lozenge:
-            return {
-                'type': 'lozenge',
-                'value': {
-                    'type': self.lozenge_type,
-                    'label': self.lozenge_value
-                }
-            }
-        elif self.has_icon:
-            return {
-                'type': 'icon',
-                'value': {
-                    'url': self.icon_url,
-                    'url@2x': self.icon_url2
-                }
-            }
-        return {}
+        return self.to_content().status()
 
     def content(self):
         """Return the JSON data to be posted to the API."""
-        content = {
-            'status': self.status(),
-            'label': self.label(),
+        return self.to_content().content()
+
+
+class Webhook(models.Model):
+
+    """HipChat webhook descriptor.
+
+    Events are posted by HipChat to the webhook view, which stores them
+    as WebhookEvent objects to be processed in the background - see
+    hipchat.webhooks.
+
+    https://ecosystem.atlassian.net/wiki/display/HIPDEV/Webhooks
+
+    """
+
+    EVENT_CHOICES = (
+        ('room_archived', 'room archived'),
+        ('room_created', 'room created'),
+        ('room_deleted', 'room deleted'),
+        ('room_enter', 'user enters room'),
+        ('room_exit', 'user exits room'),
+        ('room_file_upload', 'file uploaded to room'),
+        ('room_message', 'room message'),
+        ('room_notification', 'room notification'),
+        ('room_topic_change', 'room topic changed'),
+        ('room_unarchived', 'room unarchived'),
+    )
+
+    app = models.ForeignKey(
+        Addon,
+        help_text="The app this webhook belongs to.",
+        related_name='webhooks'
+    )
+    key = models.CharField(
+        max_length=40,
+        help_text="Unique key (in the context of the integration) to identify this webhook."
+    )
+    name = models.CharField(
+        max_length=100,
+        help_text="The display name of the webhook.",
+        blank=True
+    )
+    event = models.CharField(
+        max_length=30,
+        choices=EVENT_CHOICES,
+        help_text="The room event that triggers the webhook."
+    )
+    pattern = models.CharField(
+        max_length=200,
+        blank=True,
+        help_text="Regex that room messages must match (room_message events only)."
+    )
+
+    def __unicode__(self):
+        return self.key
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return "<Webhook id=%s key='%s'>" % (self.id, self.key.encode('utf-8'))
+
+    def get_absolute_url(self):
+        return reverse('hipchat:webhook', kwargs={'webhook_id': self.id})
+
+    def save(self, *args, **kwargs):
+        super(Webhook, self).save(*args, **kwargs)
+        return self
+
+    def descriptor(self, base_url=None):
+        """Return JSON descriptor for the Webhook."""
+        descriptor = {
+            "key": self.key,
+            "event": self.event,
+            "url": get_full_url(self.get_absolute_url(), base_url=base_url),
+            "authentication": "jwt",
         }
-        if content['status'] == {}:
-            del content['status']
-        if self.has_metadata:
-            content['metadata'] = self.metadata
-        return content
+        if self.name:
+            descriptor["name"] = self.name
+        if self.pattern:
+            descriptor["pattern"] = self.pattern
+        return descriptor
+
+
+class WebhookEvent(models.Model):
+
+    """An event posted to a Webhook by HipChat.
+
+    The raw payload is stored as received, so that the webhook view can
+    return as quickly as possible - it is parsed when the event is
+    processed (see hipchat.webhooks).
+
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_PROCESSED = 'processed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'pending'),
+        (STATUS_PROCESSING, 'processing'),
+        (STATUS_PROCESSED, 'processed'),
+        (STATUS_FAILED, 'failed'),
+    )
+
+    webhook = models.ForeignKey(
+        Webhook,
+        help_text="The Webhook that received the event.",
+        related_name='events'
+    )
+    oauth_id = models.CharField(
+        max_length=36,
+        help_text="The oauthId of the Install that sent the event (the JWT issuer)."
+    )
+    payload = models.TextField(
+        help_text="The JSON posted by HipChat."
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+    received_at = models.DateTimeField(
+        default=tz_now,
+        help_text="Set when the event is received."
+    )
+    processed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Set when the event is claimed for processing, and when it is processed (or fails)."
+    )
+    claim = models.CharField(
+        max_length=32,
+        blank=True,
+        help_text="Identifies the batch that claimed the event for processing."
+    )
+
+    class Meta:
+        # supports fetching the next batch of pending events
+        index_together = (('status', 'id'),)
+
+    def __unicode__(self):
+        return u"%s event %s" % (self.webhook_id, self.id)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return "<WebhookEvent id=%s webhook=%s status='%s'>" % (
+            self.id, self.webhook_id, self.status
+        )
+
+    def save(self, *args, **kwargs):
+        super(WebhookEvent, self).save(*args, **kwargs)
+        return self
+
+    @property
+    def data(self):
+        """Return the payload as a dict."""
+        return serialization.loads(self.payload)
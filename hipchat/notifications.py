@@ -15,30 +15,48 @@ as HIPCHAT_INFO_ROOM.
 
 >>> hipchat.yellow('this is a yellow message')
 
-Messages are sent via RQ, using the settings.QUEUE_HIPCHAT value to determine
-whether to send them sync or async.
+Messages can also be rendered from (HTML-escaped) Django templates, which
+are compiled once and cached - see send_room_template.
+
+>>> hipchat.send_room_template('Lounge', 'alerts/deploy.html', {'user': user})
+
+Room names and user emails can be resolved to (cached) ids before sending,
+by setting HIPCHAT_RESOLVE_NAMES - see hipchat.resolver. Names are resolved
+by the dispatch worker, not the caller.
+
+Messages are sent using the dispatch backend set by HIPCHAT_DISPATCH_BACKEND
+- inline (the default), from a thread pool, or via RQ. See hipchat.dispatch.
 
 Requires HIPCHAT_API_TOKEN to be set.
 
+NB requests is imported when the first message is sent (see _call_api),
+so that importing this module - e.g. to configure logging - is cheap.
+
 """
-import json
 import logging
 import os
 import random
 
 from django.conf import settings
 
-import requests
-# import django_rq
+from hipchat import dispatch
+from hipchat import metrics
+from hipchat import resolver
+from hipchat import serialization
+from hipchat.api import api_url
+from hipchat.caching import BoundedCache
 
-API_V2_ROOT = 'https://api.hipchat.com/v2/'
 VALID_COLORS = ('yellow', 'green', 'red', 'purple', 'gray', 'random')
 VALID_FORMATS = ('text', 'html')
+MAX_MESSAGE_LENGTH = 10000
 
-# requests are sent via a queue
-# HIPCHAT_QUEUE = django_rq.get_queue(async=settings.QUEUE_HIPCHAT)
 logger = logging.getLogger(__name__)
 
+# template_name -> compiled Template, see get_template
+templates_cache = BoundedCache(
+    maxsize=getattr(settings, 'HIPCHAT_TEMPLATE_CACHE_SIZE', 100)
+)
+
 
 def get_token():
     """Get a valid 'personal' auth token.
@@ -73,13 +91,18 @@ class HipChatError(Exception):
         self.error_message = error_message
 
     def __unicode__(self):
-        message = json.loads(self.error_message).get('error', {}).get('message')
+        message = serialization.loads(self.error_message).get('error', {}).get('message')
         return u'Status code %s: %s' % (self.status_code, message)
 
     def __str__(self):
         return unicode(self).decode('utf-8')
 
 
+class InvalidMessage(ValueError):
+
+    """Error raised when a rendered message is empty, or too long."""
+
+
 def get_auth_headers(auth_token=None):
     """Return authentication headers for API requests.
 
@@ -125,6 +148,7 @@ def _call_api(
     Raises HipChatError if for any reason the request fails.
 
     """
+    import requests
     assert message is not None, u"Missing message param"
     assert len(message) >= 1, u"Message too short, must be 1-10,000 chars."
     assert len(message) <= 10000, u"Message too long, must be 1-10,000 chars."
@@ -141,42 +165,170 @@ def _call_api(
     if sender is not None:
         data['from'] = sender
 
-    resp = requests.post(url, data=json.dumps(data), headers=headers)
+    resp = metrics.timed_request(url, requests.post, data=serialization.dumps(data), headers=headers)
+    dispatch.rate_limit.update(resp)
     if str(resp.status_code)[:1] != '2':
         raise HipChatError(resp.status_code, resp.text)
 
 
+def _resolve_and_call_api(kind, id_or_name, path, message, auth_token=None, **kwargs):
+    """Resolve a room / user name to an id, then send the message via _call_api.
+
+    This is the dispatched call when a name needs resolving, so that the
+    lookup (on a cache miss) is made by the dispatch worker, not the caller.
+
+    Args:
+        kind: resolver.ROOM or resolver.USER
+        id_or_name: the room / user to resolve.
+        path: string, the API path, with a %s placeholder for the id.
+        message: the message to send.
+
+    Raises resolver.RecipientNotFound if the room / user is not recognised.
+
+    """
+    id_or_name = resolver.resolve(kind, id_or_name, auth_token or get_token())
+    return _call_api(api_url(path % id_or_name), message, auth_token=auth_token, **kwargs)
+
+
+def _submit(kind, id_or_name, path, message, kwargs, priority):
+    """Dispatch a message, resolving the recipient name in the worker if required."""
+    if resolver.needs_resolving(id_or_name):
+        dispatch.submit(
+            _resolve_and_call_api, (kind, id_or_name, path, message), kwargs, priority=priority
+        )
+    else:
+        dispatch.submit(
+            _call_api, (api_url(path % id_or_name), message), kwargs, priority=priority
+        )
+
+
 def send_room_message(room_id_or_name, message, auth_token=None,
                       color='yellow', sender=None, notify=False,
-                      message_format='html'):
-    """Send a message to room."""
+                      message_format='html', priority=None):
+    """Send a message to room.
+
+    The dispatch priority (see hipchat.dispatch) defaults to one derived
+    from the color - e.g. red messages are HIGH priority.
+
+    If name resolution is enabled the room name is resolved by the
+    dispatch worker, which raises resolver.RecipientNotFound if the room
+    is not recognised.
+
+    """
     assert room_id_or_name not in (None, ''), u"Missing room_id_or_name"
-    url = "%sroom/%s/notification" % (API_V2_ROOT, room_id_or_name)
-    _call_api(
-        url,
+    if priority is None:
+        priority = dispatch.priority_for_color(color)
+    _submit(
+        resolver.ROOM,
+        room_id_or_name,
+        "room/%s/notification",
         message,
-        auth_token=auth_token,
-        color=color,
-        sender=sender,
-        notify=notify,
-        message_format=message_format
+        {
+            'auth_token': auth_token,
+            'color': color,
+            'sender': sender,
+            'notify': notify,
+            'message_format': message_format
+        },
+        priority
     )
 
 
 def send_user_message(user_id_or_email, message, auth_token=None,
-                      notify=False, message_format='html'):
-    """Send a message to room."""
+                      notify=False, message_format='html',
+                      priority=dispatch.NORMAL):
+    """Send a message to a user.
+
+    If name resolution is enabled the email is resolved by the dispatch
+    worker, which raises resolver.RecipientNotFound if the user is not
+    recognised.
+
+    """
     assert user_id_or_email not in (None, ''), u"Missing user_id_or_email"
-    url = "%suser/%s/message" % (API_V2_ROOT, user_id_or_email)
-    _call_api(
-        url,
+    _submit(
+        resolver.USER,
+        user_id_or_email,
+        "user/%s/message",
         message,
-        auth_token=auth_token,
-        notify=notify,
-        message_format=message_format
+        {
+            'auth_token': auth_token,
+            'notify': notify,
+            'message_format': message_format
+        },
+        priority
     )
 
 
+# ================================================
+# Templated messages
+# ================================================
+def get_template(template_name):
+    """Return a compiled template, from the in-process cache if possible.
+
+    Templates are loaded using the project's TEMPLATES setting, and held
+    in a BoundedCache of HIPCHAT_TEMPLATE_CACHE_SIZE (default 100) entries.
+
+    Raises django.template.TemplateDoesNotExist if the template is missing.
+
+    """
+    template = templates_cache.get(template_name)
+    if template is None:
+        from django.template import loader
+        template = loader.get_template(template_name)
+        templates_cache.set(template_name, template)
+    return template
+
+
+def render_message(template_name, context=None):
+    """Render a message template, and validate the output.
+
+    The Django template engine escapes HTML in context values (use the
+    'safe' filter, or {% autoescape off %}, for trusted markup / plain
+    text messages).
+
+    Args:
+        template_name: string, the name of the template to render.
+
+    Kwargs:
+        context: dict, the template context.
+
+    Returns the rendered message, with leading / trailing whitespace
+        removed.
+
+    Raises InvalidMessage if the message is empty, or longer than
+        MAX_MESSAGE_LENGTH.
+
+    """
+    message = get_template(template_name).render(context or {}).strip()
+    if not message:
+        raise InvalidMessage(u"Template %s rendered an empty message." % template_name)
+    if len(message) > MAX_MESSAGE_LENGTH:
+        raise InvalidMessage(
+            u"Template %s rendered %s chars, the limit is %s." %
+            (template_name, len(message), MAX_MESSAGE_LENGTH)
+        )
+    return message
+
+
+def send_room_template(room_id_or_name, template_name, context=None, **kwargs):
+    """Render a message template, and send it to a room.
+
+    The message is rendered (and validated, see render_message) before
+    it is dispatched, so errors are raised to the caller.
+
+    Args:
+        room_id_or_name: the room to send the message to.
+        template_name: string, the name of the template to render.
+
+    Kwargs:
+        context: dict, the template context.
+        other kwargs are passed through to send_room_message.
+
+    """
+    message = render_message(template_name, context)
+    return send_room_message(room_id_or_name, message, **kwargs)
+
+
 # ================================================
 # Colour specific helper functions
 # ================================================
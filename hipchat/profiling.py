@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation for the initialise_glance signal receivers.
+
+The glance view is called by the HipChat client every time a user opens
+a room or sidebar, and it blocks on every receiver connected to the
+initialise_glance signal. This module wraps the signal dispatch so that
+each receiver is timed individually, and keeps a rolling window of those
+timings so that slow data providers can be identified.
+
+>>> from hipchat import profiling
+>>> profiling.receiver_stats()
+[{'receiver': 'myapp.receivers.load_tickets', 'calls': 10, 'p50': 0.012, ...}]
+
+The thresholds are configured in settings:
+
+    HIPCHAT_SLOW_RECEIVER_THRESHOLD - duration (seconds) above which a
+        warning is logged for a receiver call, defaults to 0.25.
+    HIPCHAT_RECEIVER_STATS_WINDOW - the number of timings kept per
+        receiver for the percentile calculations, defaults to 1000.
+
+"""
+from collections import deque
+import logging
+import math
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def slow_receiver_threshold():
+    """Return the duration (seconds) over which a receiver is 'slow'."""
+    return getattr(settings, 'HIPCHAT_SLOW_RECEIVER_THRESHOLD', 0.25)
+
+
+def stats_window():
+    """Return the number of timings to keep per receiver."""
+    return getattr(settings, 'HIPCHAT_RECEIVER_STATS_WINDOW', 1000)
+
+
+def receiver_name(receiver):
+    """Return a readable dotted name for a signal receiver."""
+    module = getattr(receiver, '__module__', None)
+    name = getattr(receiver, '__name__', None) or receiver.__class__.__name__
+    return "%s.%s" % (module, name) if module else name
+
+
+def percentile(ordered, pct):
+    """Return the nearest-rank percentile from a sorted list of values."""
+    if not ordered:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+class ReceiverStats(object):
+
+    """Rolling call statistics for a single signal receiver."""
+
+    def __init__(self, name, window):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.updates = 0
+        self.slow = 0
+        self.timings = deque(maxlen=window)
+
+    def __repr__(self):
+        return "<ReceiverStats receiver='%s' calls=%s>" % (self.name, self.calls)
+
+    def record(self, duration, returned_update=False, raised=False, slow=False):
+        """Record the outcome of a single receiver call."""
+        self.calls += 1
+        self.timings.append(duration)
+        if returned_update:
+            self.updates += 1
+        if raised:
+            self.errors += 1
+        if slow:
+            self.slow += 1
+
+    def summary(self):
+        """Return the stats as a dict, including timing percentiles."""
+        ordered = sorted(self.timings)
+        summary = {
+            'receiver': self.name,
+            'calls': self.calls,
+            'updates': self.updates,
+            'errors': self.errors,
+            'slow': self.slow,
+            'max': ordered[-1] if ordered else None,
+        }
+        for pct in PERCENTILES:
+            summary['p%s' % pct] = percentile(ordered, pct)
+        return summary
+
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def get_stats(name):
+    """Return the ReceiverStats object for a receiver, creating if required."""
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = ReceiverStats(name, stats_window())
+        return stats
+
+
+def receiver_stats():
+    """Return summary stats for all receivers, slowest (p95) first."""
+    with _lock:
+        summaries = [s.summary() for s in _stats.values()]
+    return sorted(summaries, key=lambda s: s['p95'], reverse=True)
+
+
+def reset_stats():
+    """Clear down all recorded receiver stats."""
+    with _lock:
+        _stats.clear()
+
+
+def send_timed(signal, update_class, sender=None, **named):
+    """Send a signal, timing each receiver individually.
+
+    This is a drop-in replacement for signal.send - it returns the same
+    list of (receiver, response) 2-tuples, and any exception raised by
+    a receiver is propagated (after it has been recorded).
+
+    Args:
+        signal: the Signal to dispatch.
+        update_class: the class of a 'useful' response, used to record
+            whether or not each receiver returned an update.
+
+    Kwargs:
+        sender: the signal sender.
+        named: the named args passed through to each receiver.
+
+    """
+    responses = []
+    if not signal.receivers:
+        return responses
+    threshold = slow_receiver_threshold()
+    for receiver in signal._live_receivers(sender):
+        name = receiver_name(receiver)
+        start = default_timer()
+        try:
+            response = receiver(signal=signal, sender=sender, **named)
+        except Exception:
+            duration = default_timer() - start
+            get_stats(name).record(duration, raised=True, slow=duration > threshold)
+            raise
+        duration = default_timer() - start
+        slow = duration > threshold
+        if slow:
+            logger.warning(
+                "Slow glance receiver %s took %.3fs (threshold %.3fs)",
+                name, duration, threshold
+            )
+        get_stats(name).record(
+            duration,
+            returned_update=isinstance(response, update_class),
+            slow=slow
+        )
+        responses.append((receiver, response))
+    return responses
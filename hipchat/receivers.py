@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""hipchat signal receivers.
+
+These receivers are used to invalidate in-process and shared caches when
+the underlying models change. They are connected when the app is loaded,
+in HipChatConfig.ready().
+
+"""
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+from hipchat import descriptors
+from hipchat import dispatch
+from hipchat import models
+from hipchat import webhooks
+from hipchat.models import Addon, Glance, Install, Scope, Webhook
+from hipchat.signed_requests import invalidate_secret
+
+
+@receiver(post_save, sender=Install)
+@receiver(post_delete, sender=Install)
+def on_install_changed(sender, instance, **kwargs):
+    """Invalidate the cached oauth_secret for the install."""
+    invalidate_secret(instance.oauth_id)
+
+
+@receiver(post_save, sender=Addon)
+@receiver(post_delete, sender=Addon)
+def on_addon_changed(sender, instance, **kwargs):
+    """Invalidate the cached descriptor and scopes for the add-on."""
+    descriptors.invalidate(instance.id)
+    Addon.invalidate_scope_strings(instance.id)
+
+
+@receiver(post_save, sender=Glance)
+@receiver(post_delete, sender=Glance)
+def on_glance_changed(sender, instance, **kwargs):
+    """Invalidate the cached descriptor for the glance add-on."""
+    descriptors.invalidate(instance.app_id)
+
+
+@receiver(post_save, sender=Webhook)
+@receiver(post_delete, sender=Webhook)
+def on_webhook_changed(sender, instance, **kwargs):
+    """Invalidate the cached webhook, and its add-on descriptor."""
+    webhooks.invalidate_webhook(instance.id)
+    descriptors.invalidate(instance.app_id)
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def on_site_changed(sender, instance, **kwargs):
+    """Clear the cached domain (in this process), and all descriptors that use it."""
+    models.clear_domain_cache()
+    descriptors.invalidate_all()
+
+
+@receiver(setting_changed)
+def on_setting_changed(sender, setting, **kwargs):
+    """Clear cached values derived from settings that are overridden (in tests)."""
+    if setting == 'SITE_ID':
+        models.clear_domain_cache()
+    elif setting in ('HIPCHAT_DISPATCH_BACKEND', 'HIPCHAT_DISPATCH_OPTIONS'):
+        dispatch.reset_backend()
+
+
+@receiver(post_save, sender=Scope)
+@receiver(post_delete, sender=Scope)
+def on_scope_changed(sender, instance, **kwargs):
+    """Invalidate all cached descriptors and scopes - scopes are shared."""
+    descriptors.invalidate_all()
+    Addon.invalidate_scope_strings()
+
+
+@receiver(m2m_changed, sender=Addon.scopes.through)
+def on_addon_scopes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate cached descriptors and scopes when add-on scopes are changed."""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        descriptors.invalidate(instance.id)
+        Addon.invalidate_scope_strings(instance.id)
+    elif pk_set:
+        descriptors.invalidate(*pk_set)
+        Addon.invalidate_scope_strings(*pk_set)
+    else:
+        # reverse clear() - pk_set is None, so we don't know which
+        descriptors.invalidate_all()
+        Addon.invalidate_scope_strings()
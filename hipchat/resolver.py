@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Resolution of room names and user emails to HipChat ids.
+
+The message and glance functions accept room names and user emails (or
+@mention names) as well as ids, which HipChat has to resolve on every
+request. If HIPCHAT_RESOLVE_NAMES is True, names are resolved to ids
+once, using the API, and the ids are held in a bounded in-process cache,
+so that subsequent requests use the id-based endpoints:
+
+>>> resolve_room('Lounge', auth_token)
+123
+
+The notification and glance functions resolve names in the dispatch
+worker (see hipchat.dispatch), so that a cache miss does not block the
+caller on a round trip to HipChat.
+
+Names that HipChat doesn't recognise are cached too (for a shorter time)
+and raise RecipientNotFound - so a misspelt room fails immediately,
+without a round trip to HipChat. Any other API error (including a token
+without the view_room / view_group scope) is logged, and the name is
+returned unchanged, so that messages are still sent.
+
+The following settings are used:
+
+    HIPCHAT_RESOLVE_NAMES - enable name resolution, defaults to False.
+    HIPCHAT_RESOLVER_CACHE_SIZE - max number of names held, default 10000.
+    HIPCHAT_RESOLVER_TIMEOUT - seconds for which ids are held, default 3600.
+    HIPCHAT_RESOLVER_NOT_FOUND_TIMEOUT - seconds for which unknown names
+        are held, defaults to 60.
+
+"""
+import logging
+import urllib
+
+from django.conf import settings
+
+from hipchat import metrics
+from hipchat.api import HipChatError, api_url, get_json
+from hipchat.caching import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+ROOM = 'room'
+USER = 'user'
+
+# cached value for names that HipChat doesn't recognise
+NOT_FOUND = object()
+
+# (kind, group_id, name) -> id, or NOT_FOUND
+ids_cache = BoundedCache(
+    maxsize=getattr(settings, 'HIPCHAT_RESOLVER_CACHE_SIZE', 10000)
+)
+
+
+class RecipientNotFound(Exception):
+
+    """Exception raised when a room or user name is not recognised."""
+
+    pass
+
+
+def enabled():
+    """Return True if name resolution is enabled."""
+    return getattr(settings, 'HIPCHAT_RESOLVE_NAMES', False)
+
+
+def is_id(value):
+    """Return True if value is already a room / user id."""
+    return isinstance(value, (int, long)) or unicode(value).isdigit()
+
+
+def needs_resolving(value):
+    """Return True if value is a name that should be resolved to an id."""
+    return enabled() and not is_id(value)
+
+
+def resolve(kind, value, auth_token, group_id=None):
+    """Return the id of a room (kind ROOM) or user (kind USER)."""
+    return _resolve(kind, value, auth_token, group_id)
+
+
+def resolve_room(room_id_or_name, auth_token, group_id=None):
+    """Return the id of a room.
+
+    Args:
+        room_id_or_name: the room id or name.
+        auth_token: string, an API token with the view_room scope.
+
+    Kwargs:
+        group_id: the HipChat group (i.e. the install's group_id) that
+            the name belongs to, if the process serves several groups.
+
+    Returns the id (or room_id_or_name, if it cannot be resolved). Raises
+    RecipientNotFound if HipChat doesn't recognise the room.
+
+    """
+    return _resolve(ROOM, room_id_or_name, auth_token, group_id)
+
+
+def resolve_user(user_id_or_email, auth_token, group_id=None):
+    """Return the id of a user - see resolve_room."""
+    return _resolve(USER, user_id_or_email, auth_token, group_id)
+
+
+def _resolve(kind, value, auth_token, group_id):
+    if not enabled() or is_id(value):
+        return value
+    key = (kind, group_id, value)
+    resolved = ids_cache.get(key)
+    metrics.record_cache('resolver', hit=resolved is not None)
+    if resolved is None:
+        resolved = _fetch_id(kind, value, auth_token)
+        if resolved is None:
+            return value
+        if resolved is NOT_FOUND:
+            timeout = getattr(settings, 'HIPCHAT_RESOLVER_NOT_FOUND_TIMEOUT', 60)
+        else:
+            timeout = getattr(settings, 'HIPCHAT_RESOLVER_TIMEOUT', 3600)
+        ids_cache.set(key, resolved, timeout=timeout)
+    if resolved is NOT_FOUND:
+        raise RecipientNotFound(u"Unknown HipChat %s: %s" % (kind, value))
+    return resolved
+
+
+def _fetch_id(kind, value, auth_token):
+    """Return the id from the API, NOT_FOUND, or None if the API fails."""
+    url = api_url("%s/%s" % (kind, urllib.quote(unicode(value).encode('utf-8'), safe='@')))
+    try:
+        return get_json(url, auth_token)['id']
+    except HipChatError as ex:
+        if ex.status_code == 404:
+            return NOT_FOUND
+        logger.warning("Unable to resolve HipChat %s '%s': %s", kind, value, ex.status_code)
+    except Exception:
+        logger.exception("Unable to resolve HipChat %s '%s'", kind, value)
+    return None
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""JSON serialization.
+
+All JSON encoding / decoding in the app goes through this module, which
+uses the fastest JSON library that is installed - ujson, then simplejson
+(with its C speedups), then the stdlib json module. A specific library
+can be forced using the HIPCHAT_JSON_LIBRARY setting, e.g. 'json'.
+
+Values that the fast library cannot encode (e.g. datetimes, Decimals)
+fall back to the stdlib encoder with the DjangoJSONEncoder.
+
+For debug logging use pretty(), which defers the (expensive) indented
+formatting until the log message is actually emitted:
+
+>>> logger.debug("Data received: %s", pretty(data))
+
+"""
+import importlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+LIBRARIES = ('ujson', 'simplejson', 'json')
+
+# the selected library module, see get_library()
+_library = None
+
+
+def get_library():
+    """Return the JSON library module in use."""
+    global _library
+    if _library is None:
+        names = getattr(settings, 'HIPCHAT_JSON_LIBRARY', None)
+        for name in ([names] if names else LIBRARIES):
+            try:
+                _library = importlib.import_module(name)
+                break
+            except ImportError:
+                continue
+        else:
+            _library = json
+    return _library
+
+
+def reset_library():
+    """Clear the selected library, so that it is re-read from settings."""
+    global _library
+    _library = None
+
+
+def dumps(obj):
+    """Serialize obj to a JSON string."""
+    library = get_library()
+    try:
+        if library.__name__ == 'ujson':
+            return library.dumps(obj, escape_forward_slashes=False)
+        return library.dumps(obj)
+    except (TypeError, OverflowError):
+        return json.dumps(obj, cls=DjangoJSONEncoder)
+
+
+def loads(s):
+    """Deserialize a JSON string."""
+    return get_library().loads(s)
+
+
+def json_response(data, status=200):
+    """Return an HttpResponse containing data serialized as JSON."""
+    return HttpResponse(dumps(data), content_type='application/json', status=status)
+
+
+class pretty(object):
+
+    """Lazily formatted, indented, JSON for use in log messages."""
+
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj, indent=4, sort_keys=True, cls=DjangoJSONEncoder)
@@ -6,6 +6,11 @@ from django.dispatch import Signal
 # is fired from within the view function (so inside an HTTP request/response)
 # so this *is* performance-bound. The signal is used as a mechanism for
 # returning external data - the calling app can connect to the signal,
-# and then return a GlanceUpdate object which will be used by the view
+# and then return a GlanceUpdate (or GlanceContent) object which will be used by the view
 # as its return value.
 initialise_glance = Signal(providing_args=['glance'])
+
+# Signal sent when a batch of WebhookEvents is processed. This is sent in the
+# background, not from within the webhook view (see hipchat.webhooks), with
+# a list of events received by a single webhook, in the order received.
+webhook_events = Signal(providing_args=['webhook', 'events'])
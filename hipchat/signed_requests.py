@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Verification of the JWT 'signed_request' sent by HipChat.
+
+HipChat signs requests (e.g. glance data requests) with a JWT token,
+issued by the install's oauth_id and signed with its oauth_secret:
+
+https://ecosystem.atlassian.net/wiki/display/HIPDEV/HipChat+Glances
+
+Glance requests are made by every client that opens a room, so this is a
+hot path. The token is parsed exactly once, the oauth_id -> oauth_secret
+mapping is held in a bounded in-process cache (invalidated when an Install
+is saved or deleted), and tokens that have been verified are memoized
+until they expire. In the steady state verification makes no DB queries.
+
+Unknown issuers are also cached (for a shorter time), so forged tokens do
+not cost a query each. A bad signature is rejected using the cached secret
+- a secret changed by another process is picked up once the cached value
+expires.
+
+The caches are configured in settings:
+
+    HIPCHAT_JWT_SECRET_CACHE_SIZE - max number of secrets held, default 1000
+    HIPCHAT_JWT_SECRET_CACHE_TIMEOUT - seconds for which a secret is held,
+        defaults to 300. (Invalidation only reaches the current process.)
+    HIPCHAT_JWT_UNKNOWN_ISSUER_TIMEOUT - seconds for which an unknown
+        issuer is remembered, defaults to 30.
+    HIPCHAT_JWT_TOKEN_CACHE_SIZE - max number of verified tokens held,
+        defaults to 10000.
+    HIPCHAT_JWT_LEEWAY - seconds of clock skew allowed on 'exp' and 'nbf',
+        default 0.
+
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import time
+
+from django.conf import settings
+
+from hipchat import serialization
+from hipchat.caching import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+ALGORITHMS = {
+    'HS256': hashlib.sha256,
+    'HS384': hashlib.sha384,
+    'HS512': hashlib.sha512,
+}
+
+# cached in place of the secret for unknown issuers
+UNKNOWN_ISSUER = object()
+
+# oauth_id -> oauth_secret (or UNKNOWN_ISSUER)
+secrets_cache = BoundedCache(
+    maxsize=getattr(settings, 'HIPCHAT_JWT_SECRET_CACHE_SIZE', 1000),
+    timeout=getattr(settings, 'HIPCHAT_JWT_SECRET_CACHE_TIMEOUT', 300)
+)
+# raw token -> verified claims
+tokens_cache = BoundedCache(
+    maxsize=getattr(settings, 'HIPCHAT_JWT_TOKEN_CACHE_SIZE', 10000)
+)
+
+
+class InvalidSignedRequest(Exception):
+
+    """Exception raised when a signed_request cannot be verified."""
+
+    pass
+
+
+def _b64decode(segment):
+    """Decode a base64url JWT segment (which has its padding stripped)."""
+    segment = str(segment)
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def parse_token(token):
+    """Split and decode a JWT token, without verifying it.
+
+    Returns a 4-tuple of (header, claims, signing_input, signature), where
+    header and claims are the decoded JSON dicts.
+
+    Raises InvalidSignedRequest if the token is malformed - including if
+    the header or claims are not JSON objects, the algorithm ('alg') or
+    issuer ('iss') are not strings, or 'exp' / 'nbf' are not numbers.
+
+    """
+    try:
+        token = token.encode('ascii') if isinstance(token, unicode) else token
+        signing_input, signature = token.rsplit('.', 1)
+        header, claims = signing_input.split('.', 1)
+        header = serialization.loads(_b64decode(header))
+        claims = serialization.loads(_b64decode(claims))
+        signature = _b64decode(signature)
+    except (ValueError, TypeError, AttributeError, UnicodeError, binascii.Error):
+        raise InvalidSignedRequest("Malformed JWT token.")
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise InvalidSignedRequest("Malformed JWT token.")
+    if not isinstance(header.get('alg', ''), basestring):
+        raise InvalidSignedRequest("Malformed JWT algorithm.")
+    if not isinstance(claims.get('iss', ''), basestring):
+        raise InvalidSignedRequest("Malformed JWT issuer.")
+    for name in ('exp', 'nbf'):
+        value = claims.get(name, 0)
+        if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+            raise InvalidSignedRequest("Malformed JWT '%s' claim." % name)
+    return header, claims, signing_input, signature
+
+
+def get_secret(oauth_id, refresh=False):
+    """Return the oauth_secret for an install, from the cache if possible.
+
+    Kwargs:
+        refresh: bool, if True then bypass the cache and read the
+            secret from the database.
+
+    Raises InvalidSignedRequest if the install does not exist - this is
+    cached for HIPCHAT_JWT_UNKNOWN_ISSUER_TIMEOUT seconds.
+
+    """
+    secret = None if refresh else secrets_cache.get(oauth_id)
+    if secret is None:
+        # avoid circular import
+        from hipchat.models import Install
+        try:
+            secret = (
+                Install.objects
+                .values_list('oauth_secret', flat=True)
+                .get(oauth_id=oauth_id)
+            )
+        except Install.DoesNotExist:
+            secrets_cache.set(
+                oauth_id,
+                UNKNOWN_ISSUER,
+                timeout=getattr(settings, 'HIPCHAT_JWT_UNKNOWN_ISSUER_TIMEOUT', 30)
+            )
+            raise InvalidSignedRequest("Unknown JWT issuer: %s" % oauth_id)
+        secrets_cache.set(oauth_id, secret)
+    elif secret is UNKNOWN_ISSUER:
+        raise InvalidSignedRequest("Unknown JWT issuer: %s" % oauth_id)
+    return secret
+
+
+def invalidate_secret(oauth_id):
+    """Remove cached secret, and any tokens verified against it."""
+    secrets_cache.delete(oauth_id)
+    # verified tokens aren't indexed by issuer - installs rarely change
+    # so it's simpler (and safe) to drop all of them.
+    tokens_cache.clear()
+
+
+def _signature(secret, algorithm, signing_input):
+    digestmod = ALGORITHMS[algorithm]
+    return hmac.new(secret.encode('utf-8'), signing_input, digestmod).digest()
+
+
+def verify_token(token):
+    """Verify a HipChat JWT token, and return its claims.
+
+    Raises InvalidSignedRequest if the token cannot be verified, if it
+    has expired, or if it is not yet valid ('nbf' is in the future).
+
+    """
+    now = time.time()
+    claims = tokens_cache.get(token)
+    if claims is not None:
+        return claims
+
+    header, claims, signing_input, signature = parse_token(token)
+    algorithm = header.get('alg')
+    if algorithm not in ALGORITHMS:
+        raise InvalidSignedRequest("Unsupported JWT algorithm: %s" % algorithm)
+    oauth_id = claims.get('iss')
+    if oauth_id is None:
+        raise InvalidSignedRequest("Missing JWT issuer.")
+
+    expected = _signature(get_secret(oauth_id), algorithm, signing_input)
+    if not hmac.compare_digest(expected, signature):
+        raise InvalidSignedRequest("Invalid JWT signature.")
+
+    leeway = getattr(settings, 'HIPCHAT_JWT_LEEWAY', 0)
+    not_before = claims.get('nbf')
+    if not_before is not None and int(not_before) - leeway > now:
+        raise InvalidSignedRequest("JWT token is not yet valid.")
+    expires_at = claims.get('exp')
+    if expires_at is not None:
+        ttl = int(expires_at) + leeway - now
+        if ttl <= 0:
+            raise InvalidSignedRequest("JWT token has expired.")
+        tokens_cache.set(token, claims, timeout=ttl)
+
+    return claims
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Background tasks.
+
+HipChat expects the install callback to be acknowledged quickly, so any
+follow-up API calls (e.g. requesting an access token) are run in the
+background, on a daemon thread, once the view has done its work.
+
+Set HIPCHAT_RUN_TASKS_SYNC to True to run tasks inline (e.g. in tests).
+
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def _run(func, *args, **kwargs):
+    """Run the task, logging any errors, and clean up the DB connection."""
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Error running background task %s", func)
+    finally:
+        # each thread has its own connection, which must be closed.
+        connection.close()
+
+
+def schedule(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in the background.
+
+    NB if the calling code is inside a transaction (e.g. ATOMIC_REQUESTS)
+    the task may start before the transaction has been committed.
+
+    """
+    if getattr(settings, 'HIPCHAT_RUN_TASKS_SYNC', False):
+        return func(*args, **kwargs)
+    thread = threading.Thread(target=_run, args=(func,) + args, kwargs=kwargs)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def acquire_access_token(install):
+    """Background task run after a successful install."""
+    install.acquire_access_token()
+    logger.debug("Access token status for %s: %s", install, install.token_status)
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""Testing utilities for projects that use the hipchat app."""
+from hipchat.testing.fake_api import FakeHipChatServer  # noqa
+from hipchat.testing.fake_queue import FakeQueue  # noqa
+from hipchat.testing.budgets import QueryBudgetMixin  # noqa
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Query and cache operation budgets for tests.
+
+Use QueryBudgetMixin in a TestCase to pin the exact number of DB queries
+and cache operations made by a block of code:
+
+>>> class MyTests(QueryBudgetMixin, TestCase):
+...     def test_descriptor(self):
+...         with self.assertBudget(queries=2, cache=0):
+...             app.descriptor()
+
+If the budget is not met the test fails with the list of queries issued,
+with repeated queries (the tell-tale sign of an N+1) collapsed and counted,
+and - if expected_queries is passed - a diff against the expected queries.
+
+"""
+import ast
+from collections import OrderedDict
+import difflib
+import re
+
+from django.core.cache import caches
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+
+CACHE_METHODS = (
+    'add', 'get', 'set', 'delete', 'get_many', 'set_many',
+    'delete_many', 'has_key', 'incr', 'decr', 'clear'
+)
+
+# used to replace literal values in SQL, so that N+1 queries match
+LITERALS = re.compile(r"('[^']*'|\"s\d+_x\d+\"|\b\d+\b|%s)")
+
+# some backends (e.g. sqlite) can't interpolate the params into the SQL,
+# and record queries in this format instead
+UNINTERPOLATED = re.compile(r"^QUERY = (?P<sql>u?('|\").*\2) - PARAMS = (?P<params>.*)$", re.DOTALL)
+
+
+def normalize(sql):
+    """Return SQL with literal values replaced by '?'."""
+    return LITERALS.sub('?', sql)
+
+
+def parse_query(sql):
+    """Return readable SQL from a captured query."""
+    match = UNINTERPOLATED.match(sql)
+    if match is None:
+        return sql
+    return u"%s %s" % (ast.literal_eval(match.group('sql')), match.group('params'))
+
+
+class CaptureCacheContext(object):
+
+    """Context manager that records calls made to a cache backend."""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.calls = []
+        # backends may implement e.g. get_many using get - only the
+        # outermost call is recorded
+        self._depth = 0
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __enter__(self):
+        self.cache = caches[self.alias]
+        for name in CACHE_METHODS:
+            setattr(self.cache, name, self._wrap(name, getattr(self.cache, name)))
+        return self
+
+    def __exit__(self, *args):
+        for name in CACHE_METHODS:
+            delattr(self.cache, name)
+
+    def _wrap(self, name, method):
+        def wrapper(*args, **kwargs):
+            if self._depth == 0:
+                self.calls.append('%s(%s)' % (name, ', '.join(repr(a) for a in args)))
+            self._depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+        return wrapper
+
+
+class Budget(object):
+
+    """Context manager that captures queries and cache calls."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, cache_alias='default'):
+        self.queries = CaptureQueriesContext(connections[using])
+        self.cache = CaptureCacheContext(cache_alias)
+
+    def __enter__(self):
+        self.queries.__enter__()
+        self.cache.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.cache.__exit__(*args)
+        self.queries.__exit__(*args)
+
+    @property
+    def sql(self):
+        return [parse_query(q['sql']) for q in self.queries.captured_queries]
+
+    def report(self, expected_queries=None):
+        """Return a readable summary of the queries and cache calls."""
+        lines = ["Queries issued (%s):" % len(self.sql)]
+        counts = OrderedDict()
+        for sql in self.sql:
+            key = normalize(sql)
+            counts[key] = counts.get(key, 0) + 1
+        for sql, count in counts.items():
+            lines.append("  %s%s" % ("[x%s] " % count if count > 1 else "", sql))
+        if expected_queries is not None:
+            lines.append("Diff against expected queries:")
+            lines.extend(
+                "  %s" % line for line in difflib.unified_diff(
+                    [normalize(q) for q in expected_queries],
+                    [normalize(q) for q in self.sql],
+                    'expected', 'actual', lineterm=''
+                )
+            )
+        lines.append("Cache calls (%s):" % len(self.cache))
+        lines.extend("  %s" % call for call in self.cache.calls)
+        return '\n'.join(lines)
+
+
+class _BudgetAssertion(Budget):
+
+    def __init__(self, test_case, queries, cache, expected_queries, **kwargs):
+        super(_BudgetAssertion, self).__init__(**kwargs)
+        self.test_case = test_case
+        self.num_queries = queries
+        self.num_cache = cache
+        self.expected_queries = expected_queries
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_BudgetAssertion, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        failures = []
+        if self.num_queries is not None and len(self.sql) != self.num_queries:
+            failures.append("%s queries executed, %s expected" % (len(self.sql), self.num_queries))
+        if self.expected_queries is not None:
+            if [normalize(q) for q in self.expected_queries] != [normalize(q) for q in self.sql]:
+                failures.append("Queries do not match the expected queries")
+        if self.num_cache is not None and len(self.cache) != self.num_cache:
+            failures.append("%s cache calls made, %s expected" % (len(self.cache), self.num_cache))
+        if failures:
+            self.test_case.fail(
+                '\n'.join(failures + [self.report(self.expected_queries)])
+            )
+
+
+class QueryBudgetMixin(object):
+
+    """TestCase mixin providing the assertBudget context manager."""
+
+    def assertBudget(self, queries=None, cache=None, expected_queries=None,
+                     using=DEFAULT_DB_ALIAS, cache_alias='default'):
+        """Assert the exact number of queries and / or cache calls made.
+
+        Kwargs:
+            queries: int, the number of DB queries expected.
+            cache: int, the number of cache calls expected.
+            expected_queries: list of SQL strings - if passed, the queries
+                issued must match these (ignoring literal values).
+
+        """
+        return _BudgetAssertion(
+            self, queries, cache, expected_queries,
+            using=using, cache_alias=cache_alias
+        )
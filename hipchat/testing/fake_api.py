@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the HipChat v2 API.
+
+FakeHipChatServer runs a threaded HTTP server on localhost that mimics
+the API endpoints used by this app, so that the notification, glance and
+token code can be load tested - and its handling of errors and rate
+limiting exercised - without network access.
+
+>>> with FakeHipChatServer(latency=0.05, error_rate=0.1) as server:
+...     with server.settings():
+...         send_room_message(123, "Hello")
+...     server.requests[0].payload
+{u'message': u'Hello', ...}
+
+Supported endpoints:
+
+    POST /v2/room/{id}/notification     - 204
+    POST /v2/user/{id}/message          - 204
+    POST /v2/addon/ui[/room|user/{id}]  - 204
+    POST /v2/oauth/token                - 200, with an access token
+    GET /v2/room/{id_or_name}           - 200, or 404 if not in rooms
+    GET /v2/user/{id_or_email}          - 200, or 404 if not in users
+
+Rooms and users are configured as dicts of name (or email) -> id.
+
+Faults are configured on the server (and can be changed while running):
+
+    latency: seconds to wait before responding, either a number or a
+        (min, max) tuple from which a random value is chosen.
+    rate_limit: max number of requests per rate_limit_period - requests
+        over the limit get a 429 with the HipChat rate limit headers.
+    error_rate: fraction (0-1) of requests that get a 500 response.
+    drop_rate: fraction (0-1) of requests where the connection is closed
+        without sending a response.
+
+"""
+import BaseHTTPServer
+from collections import namedtuple
+import json
+import random
+import re
+import SocketServer
+import threading
+import time
+import urllib
+
+from django.test.utils import override_settings
+
+# a request received by the server
+ReceivedRequest = namedtuple(
+    'ReceivedRequest',
+    ['method', 'path', 'endpoint', 'headers', 'body', 'payload', 'status']
+)
+
+ENDPOINTS = (
+    ('room_notification', re.compile(r'^/v2/room/(?P<id>[^/]+)/notification$')),
+    ('user_message', re.compile(r'^/v2/user/(?P<id>[^/]+)/message$')),
+    ('addon_ui', re.compile(r'^/v2/addon/ui(/(room|user)/(?P<id>[^/]+))?$')),
+    ('oauth_token', re.compile(r'^/v2/oauth/token$')),
+    ('room', re.compile(r'^/v2/room/(?P<id>[^/]+)$')),
+    ('user', re.compile(r'^/v2/user/(?P<id>[^/]+)$')),
+)
+
+TOKEN_RESPONSE = {
+    'access_token': 'fake-access-token',
+    'expires_in': 3599,
+    'group_id': 1,
+    'group_name': 'Fake Group',
+    'scope': 'send_notification view_group',
+    'token_type': 'bearer'
+}
+
+
+class RateLimiter(object):
+
+    """Fixed-window request counter, as per the HipChat rate limits."""
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.window_start = time.time()
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        """Record a request; return (allowed, remaining, reset_timestamp)."""
+        with self._lock:
+            now = time.time()
+            if now - self.window_start >= self.period:
+                self.window_start = now
+                self.count = 0
+            self.count += 1
+            reset = int(self.window_start + self.period)
+            return self.count <= self.limit, max(self.limit - self.count, 0), reset
+
+
+class FakeHipChatHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """Request handler for the fake API - see FakeHipChatServer."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api_request()
+
+    def do_POST(self):
+        self.handle_api_request()
+
+    def send_json(self, status, data=None, headers=None):
+        body = '' if data is None else json.dumps(data)
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_api_request(self):
+        fake = self.server.fake
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+        endpoint = fake.match(self.path.split('?')[0])
+
+        latency = fake.get_latency()
+        if latency:
+            time.sleep(latency)
+
+        if fake.should(fake.drop_rate):
+            fake.record(self, endpoint, body, 'dropped')
+            self.close_connection = 1
+            return
+        status, data, headers = self.get_response(fake, endpoint, self.path.split('?')[0])
+        # record before responding, so that the client always sees it
+        fake.record(self, endpoint, body, status)
+        self.send_json(status, data, headers)
+
+    def get_response(self, fake, endpoint, path):
+        """Return (status, data, headers) for a request."""
+        if endpoint is None:
+            return 404, {'error': {'code': 404, 'message': 'Not found'}}, None
+        headers = {}
+        if fake.rate_limiter is not None:
+            allowed, remaining, reset = fake.rate_limiter.hit()
+            headers = {
+                'X-Ratelimit-Limit': str(fake.rate_limiter.limit),
+                'X-Ratelimit-Remaining': str(remaining),
+                'X-Ratelimit-Reset': str(reset),
+            }
+            if not allowed:
+                headers['Retry-After'] = str(max(reset - int(time.time()), 1))
+                return 429, {'error': {'code': 429, 'message': 'Rate limit exceeded'}}, headers
+        if fake.should(fake.error_rate):
+            return 500, {'error': {'code': 500, 'message': 'Server error'}}, headers
+        if endpoint == 'oauth_token':
+            return 200, fake.token_response, headers
+        if endpoint in ('room', 'user'):
+            entity = fake.lookup(endpoint, path)
+            if entity is None:
+                return 404, {'error': {'code': 404, 'message': 'Not found'}}, headers
+            return 200, entity, headers
+        return 204, None, headers
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeHipChatServer(object):
+
+    """Fake HipChat v2 API running on a local port.
+
+    Use as a context manager, or call start() / stop() explicitly. All
+    requests are recorded in the requests list.
+
+    """
+
+    def __init__(self, latency=0, rate_limit=None, rate_limit_period=300,
+                 error_rate=0, drop_rate=0, token_response=None,
+                 rooms=None, users=None, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.rate_limiter = None
+        if rate_limit is not None:
+            self.rate_limiter = RateLimiter(rate_limit, rate_limit_period)
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.token_response = token_response or TOKEN_RESPONSE
+        self.rooms = rooms or {}
+        self.users = users or {}
+        self.address = (host, port)
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __repr__(self):
+        return "<FakeHipChatServer url='%s'>" % (self.url if self._server else None)
+
+    @property
+    def url(self):
+        """The API root URL, for use as the HIPCHAT_API_ROOT setting."""
+        host, port = self._server.server_address
+        return 'http://%s:%s/v2/' % (host, port)
+
+    def start(self):
+        """Start serving requests on a background thread."""
+        self._server = _ThreadedHTTPServer(self.address, FakeHipChatHandler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+
+    def settings(self):
+        """Return an override_settings that points the app at this server."""
+        return override_settings(HIPCHAT_API_ROOT=self.url)
+
+    def match(self, path):
+        """Return the name of the endpoint matching a path, or None."""
+        for name, pattern in ENDPOINTS:
+            if pattern.match(path):
+                return name
+        return None
+
+    def lookup(self, endpoint, path):
+        """Return the room / user JSON for a request path, or None."""
+        key = urllib.unquote(path.rsplit('/', 1)[1]).decode('utf-8')
+        entities = self.rooms if endpoint == 'room' else self.users
+        for name, id in entities.items():
+            if key in (name, unicode(id)):
+                if endpoint == 'room':
+                    return {'id': id, 'name': name}
+                return {'id': id, 'email': name}
+        return None
+
+    def get_latency(self):
+        if isinstance(self.latency, (tuple, list)):
+            return random.uniform(*self.latency)
+        return self.latency
+
+    def should(self, rate):
+        """Return True with probability rate."""
+        return rate > 0 and random.random() < rate
+
+    def record(self, handler, endpoint, body, status):
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            # e.g. form-encoded token requests
+            payload = body
+        request = ReceivedRequest(
+            method=handler.command,
+            path=handler.path,
+            endpoint=endpoint,
+            headers=dict(handler.headers.items()),
+            body=body,
+            payload=payload,
+            status=status
+        )
+        with self._lock:
+            self.requests.append(request)
+
+    def requests_to(self, endpoint):
+        """Return the recorded requests for an endpoint name."""
+        with self._lock:
+            return [r for r in self.requests if r.endpoint == endpoint]
+
+    def reset(self):
+        """Clear the recorded requests."""
+        with self._lock:
+            del self.requests[:]
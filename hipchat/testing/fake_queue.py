@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""In-process stand-in for an RQ queue.
+
+FakeQueue implements the parts of the rq.Queue API used by the
+hipchat.dispatch.RQBackend, so that queued dispatch can be tested
+without Redis:
+
+>>> queue = FakeQueue()
+>>> backend = RQBackend(queue=queue)
+>>> backend.dispatch(send_room_message, 123, "Hello")
+>>> queue.count
+1
+>>> queue.work()
+1
+
+As with RQ, the job function and arguments are pickled when the job is
+enqueued (and unpickled when it is run), so arguments that could not be
+sent via Redis fail here too.
+
+"""
+import itertools
+import pickle
+import sys
+import threading
+
+QUEUED = 'queued'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+_job_ids = itertools.count(1)
+
+
+class FakeJob(object):
+
+    """A queued function call."""
+
+    def __init__(self, data, origin):
+        self.id = str(next(_job_ids))
+        self.data = data
+        self.origin = origin
+        self.status = QUEUED
+        self.result = None
+        self.exc_info = None
+
+    def __repr__(self):
+        return "<FakeJob id=%s status=%s>" % (self.id, self.status)
+
+    @property
+    def func(self):
+        return pickle.loads(self.data)[0]
+
+    @property
+    def args(self):
+        return pickle.loads(self.data)[1]
+
+    @property
+    def kwargs(self):
+        return pickle.loads(self.data)[2]
+
+    def perform(self):
+        """Run the job, recording its result or exception."""
+        func, args, kwargs = pickle.loads(self.data)
+        try:
+            self.result = func(*args, **kwargs)
+            self.status = FINISHED
+        except Exception:
+            self.exc_info = sys.exc_info()
+            self.status = FAILED
+        return self.result
+
+
+class FakeQueue(object):
+
+    """Fake rq.Queue, see module docstring.
+
+    Kwargs:
+        name: string, the queue name.
+        async: bool, if False jobs are run as soon as they are enqueued
+            (as per rq.Queue(async=False)).
+
+    """
+
+    def __init__(self, name='default', async=True):
+        self.name = name
+        self.async = async
+        self.jobs = []
+        self.finished = []
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def count(self):
+        """The number of queued jobs."""
+        with self._lock:
+            return len(self.jobs)
+
+    def is_empty(self):
+        return self.count == 0
+
+    def enqueue_call(self, func, args=None, kwargs=None, **options):
+        job = FakeJob(pickle.dumps((func, args or (), kwargs or {})), self.name)
+        if not self.async:
+            self._perform(job)
+            return job
+        with self._lock:
+            self.jobs.append(job)
+        return job
+
+    def enqueue(self, func, *args, **kwargs):
+        return self.enqueue_call(func, args=args, kwargs=kwargs)
+
+    def empty(self):
+        """Remove all queued jobs."""
+        with self._lock:
+            del self.jobs[:]
+
+    def work(self):
+        """Run all queued jobs (in order), returning the number run."""
+        count = 0
+        while True:
+            with self._lock:
+                if not self.jobs:
+                    return count
+                job = self.jobs.pop(0)
+            self._perform(job)
+            count += 1
+
+    def _perform(self, job):
+        job.perform()
+        (self.finished if job.status == FINISHED else self.failed).append(job)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from hipchat import models
+from hipchat.admin import EstimatedCountPaginator
+
+
+class InstallAdminTests(TestCase):
+
+    """Test suite for the Install admin."""
+
+    def setUp(self):
+        cache.clear()
+        self.model_admin = admin.site._registry[models.Install]
+        app = models.Addon(key="foo").save()
+        self.installs = [
+            models.Install(app=app, oauth_id="install-%s" % i, group_id=1).save()
+            for i in range(3)
+        ]
+
+    def test_get_cached_tokens(self):
+        install = self.installs[0]
+        cache.set(install.cache_key, {'access_token': 'foo'})
+        self.assertEqual(
+            models.Install.get_cached_tokens(self.installs),
+            {install.oauth_id: {'access_token': 'foo'}}
+        )
+
+    def test_token_ttl(self):
+        self.assertIsNone(models.Install.token_ttl(None))
+        self.assertIsNone(models.Install.token_ttl({'access_token': 'foo'}))
+        token = {'access_token': 'foo', 'expires_at': time.time() + 100}
+        self.assertTrue(98 <= models.Install.token_ttl(token) <= 100)
+        token = {'access_token': 'foo', 'expires_at': time.time() - 100}
+        self.assertEqual(models.Install.token_ttl(token), 0)
+
+    def test_columns_without_changelist(self):
+        install = self.installs[0]
+        self.assertFalse(self.model_admin.has_access_token(install))
+        self.assertIsNone(self.model_admin.token_ttl(install))
+        cache.set(install.cache_key, {'access_token': 'foo', 'expires_at': time.time() + 100})
+        self.assertTrue(self.model_admin.has_access_token(install))
+        self.assertIsNotNone(self.model_admin.token_ttl(install))
+
+    def test_changelist(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        install = self.installs[1]
+        cache.set(install.cache_key, {'access_token': 'foo', 'expires_at': time.time() + 100})
+        resp = self.client.get(reverse('admin:hipchat_install_changelist'))
+        self.assertEqual(resp.status_code, 200)
+        results = resp.context['cl'].result_list
+        self.assertEqual(
+            [obj._cached_token is not None for obj in results],
+            [False, True, False]
+        )
+
+
+class GlanceUpdateAdminTests(TestCase):
+
+    """Test suite for the GlanceUpdate admin."""
+
+    def setUp(self):
+        app = models.Addon(key="foo").save()
+        self.glances = [models.Glance(app=app, key="glance-%s" % i).save() for i in range(2)]
+        self.updates = [
+            models.GlanceUpdate(glance=glance, label_value="update %s" % i).save()
+            for i in range(3) for glance in self.glances
+        ]
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+    def test_latest_per_glance(self):
+        self.assertEqual(
+            set(models.GlanceUpdate.objects.latest_per_glance()),
+            set(self.updates[-2:])
+        )
+        self.assertEqual(
+            list(models.GlanceUpdate.objects.filter(glance=self.glances[0]).latest_per_glance()),
+            [self.updates[-2]]
+        )
+
+    @override_settings(HIPCHAT_ADMIN_COUNT_LIMIT=4)
+    def test_paginator_count_limit(self):
+        paginator = EstimatedCountPaginator(models.GlanceUpdate.objects.all(), 2)
+        self.assertEqual(paginator.count, 4)
+        self.assertEqual(paginator.num_pages, 2)
+        paginator = EstimatedCountPaginator(models.GlanceUpdate.objects.filter(glance=self.glances[0]), 2)
+        self.assertEqual(paginator.count, 3)
+
+    def test_changelist(self):
+        url = reverse('admin:hipchat_glanceupdate_changelist')
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['cl'].result_count, 6)
+        self.assertEqual(list(resp.context['cl'].result_list)[0], self.updates[-1])
+        resp = self.client.get(url, {'history': 'latest'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(set(resp.context['cl'].result_list), set(self.updates[-2:]))
+        resp = self.client.get(url, {'glance__id__exact': self.glances[0].id, 'created_at__gte': '2000-01-01'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['cl'].result_count, 3)
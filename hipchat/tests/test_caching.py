@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.test import TestCase
+
+from hipchat.caching import BoundedCache
+
+
+class BoundedCacheTests(TestCase):
+
+    """Test suite for the BoundedCache object."""
+
+    def test_get_set(self):
+        cache = BoundedCache()
+        self.assertIsNone(cache.get('foo'))
+        self.assertEqual(cache.get('foo', 'bar'), 'bar')
+        cache.set('foo', 1)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertTrue('foo' in cache)
+        cache.delete('foo')
+        self.assertFalse('foo' in cache)
+
+    def test_maxsize(self):
+        cache = BoundedCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # reading 'a' makes 'b' the least recently used
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_timeout(self):
+        cache = BoundedCache(timeout=10)
+        with mock.patch('hipchat.caching.time.time', lambda: 100):
+            cache.set('a', 1)
+            cache.set('b', 2, timeout=20)
+        with mock.patch('hipchat.caching.time.time', lambda: 115):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b'), 2)
+
+    def test_clear(self):
+        cache = BoundedCache()
+        cache.set('a', 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
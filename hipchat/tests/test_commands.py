@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import csv
+import datetime
+import gzip
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from hipchat import serialization
+from hipchat.management.commands.export_glance_updates import FIELDS
+from hipchat.management.commands.hipchat_loadtest import parse_mix
+from hipchat.models import Addon, Glance, GlanceUpdate
+
+
+class LoadTestCommandTests(TestCase):
+
+    """Test suite for the hipchat_loadtest command."""
+
+    def test_parse_mix(self):
+        self.assertEqual(
+            parse_mix('glance=80, descriptor=20'),
+            {'glance': 80, 'descriptor': 20}
+        )
+        self.assertRaises(CommandError, parse_mix, 'foo=1')
+        self.assertRaises(CommandError, parse_mix, 'glance=x')
+        self.assertRaises(CommandError, parse_mix, 'glance=0')
+
+
+class ExportGlanceUpdatesCommandTests(TestCase):
+
+    """Test suite for the export_glance_updates command."""
+
+    def setUp(self):
+        self.app = Addon.objects.create(key="foo", name="Foo")
+        self.glance = Glance.objects.create(app=self.app, key="bar", name="Bar")
+        self.other = Glance.objects.create(app=self.app, key="baz", name="Baz")
+        self.updates = [
+            GlanceUpdate.objects.create(
+                glance=glance,
+                label_value=u"Café %s" % i,
+                created_at=datetime.datetime(2016, 1, i + 1)
+            )
+            for i, glance in enumerate([self.glance, self.other] * 3)
+        ]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def export(self, **options):
+        stdout = StringIO()
+        call_command('export_glance_updates', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_ndjson(self):
+        rows = [serialization.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([r['id'] for r in rows], [u.id for u in self.updates])
+        self.assertEqual(rows[0]['label_value'], u"Café 0")
+        self.assertEqual(rows[0]['glance__key'], "bar")
+        self.assertEqual(rows[0]['created_at'], "2016-01-01T00:00:00")
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.export(format='csv'))))
+        self.assertEqual(tuple(rows[0]), FIELDS)
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1][FIELDS.index('label_value')], u"Café 0".encode('utf-8'))
+
+    def test_filters(self):
+        rows = [
+            serialization.loads(line) for line in
+            self.export(glances=[self.glance.id], since='2016-01-02', until='2016-01-05').splitlines()
+        ]
+        self.assertEqual([r['id'] for r in rows], [self.updates[2].id])
+        self.assertRaises(CommandError, self.export, since='yesterday')
+        self.assertRaises(CommandError, self.export, format='xml')
+        self.assertRaises(CommandError, self.export, resume=True)
+
+    def test_chunked_queries(self):
+        # one query per chunk, plus the final empty one
+        with self.assertNumQueries(4):
+            lines = self.export(chunk_size=2).splitlines()
+        self.assertEqual(len(lines), 6)
+
+    def test_gzip_resume(self):
+        path = os.path.join(self.tmpdir, 'updates.csv.gz')
+        self.export(format='csv', output=path, after_id=self.updates[3].id)
+        with open(path + '.last_id') as f:
+            self.assertEqual(int(f.read()), self.updates[5].id)
+        GlanceUpdate.objects.create(glance=self.glance, label_value="New")
+        # appends a new gzip member, without a second header
+        self.export(format='csv', output=path, resume=True, chunk_size=1)
+        with gzip.open(path) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(tuple(rows[0]), FIELDS)
+        self.assertEqual([r[-1] for r in rows[1:]], ["", "", ""])
+        self.assertEqual(
+            [r[FIELDS.index('label_value')] for r in rows[1:]],
+            ["Café 4", "Café 5", "New"]
+        )
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import json
+from StringIO import StringIO
+
+import mock
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase, RequestFactory, override_settings
+
+from hipchat import descriptors
+from hipchat import models
+from hipchat import views
+
+
+class DescriptorCacheTests(TransactionTestCase):
+
+    """Test suite for the cached add-on descriptors."""
+
+    fixtures = ['scopes.json']
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.app = models.Addon(key=u"∂ƒ©˙∆˚").save()
+
+    def assertCached(self, cached=True):
+        key = descriptors.cache_key(self.app.id)
+        self.assertEqual(cache.get(key) is not None, cached)
+
+    def test_get_serialized_descriptor(self):
+        content, etag = descriptors.get_serialized_descriptor(self.app.id)
+        self.assertEqual(json.loads(content), self.app.descriptor())
+        self.assertCached()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                descriptors.get_serialized_descriptor(self.app.id),
+                (content, etag)
+            )
+
+    def test_get_serialized_descriptor_missing(self):
+        self.assertRaises(
+            models.Addon.DoesNotExist,
+            descriptors.get_serialized_descriptor,
+            0
+        )
+
+    def test_view_etag(self):
+        request = self.factory.get('/')
+        resp = views.descriptor(request, app_id=self.app.id)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=etag)
+        resp = views.descriptor(request, app_id=self.app.id)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], etag)
+
+    def test_late_write_not_served(self):
+        # a request that read the old rows before the change was committed
+        # writes its descriptor under the previous generation's key
+        key = descriptors.cache_key(self.app.id)
+        descriptors.invalidate(self.app.id)
+        cache.set(key, {models.get_base_url(): ("stale", '"etag"')})
+        content, _ = descriptors.get_serialized_descriptor(self.app.id)
+        self.assertNotEqual(content, "stale")
+
+    def test_invalidate_on_addon_save(self):
+        descriptors.get_serialized_descriptor(self.app.id)
+        self.app.name = "foo"
+        self.app.save()
+        self.assertCached(False)
+        content, _ = descriptors.get_serialized_descriptor(self.app.id)
+        self.assertEqual(json.loads(content)['name'], "foo")
+
+    def test_invalidate_on_glance_save(self):
+        descriptors.get_serialized_descriptor(self.app.id)
+        glance = models.Glance(app=self.app, key="foo").save()
+        self.assertCached(False)
+        descriptors.get_serialized_descriptor(self.app.id)
+        glance.delete()
+        self.assertCached(False)
+
+    def test_invalidate_on_scopes_changed(self):
+        scope = models.Scope.objects.first()
+        descriptors.get_serialized_descriptor(self.app.id)
+        self.app.scopes.add(scope)
+        self.assertCached(False)
+        descriptors.get_serialized_descriptor(self.app.id)
+        scope.addon_set.remove(self.app)
+        self.assertCached(False)
+        descriptors.get_serialized_descriptor(self.app.id)
+        scope.name = "foo"
+        scope.save()
+        self.assertCached(False)
+
+    def test_invalidate_on_site_save(self):
+        descriptors.get_serialized_descriptor(self.app.id)
+        site = Site.objects.get_current()
+        site.domain = "foo.com"
+        site.save()
+        self.assertCached(False)
+
+
+class BulkDescriptorTests(TransactionTestCase):
+
+    """Test suite for building descriptors in bulk."""
+
+    fixtures = ['scopes.json']
+
+    def create_addons(self, count, start=0):
+        scopes = list(models.Scope.objects.all()[:3])
+        for i in range(start, start + count):
+            app = models.Addon(key="app-%s" % i).save()
+            app.scopes.add(*scopes)
+            models.Glance(app=app, key="glance-%s" % i).save()
+
+    def test_iter_descriptors(self):
+        self.create_addons(3)
+        output = list(descriptors.iter_descriptors())
+        self.assertEqual(len(output), 3)
+        for addon, descriptor in output:
+            self.assertEqual(descriptor, models.Addon.objects.get(id=addon.id).descriptor())
+
+    def test_iter_descriptors_num_queries(self):
+        base_url = "https://foo.com"
+        self.create_addons(1)
+        # addons, scopes, glances, webhooks
+        with self.assertNumQueries(4):
+            list(descriptors.iter_descriptors(base_url=base_url))
+        self.create_addons(10, start=1)
+        with self.assertNumQueries(4):
+            list(descriptors.iter_descriptors(base_url=base_url))
+
+    def test_export_descriptors_command(self):
+        self.create_addons(2)
+        out = StringIO()
+        call_command('export_descriptors', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([json.loads(l)['key'] for l in lines], ['app-0', 'app-1'])
+        out = StringIO()
+        call_command('export_descriptors', keys=['app-1'], stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+
+class BaseUrlTests(TransactionTestCase):
+
+    """Test suite for the cached base URL used in descriptors."""
+
+    def setUp(self):
+        cache.clear()
+        models.clear_domain_cache()
+        self.factory = RequestFactory()
+
+    def test_get_domain_cached(self):
+        Site.objects.clear_cache()
+        with self.assertNumQueries(1):
+            self.assertEqual(models.get_domain(), Site.objects.get_current().domain)
+        with self.assertNumQueries(0):
+            models.get_domain()
+        site = Site.objects.get_current()
+        site.domain = "foo.com"
+        site.save()
+        self.assertEqual(models.get_domain(), "foo.com")
+
+    def test_get_domain_expires(self):
+        # changes made by other processes are picked up after the timeout
+        Site.objects.clear_cache()
+        with override_settings(HIPCHAT_DOMAIN_CACHE_TIMEOUT=-1):
+            models.get_domain()
+        Site.objects.filter(id=settings.SITE_ID).update(domain="bar.com")
+        Site.objects.clear_cache()
+        with self.assertNumQueries(1):
+            self.assertEqual(models.get_domain(), "bar.com")
+        with self.assertNumQueries(0):
+            self.assertEqual(models.get_domain(), "bar.com")
+
+    def test_get_base_url(self):
+        with mock.patch('hipchat.models.get_domain', lambda: 'foo.com'):
+            self.assertEqual(models.get_base_url(), "https://foo.com")
+            with override_settings(USE_SSL=False):
+                self.assertEqual(models.get_base_url(), "http://foo.com")
+
+    def test_get_base_url_from_request(self):
+        request = self.factory.get('/', HTTP_HOST='bar.com')
+        with mock.patch('hipchat.models.get_domain', lambda: 'foo.com'):
+            self.assertEqual(models.get_base_url(request), "https://foo.com")
+            with override_settings(HIPCHAT_BASE_URL_FROM_REQUEST=True):
+                self.assertEqual(models.get_base_url(request), "http://bar.com")
+
+    def test_descriptor_per_base_url(self):
+        app = models.Addon(key="foo").save()
+        content1, _ = descriptors.get_serialized_descriptor(app.id, "https://foo.com")
+        content2, _ = descriptors.get_serialized_descriptor(app.id, "https://bar.com")
+        self.assertTrue("https://foo.com/" in content1)
+        self.assertTrue("https://bar.com/" in content2)
+        # both are invalidated together
+        app.save()
+        self.assertIsNone(cache.get(descriptors.cache_key(app.id)))
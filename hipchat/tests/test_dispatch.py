@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+import logging
+import pickle
+import threading
+import time
+
+import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from hipchat import dispatch
+from hipchat import models
+from hipchat import notifications
+from hipchat.logger import LogHandler
+from hipchat.testing import FakeQueue
+
+
+def add(x, y):
+    return x + y
+
+
+def fail():
+    raise Exception("Boom")
+
+
+class BackendTests(TestCase):
+
+    """Test suite for the dispatch backends."""
+
+    def test_sync(self):
+        self.assertEqual(dispatch.SyncBackend().dispatch(add, 1, y=2), 3)
+
+    def test_thread_pool(self):
+        backend = dispatch.ThreadPoolBackend(workers=2)
+        results = []
+        for i in range(10):
+            self.assertTrue(backend.dispatch(results.append, i))
+        backend.dispatch(fail)
+        backend.join()
+        self.assertEqual(sorted(results), range(10))
+        self.assertEqual(len(backend.threads), 2)
+
+    def test_thread_pool_full(self):
+        backend = dispatch.ThreadPoolBackend(workers=1, max_queue_size=1)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        backend.dispatch(block)
+        started.wait()
+        self.assertTrue(backend.dispatch(add, 1, 2))
+        self.assertFalse(backend.dispatch(add, 1, 2))
+        release.set()
+        backend.join()
+
+    def test_rq(self):
+        queue = FakeQueue('hipchat')
+        backend = dispatch.RQBackend(queue=queue)
+        job = backend.dispatch(add, 1, y=2)
+        self.assertEqual(queue.count, 1)
+        self.assertEqual(job.func, dispatch.perform)
+        self.assertEqual(job.args, (add, (1,), {'y': 2}))
+        self.assertEqual(queue.work(), 1)
+        self.assertEqual(job.result, 3)
+        backend.dispatch(fail)
+        queue.work()
+        self.assertEqual(len(queue.failed), 1)
+
+    def test_rq_queue_path(self):
+        backend = dispatch.RQBackend(queue_name='foo', queue='hipchat.testing.FakeQueue')
+        self.assertIsInstance(backend.queue, FakeQueue)
+        self.assertEqual(backend.queue.name, 'foo')
+
+    def test_rq_unpicklable(self):
+        backend = dispatch.RQBackend(queue=FakeQueue())
+        self.assertRaises(
+            (pickle.PicklingError, TypeError),
+            backend.dispatch, add, 1, threading.Lock()
+        )
+
+    def test_get_backend(self):
+        dispatch.reset_backend()
+        self.assertIsInstance(dispatch.get_backend(), dispatch.SyncBackend)
+        with override_settings(
+            HIPCHAT_DISPATCH_BACKEND='hipchat.dispatch.RQBackend',
+            HIPCHAT_DISPATCH_OPTIONS={'queue': 'hipchat.testing.FakeQueue'}
+        ):
+            self.assertIsInstance(dispatch.get_backend(), dispatch.RQBackend)
+        self.assertIsInstance(dispatch.get_backend(), dispatch.SyncBackend)
+
+
+@override_settings(
+    HIPCHAT_DISPATCH_BACKEND='hipchat.dispatch.RQBackend',
+    HIPCHAT_DISPATCH_OPTIONS={'queue': 'hipchat.testing.FakeQueue'}
+)
+class QueuedDispatchTests(TestCase):
+
+    """Test that outbound calls are sent via the dispatch backend."""
+
+    def setUp(self):
+        self.queue = dispatch.get_backend().queue
+        for priority in (dispatch.HIGH, dispatch.NORMAL, dispatch.LOW):
+            dispatch.get_backend().get_queue(priority).empty()
+
+    @mock.patch('requests.post')
+    def test_send_room_message(self, post):
+        post.return_value = mock.Mock(status_code=204)
+        notifications.send_room_message(123, "Hello", auth_token='token')
+        notifications.send_user_message('foo@bar.com', "Hello", auth_token='token')
+        self.assertEqual(post.call_count, 0)
+        self.assertEqual([j.args[0] for j in self.queue.jobs], [notifications._call_api] * 2)
+        self.assertEqual(self.queue.work(), 2)
+        self.assertEqual(post.call_count, 2)
+
+    def test_log_handler(self):
+        handler = LogHandler('token', 123)
+        handler.emit(logging.makeLogRecord({'msg': "Hello", 'levelname': 'ERROR', 'levelno': logging.ERROR}))
+        # ERROR messages are HIGH priority
+        queue = dispatch.get_backend().get_queue(dispatch.HIGH)
+        func, args, kwargs = queue.jobs[0].args
+        self.assertEqual(func, notifications._call_api)
+        self.assertEqual(args[1], "Hello")
+        self.assertEqual(kwargs['color'], 'red')
+
+    def test_glance_push(self):
+        cache.clear()
+        app = models.Addon(key="foo").save()
+        glance = models.Glance(app=app, key="bar").save()
+        install = models.Install(app=app, oauth_id="abc", group_id=1).save()
+        cache.set(install.cache_key, {'access_token': 'token'})
+        glance.update_room(123, "foo")
+        self.assertEqual(self.queue.count, 1)
+        self.assertEqual(self.queue.jobs[0].args[0].__name__, 'post_json')
+
+    @mock.patch('requests.post')
+    def test_color_priorities(self, post):
+        backend = dispatch.get_backend()
+        notifications.red(123, "Alert")
+        notifications.gray(123, "Noise")
+        notifications.yellow(123, "Info")
+        notifications.send_room_message(123, "Explicit", color='gray', priority=dispatch.HIGH)
+        self.assertEqual(backend.get_queue(dispatch.HIGH).count, 2)
+        self.assertEqual(backend.get_queue(dispatch.NORMAL).count, 1)
+        self.assertEqual(backend.get_queue(dispatch.LOW).count, 1)
+        self.assertEqual(backend.get_queue(dispatch.LOW).name, 'hipchat-low')
+
+
+class PriorityTests(TestCase):
+
+    """Test suite for dispatch priorities."""
+
+    def setUp(self):
+        dispatch.rate_limit.clear()
+
+    def tearDown(self):
+        dispatch.rate_limit.clear()
+
+    def test_priority_for_color(self):
+        self.assertEqual(dispatch.priority_for_color('red'), dispatch.HIGH)
+        self.assertEqual(dispatch.priority_for_color('yellow'), dispatch.NORMAL)
+        self.assertEqual(dispatch.priority_for_color('gray'), dispatch.LOW)
+
+    def test_priority_for_level(self):
+        self.assertEqual(dispatch.priority_for_level(logging.CRITICAL), dispatch.HIGH)
+        self.assertEqual(dispatch.priority_for_level(logging.ERROR), dispatch.HIGH)
+        self.assertEqual(dispatch.priority_for_level(logging.WARNING), dispatch.NORMAL)
+        self.assertEqual(dispatch.priority_for_level(logging.INFO), dispatch.NORMAL)
+        self.assertEqual(dispatch.priority_for_level(logging.DEBUG), dispatch.LOW)
+
+    def test_thread_pool_order(self):
+        backend = dispatch.ThreadPoolBackend(workers=1)
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def block():
+            started.set()
+            release.wait()
+
+        backend.submit(block)
+        started.wait()
+        backend.submit(results.append, ('low',), priority=dispatch.LOW)
+        backend.submit(results.append, ('normal 1',))
+        backend.submit(results.append, ('high',), priority=dispatch.HIGH)
+        backend.submit(results.append, ('normal 2',))
+        release.set()
+        backend.join()
+        self.assertEqual(results, ['high', 'normal 1', 'normal 2', 'low'])
+
+    def test_thread_pool_shedding(self):
+        backend = dispatch.ThreadPoolBackend(workers=1, max_queue_size=2)
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def block():
+            started.set()
+            release.wait()
+
+        backend.submit(block)
+        started.wait()
+        self.assertTrue(backend.submit(results.append, ('low',), priority=dispatch.LOW))
+        self.assertTrue(backend.submit(results.append, ('normal',)))
+        # full - the low priority call is shed to make room
+        self.assertTrue(backend.submit(results.append, ('high',), priority=dispatch.HIGH))
+        # full, with nothing of lower priority to shed
+        self.assertFalse(backend.submit(results.append, ('low 2',), priority=dispatch.LOW))
+        self.assertFalse(backend.submit(results.append, ('normal 2',)))
+        release.set()
+        backend.join()
+        self.assertEqual(results, ['high', 'normal'])
+
+    def test_rate_limit_shedding(self):
+        now = int(time.time())
+        dispatch.rate_limit.update(mock.Mock(
+            status_code=204,
+            headers={'X-Ratelimit-Remaining': '5', 'X-Ratelimit-Reset': str(now + 60)}
+        ))
+        self.assertTrue(dispatch.rate_limit.saturated())
+        self.assertIsNone(dispatch.perform(add, (1, 2), {}, priority=dispatch.LOW))
+        self.assertEqual(dispatch.perform(add, (1, 2), {}, priority=dispatch.NORMAL), 3)
+        self.assertEqual(dispatch.perform(add, (1, 2), {}, priority=dispatch.HIGH), 3)
+        with override_settings(HIPCHAT_DISPATCH_RATE_LIMIT_RESERVE=5):
+            self.assertFalse(dispatch.rate_limit.saturated())
+        # the limit resets
+        dispatch.rate_limit.reset_at = now - 1
+        self.assertFalse(dispatch.rate_limit.saturated())
+
+    def test_rate_limit_429(self):
+        dispatch.rate_limit.update(mock.Mock(status_code=429, headers={}))
+        self.assertTrue(dispatch.rate_limit.saturated())
+        dispatch.rate_limit.clear()
+        dispatch.rate_limit.update(mock.Mock(status_code=204, headers={}))
+        self.assertFalse(dispatch.rate_limit.saturated())
+
+    def test_rq_max_low_queue_size(self):
+        backend = dispatch.RQBackend(queue='hipchat.testing.FakeQueue', max_low_queue_size=1)
+        self.assertIsNotNone(backend.submit(add, (1, 2), priority=dispatch.LOW))
+        self.assertIsNone(backend.submit(add, (1, 2), priority=dispatch.LOW))
+        self.assertIsNotNone(backend.submit(add, (1, 2), priority=dispatch.HIGH))
+        self.assertEqual(backend.get_queue(dispatch.LOW).count, 1)
+        self.assertEqual(backend.get_queue(dispatch.HIGH).name, 'hipchat-high')
+
+    @mock.patch('requests.post')
+    def test_call_api_updates_rate_limit(self, post):
+        post.return_value = mock.Mock(
+            status_code=204,
+            headers={'X-Ratelimit-Remaining': '0', 'X-Ratelimit-Reset': str(int(time.time()) + 60)}
+        )
+        notifications.send_room_message(123, "Hello", auth_token='token')
+        self.assertEqual(dispatch.rate_limit.remaining, 0)
+        self.assertTrue(dispatch.rate_limit.saturated())
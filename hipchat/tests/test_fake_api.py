@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import mock
+import requests
+
+from django.test import TestCase
+
+from hipchat import notifications
+from hipchat.api import post_json
+from hipchat.models import Install
+from hipchat.testing import FakeHipChatServer
+
+
+class FakeHipChatServerTests(TestCase):
+
+    """Test suite for the fake HipChat API server."""
+
+    def test_room_notification(self):
+        with FakeHipChatServer() as server:
+            with server.settings():
+                notifications.send_room_message(123, "Hello", auth_token="token")
+            self.assertEqual(len(server.requests), 1)
+            request = server.requests[0]
+            self.assertEqual(request.endpoint, 'room_notification')
+            self.assertEqual(request.path, '/v2/room/123/notification')
+            self.assertEqual(request.payload['message'], "Hello")
+            self.assertEqual(request.status, 204)
+            self.assertEqual(request.headers['authorization'], 'Bearer token')
+
+    def test_user_message_and_glance(self):
+        with FakeHipChatServer() as server:
+            with server.settings():
+                notifications.send_user_message('foo@bar.com', "Hello", auth_token="token")
+                post_json(server.url + 'addon/ui/user/1', 'token', {'glance': []})
+            self.assertEqual(len(server.requests_to('user_message')), 1)
+            self.assertEqual(server.requests_to('addon_ui')[0].payload, {'glance': []})
+
+    @mock.patch('hipchat.models.Install.token_request_payload', lambda x: {})
+    def test_oauth_token(self):
+        with FakeHipChatServer() as server:
+            with server.settings():
+                token = Install(oauth_id='abc', oauth_secret='xyz').request_access_token()
+            self.assertEqual(token['access_token'], 'fake-access-token')
+
+    def test_not_found(self):
+        with FakeHipChatServer() as server:
+            resp = requests.get(server.url + 'foo')
+            self.assertEqual(resp.status_code, 404)
+
+    def test_rate_limit(self):
+        with FakeHipChatServer(rate_limit=2) as server:
+            statuses = [requests.post(server.url + 'addon/ui').status_code for _ in range(3)]
+            self.assertEqual(statuses, [204, 204, 429])
+            resp = requests.post(server.url + 'addon/ui')
+            self.assertEqual(resp.headers['X-Ratelimit-Limit'], '2')
+            self.assertEqual(resp.headers['X-Ratelimit-Remaining'], '0')
+            self.assertTrue(int(resp.headers['Retry-After']) > 0)
+
+    def test_error_rate(self):
+        with FakeHipChatServer(error_rate=1) as server:
+            with server.settings():
+                self.assertRaises(
+                    notifications.HipChatError,
+                    notifications.send_room_message, 1, "Hello", auth_token="token"
+                )
+            self.assertEqual(server.requests[0].status, 500)
+
+    def test_drop_rate(self):
+        with FakeHipChatServer(drop_rate=1) as server:
+            self.assertRaises(
+                requests.ConnectionError, requests.post, server.url + 'addon/ui'
+            )
+            self.assertEqual(server.requests[0].status, 'dropped')
+
+    def test_latency(self):
+        server = FakeHipChatServer(latency=(0.01, 0.02))
+        for _ in range(10):
+            self.assertTrue(0.01 <= server.get_latency() <= 0.02)
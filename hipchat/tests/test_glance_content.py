@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import time
+
+import jwt
+import mock
+
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+
+from hipchat import models
+from hipchat import signals
+from hipchat import views
+
+
+class GlanceContentTests(TestCase):
+
+    """Test suite for the GlanceContent value object."""
+
+    def assertSameContent(self, **kwargs):
+        content = models.GlanceContent(u"∂ƒ©˙", **kwargs)
+        update = models.GlanceUpdate(label_value=u"∂ƒ©˙", **kwargs)
+        self.assertEqual(content.label(), update.label())
+        self.assertEqual(content.status(), update.status())
+        self.assertEqual(content.content(), update.content())
+
+    def test_content(self):
+        self.assertSameContent()
+        self.assertSameContent(lozenge=models.Lozenge(models.LOZENGE_NEW, "foo"))
+        self.assertSameContent(icons=models.Icon("www", "xyz"))
+        self.assertSameContent(metadata={'foo': 'bar'})
+        self.assertEqual(
+            models.GlanceContent("foo").content(),
+            {'label': {'type': 'html', 'value': "foo"}}
+        )
+
+    def test_immutable(self):
+        content = models.GlanceContent("foo")
+        self.assertRaises(AttributeError, setattr, content, 'label_value', "bar")
+        self.assertRaises(AttributeError, setattr, content, 'foo', "bar")
+        self.assertRaises(AttributeError, delattr, content, 'label_value')
+        self.assertFalse(hasattr(content, '__dict__'))
+
+    def test_equality(self):
+        self.assertEqual(models.GlanceContent("foo"), models.GlanceContent("foo"))
+        self.assertNotEqual(models.GlanceContent("foo"), models.GlanceContent("bar"))
+        self.assertEqual(len(set([models.GlanceContent("foo"), models.GlanceContent("foo")])), 1)
+
+    def test_to_model(self):
+        glance = models.Glance(app=models.Addon(key="foo").save(), key="bar").save()
+        content = models.GlanceContent(
+            "foo",
+            lozenge=models.Lozenge(models.LOZENGE_NEW, "bar"),
+            icons=models.Icon("www", "xyz"),
+        )
+        update = content.to_model(glance)
+        self.assertIsInstance(update, models.GlanceUpdate)
+        self.assertEqual(update.glance, glance)
+        self.assertEqual(update.lozenge, content.lozenge)
+        self.assertEqual(update.icons, content.icons)
+        self.assertEqual(update.to_content(), content)
+
+
+class GlancePushTests(TestCase):
+
+    """Test suite for the Glance update_* push methods."""
+
+    def setUp(self):
+        cache.clear()
+        self.app = models.Addon(key="foo").save()
+        self.glance = models.Glance(app=self.app, key="bar").save()
+
+    def create_install(self):
+        install = models.Install(app=self.app, oauth_id="abc", group_id=1).save()
+        cache.set(install.cache_key, {'access_token': 'token'})
+        return install
+
+    @mock.patch('hipchat.models.post_json')
+    def test_update_room(self, post_json):
+        self.create_install()
+        content = self.glance.update_room(
+            123, "foo", lozenge=models.Lozenge(models.LOZENGE_NEW, "bar")
+        )
+        self.assertIsInstance(content, models.GlanceContent)
+        post_json.assert_called_once_with(
+            models.api_url("addon/ui/room/123"),
+            'token',
+            {'glance': [{'content': content.content(), 'key': "bar"}]}
+        )
+        self.assertEqual(models.GlanceUpdate.objects.count(), 0)
+
+    @mock.patch('hipchat.models.post_json')
+    def test_update_user_record(self, post_json):
+        self.create_install()
+        update = self.glance.update_user("foo@example.com", "foo", record=True)
+        self.assertIsInstance(update, models.GlanceUpdate)
+        self.assertEqual(models.GlanceUpdate.objects.get(), update)
+        self.assertEqual(post_json.call_args[0][0], models.api_url("addon/ui/user/foo@example.com"))
+
+    @mock.patch('hipchat.models.post_json')
+    def test_update_global(self, post_json):
+        install = self.create_install()
+        with mock.patch.object(models.Glance, 'get_install') as get_install:
+            self.glance.update_global("foo", install=install)
+            self.assertEqual(get_install.call_count, 0)
+        self.assertEqual(post_json.call_args[0][0], models.api_url("addon/ui"))
+
+    def test_no_install(self):
+        self.assertRaises(models.NoValidAccessToken, self.glance.update_room, 123, "foo")
+
+
+class GlanceViewContentTests(TestCase):
+
+    """Test that the glance view accepts GlanceContent responses."""
+
+    def setUp(self):
+        self.app = models.Addon(key="foo").save()
+        self.glance = models.Glance(app=self.app, key="bar").save()
+        self.install = models.Install(
+            app=self.app, oauth_id="abc", oauth_secret="secret", group_id=1
+        ).save()
+
+    def test_glance_content_receiver(self):
+        def receiver(sender, glance, **kwargs):
+            return models.GlanceContent("from receiver")
+
+        token = jwt.encode(
+            {'iss': self.install.oauth_id, 'exp': int(time.time()) + 3600},
+            self.install.oauth_secret
+        )
+        request = RequestFactory().get('/', {'signed_request': token})
+        with mock.patch.object(signals.initialise_glance, 'receivers', []):
+            signals.initialise_glance.connect(receiver, weak=False)
+            resp = views.glance(request, glance_id=self.glance.id)
+        self.assertEqual(resp.status_code, 200)
+        update = models.GlanceUpdate.objects.get()
+        self.assertEqual(update.label_value, "from receiver")
+        self.assertEqual(update.glance, self.glance)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import mock
+import requests
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from hipchat import models
+from hipchat import resolver
+from hipchat.testing import FakeHipChatServer
+
+
+class GlancePushManyTests(TestCase):
+
+    """Test suite for Glance.update_rooms / update_users."""
+
+    @classmethod
+    def setUpClass(cls):
+        super(GlancePushManyTests, cls).setUpClass()
+        # the server is shared, as stopping it takes ~0.5s
+        cls.server = FakeHipChatServer(rooms={"Lounge": 123}).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super(GlancePushManyTests, cls).tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        resolver.ids_cache.clear()
+        self.server.reset()
+        self.server.error_rate = 0
+        self.settings = self.server.settings()
+        self.settings.enable()
+        self.app = models.Addon(key="foo").save()
+        self.glance = models.Glance(app=self.app, key="bar").save()
+        self.install = models.Install(app=self.app, oauth_id="abc", group_id=1).save()
+        cache.set(self.install.cache_key, {'access_token': 'token'})
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def test_update_rooms(self):
+        with mock.patch.object(
+            models.Install, 'get_access_token', return_value={'access_token': 'token'}
+        ) as get_access_token:
+            with mock.patch('requests.Session', wraps=requests.Session) as session:
+                results = self.glance.update_rooms(
+                    range(20), "foo",
+                    lozenge=models.Lozenge(models.LOZENGE_NEW, "bar"),
+                    workers=5
+                )
+        self.assertEqual(get_access_token.call_count, 1)
+        self.assertEqual(session.call_count, 1)
+        self.assertEqual([r.target for r in results], range(20))
+        self.assertTrue(all(r.ok and r.status_code == 204 for r in results))
+        requests_made = self.server.requests_to('addon_ui')
+        self.assertEqual(
+            sorted(r.path for r in requests_made),
+            sorted('/v2/addon/ui/room/%s' % i for i in range(20))
+        )
+        self.assertEqual(
+            requests_made[0].payload,
+            {'glance': [{'key': "bar", 'content': results[0].content.content()}]}
+        )
+        self.assertEqual(set(r.headers['authorization'] for r in requests_made), {'Bearer token'})
+        self.assertEqual(models.GlanceUpdate.objects.count(), 0)
+
+    def test_update_users_per_target(self):
+        contents = {
+            "foo@example.com": models.GlanceContent("foo"),
+            "bar@example.com": models.GlanceContent("bar"),
+        }
+        results = self.glance.update_users(contents, record=True)
+        self.assertEqual(
+            dict((r.target, r.content) for r in results),
+            contents
+        )
+        self.assertEqual(
+            sorted(r.payload['glance'][0]['content']['label']['value']
+                   for r in self.server.requests_to('addon_ui')),
+            ["bar", "foo"]
+        )
+        self.assertEqual(
+            sorted(models.GlanceUpdate.objects.values_list('label_value', flat=True)),
+            ["bar", "foo"]
+        )
+
+    def test_errors(self):
+        self.server.error_rate = 1
+        results = self.glance.update_rooms([1, 2], "foo", record=True)
+        self.assertEqual([r.status_code for r in results], [500, 500])
+        self.assertFalse(any(r.ok for r in results))
+        self.assertTrue(all(r.error for r in results))
+        self.assertEqual(models.GlanceUpdate.objects.count(), 0)
+
+    @override_settings(HIPCHAT_RESOLVE_NAMES=True)
+    def test_resolve_names(self):
+        results = self.glance.update_rooms(["Lounge", "Nope"], "foo")
+        self.assertTrue(results[0].ok)
+        self.assertEqual(results[1].status_code, None)
+        self.assertIn("Nope", results[1].error)
+        self.assertEqual(
+            [r.path for r in self.server.requests_to('addon_ui')],
+            ['/v2/addon/ui/room/123']
+        )
+
+    def test_empty(self):
+        self.assertEqual(self.glance.update_rooms([], "foo"), [])
+        self.assertRaises(AssertionError, self.glance.update_rooms, [1])
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def imported_modules(statement, modules):
+    """Run statement in a fresh interpreter, returning which modules it imported."""
+    code = "import json, sys; %s; print(json.dumps([m for m in %r if m in sys.modules]))" % (
+        statement, tuple(modules)
+    )
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='settings')
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, env=env)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class LazyImportTests(SimpleTestCase):
+
+    """Test that heavy dependencies are only imported on first use.
+
+    See benchmarks/imports.py for the corresponding import-time budgets.
+
+    """
+
+    def test_logger(self):
+        self.assertEqual(
+            imported_modules(
+                "import hipchat.logger",
+                ('requests', 'django.conf', 'hipchat.notifications')
+            ),
+            []
+        )
+
+    def test_django_setup(self):
+        self.assertEqual(
+            imported_modules(
+                "import django; django.setup()",
+                ('requests', 'jwt', 'hipchat.notifications')
+            ),
+            []
+        )
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.cache import cache
+from django.http import Http404
+from django.test import TestCase, RequestFactory, override_settings
+
+from hipchat import api
+from hipchat import metrics
+from hipchat import models
+from hipchat import notifications
+from hipchat import views
+
+
+class FunctionTests(TestCase):
+
+    """Free function tests."""
+
+    def setUp(self):
+        metrics.reset_backend()
+        self.backend = metrics.get_backend()
+
+    def test_endpoint_name(self):
+        root = api.API_V2_ROOT
+        self.assertEqual(metrics.endpoint_name(root + 'room/123/notification'), 'room/{id}/notification')
+        self.assertEqual(metrics.endpoint_name(root + 'user/foo@bar.com/message'), 'user/{id}/message')
+        self.assertEqual(metrics.endpoint_name(root + 'addon/ui/room/123'), 'addon/ui/room/{id}')
+        self.assertEqual(metrics.endpoint_name(root + 'addon/ui'), 'addon/ui')
+        self.assertEqual(metrics.endpoint_name(root + 'oauth/token'), 'oauth/token')
+
+    def test_timed_request(self):
+        func = mock.Mock(return_value=mock.Mock(status_code=204))
+        metrics.timed_request('https://api.hipchat.com/v2/room/1/notification', func, data='x')
+        func.assert_called_once_with('https://api.hipchat.com/v2/room/1/notification', data='x')
+        endpoint = 'room/{id}/notification'
+        self.assertEqual(self.backend.get_counter(metrics.RESPONSES, endpoint=endpoint, status=204), 1)
+        self.assertEqual(self.backend.get_histogram(metrics.REQUEST_DURATION, endpoint=endpoint).count, 1)
+
+    def test_timed_request_error(self):
+        func = mock.Mock(side_effect=IOError())
+        self.assertRaises(IOError, metrics.timed_request, 'https://x.com/v2/oauth/token', func)
+        self.assertEqual(
+            self.backend.get_counter(metrics.RESPONSES, endpoint='oauth/token', status='error'), 1
+        )
+
+    @override_settings(HIPCHAT_METRICS_BACKEND=None)
+    def test_null_backend(self):
+        metrics.reset_backend()
+        self.assertIsInstance(metrics.get_backend(), metrics.NullBackend)
+        metrics.record_cache('foo', hit=True)
+
+
+class InMemoryBackendTests(TestCase):
+
+    """Test suite for the InMemoryBackend."""
+
+    def test_histogram(self):
+        backend = metrics.InMemoryBackend()
+        backend.timing('foo', 0.02, endpoint='bar')
+        backend.timing('foo', 3, endpoint='bar')
+        histogram = backend.get_histogram('foo', endpoint='bar')
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.sum, 3.02)
+        counts = dict(zip(histogram.buckets, histogram.counts))
+        self.assertEqual(counts[0.01], 0)
+        self.assertEqual(counts[0.025], 1)
+        self.assertEqual(counts[5.0], 2)
+
+    def test_render(self):
+        backend = metrics.InMemoryBackend()
+        backend.timing('foo', 0.02, endpoint='bar')
+        backend.increment('baz', status=200)
+        backend.increment('baz', status=200)
+        output = backend.render()
+        self.assertTrue('# TYPE foo histogram' in output)
+        self.assertTrue('foo_bucket{endpoint="bar",le="0.025"} 1' in output)
+        self.assertTrue('foo_bucket{endpoint="bar",le="+Inf"} 1' in output)
+        self.assertTrue('foo_count{endpoint="bar"} 1' in output)
+        self.assertTrue('# TYPE baz counter' in output)
+        self.assertTrue('baz{status="200"} 2' in output)
+
+
+class StatsdBackendTests(TestCase):
+
+    """Test suite for the StatsdBackend."""
+
+    def test_send(self):
+        backend = metrics.StatsdBackend(host='localhost', port=8125, prefix='test')
+        with mock.patch.object(backend, 'socket') as sock:
+            backend.increment('foo', endpoint='room/{id}/notification', status=200)
+            sock.sendto.assert_called_once_with(
+                'test.foo.room__id__notification.200:1|c', ('localhost', 8125)
+            )
+            backend.timing('bar', 0.5)
+            sock.sendto.assert_called_with('test.bar:500|ms', ('localhost', 8125))
+
+
+class InstrumentationTests(TestCase):
+
+    """Test that outbound calls report into the metrics backend."""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset_backend()
+        self.backend = metrics.get_backend()
+
+    def test_call_api(self):
+        resp = mock.Mock(status_code=204)
+        with mock.patch('requests.post', return_value=resp):
+            notifications.send_room_message(1, 'hello', auth_token='token')
+        self.assertEqual(
+            self.backend.get_counter(
+                metrics.RESPONSES, endpoint='room/{id}/notification', status=204
+            ),
+            1
+        )
+
+    def test_access_token_cache(self):
+        install = models.Install(oauth_id='abc')
+        install.get_access_token(auto_refresh=False)
+        cache.set(install.cache_key, {'access_token': 'foo'})
+        install.get_access_token(auto_refresh=False)
+        for result in ('hit', 'miss'):
+            self.assertEqual(
+                self.backend.get_counter(
+                    metrics.CACHE_REQUESTS, cache='access_token', result=result
+                ),
+                1
+            )
+
+
+class MetricsViewTests(TestCase):
+
+    """Test suite for the Prometheus metrics view."""
+
+    def setUp(self):
+        metrics.reset_backend()
+        self.factory = RequestFactory()
+
+    def test_metrics_disabled(self):
+        self.assertRaises(Http404, views.metrics, self.factory.get('/'))
+
+    @override_settings(HIPCHAT_METRICS_VIEW_ENABLED=True)
+    def test_metrics_enabled(self):
+        metrics.record_request('room/{id}/notification', 0.01, 204)
+        resp = views.metrics(self.factory.get('/'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['Content-Type'].startswith('text/plain'))
+        self.assertTrue(
+            'hipchat_api_responses_total{endpoint="room/{id}/notification",status="204"} 1'
+            in resp.content
+        )
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from StringIO import StringIO
+
+import mock
+
+from django.core.management import call_command
+from django.dispatch import Signal
+from django.test import TestCase, override_settings
+
+from hipchat import models
+from hipchat import profiling
+from hipchat import signals
+
+
+class Update(object):
+
+    """Stand-in for the GlanceUpdate class."""
+
+    pass
+
+
+def returns_update(sender, **kwargs):
+    return Update()
+
+
+def returns_nothing(sender, **kwargs):
+    return None
+
+
+def raises_error(sender, **kwargs):
+    raise ValueError("Receiver error")
+
+
+class FunctionTests(TestCase):
+
+    """Free function tests."""
+
+    def test_receiver_name(self):
+        self.assertEqual(
+            profiling.receiver_name(returns_update),
+            'hipchat.tests.test_profiling.returns_update'
+        )
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertIsNone(profiling.percentile([], 50))
+        self.assertEqual(profiling.percentile(values, 50), 50)
+        self.assertEqual(profiling.percentile(values, 95), 95)
+        self.assertEqual(profiling.percentile(values, 100), 100)
+        self.assertEqual(profiling.percentile([7], 99), 7)
+
+
+class ReceiverStatsTests(TestCase):
+
+    """Test suite for the ReceiverStats object."""
+
+    def test_record(self):
+        stats = profiling.ReceiverStats('foo', window=3)
+        stats.record(0.1, returned_update=True)
+        stats.record(0.2, raised=True)
+        stats.record(0.3, slow=True)
+        stats.record(0.4)
+        summary = stats.summary()
+        self.assertEqual(summary['calls'], 4)
+        self.assertEqual(summary['updates'], 1)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['slow'], 1)
+        # the window only holds the last three timings
+        self.assertEqual(list(stats.timings), [0.2, 0.3, 0.4])
+        self.assertEqual(summary['max'], 0.4)
+
+
+class SendTimedTests(TestCase):
+
+    """Test suite for the send_timed signal wrapper."""
+
+    def setUp(self):
+        profiling.reset_stats()
+        self.signal = Signal(providing_args=['glance'])
+
+    def test_no_receivers(self):
+        self.assertEqual(profiling.send_timed(self.signal, Update, glance=None), [])
+        self.assertEqual(profiling.receiver_stats(), [])
+
+    def test_responses(self):
+        self.signal.connect(returns_update)
+        self.signal.connect(returns_nothing)
+        responses = profiling.send_timed(self.signal, Update, glance=None)
+        self.assertEqual([r[0] for r in responses], [returns_update, returns_nothing])
+        self.assertIsInstance(responses[0][1], Update)
+        self.assertIsNone(responses[1][1])
+        stats = {s['receiver']: s for s in profiling.receiver_stats()}
+        self.assertEqual(len(stats), 2)
+        self.assertEqual(
+            stats['hipchat.tests.test_profiling.returns_update']['updates'], 1
+        )
+        self.assertEqual(
+            stats['hipchat.tests.test_profiling.returns_nothing']['updates'], 0
+        )
+
+    def test_receiver_raises(self):
+        self.signal.connect(raises_error)
+        self.assertRaises(
+            ValueError, profiling.send_timed, self.signal, Update, glance=None
+        )
+        stats = profiling.receiver_stats()[0]
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['errors'], 1)
+
+    @override_settings(HIPCHAT_SLOW_RECEIVER_THRESHOLD=-1)
+    def test_slow_receiver_warning(self):
+        self.signal.connect(returns_nothing)
+        with mock.patch('hipchat.profiling.logger') as logger:
+            profiling.send_timed(self.signal, Update, glance=None)
+            self.assertEqual(logger.warning.call_count, 1)
+        self.assertEqual(profiling.receiver_stats()[0]['slow'], 1)
+
+
+class ReceiverStatsCommandTests(TestCase):
+
+    """Test suite for the glance_receiver_stats command."""
+
+    def test_command(self):
+        app = models.Addon(key="foo").save()
+        models.Glance(app=app, key="bar").save()
+        calls = []
+
+        def receiver(sender, glance, **kwargs):
+            calls.append(glance)
+
+        signals.initialise_glance.connect(receiver)
+        try:
+            stdout, stderr = StringIO(), StringIO()
+            call_command('glance_receiver_stats', iterations=3, stdout=stdout, stderr=stderr)
+        finally:
+            signals.initialise_glance.disconnect(receiver)
+            profiling.reset_stats()
+        # the live receivers are called, with a warning
+        self.assertEqual(len(calls), 3)
+        self.assertIn("live initialise_glance receivers", stderr.getvalue())
+        self.assertIn("test_profiling.receiver", stdout.getvalue())
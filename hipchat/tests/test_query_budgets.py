@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""Pin the number of DB queries and cache calls made on the hot paths.
+
+If one of these tests fails the failure message lists the queries that
+were issued - repeated queries (N+1s) are collapsed and counted. If the
+change is intentional, update the budget.
+
+"""
+import json
+import time
+
+import jwt
+import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.urlresolvers import reverse
+from django.test import TestCase, RequestFactory
+
+from hipchat import models
+from hipchat import signed_requests
+from hipchat import views
+from hipchat.testing.budgets import QueryBudgetMixin, normalize
+
+BASE_URL = 'https://example.com'
+
+
+def create_addon(key, num_scopes=3, num_glances=2):
+    app = models.Addon(key=key).save()
+    app.scopes.add(*models.Scope.objects.all()[:num_scopes])
+    for i in range(num_glances):
+        models.Glance(app=app, key="glance-%s" % i).save()
+    return app
+
+
+class BudgetMixinTests(QueryBudgetMixin, TestCase):
+
+    """Test the budget assertions themselves."""
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize("SELECT * FROM foo WHERE id = 12 AND key = 'bar'"),
+            "SELECT * FROM foo WHERE id = ? AND key = ?"
+        )
+
+    def test_budget_met(self):
+        with self.assertBudget(queries=1, cache=2):
+            models.Addon.objects.count()
+            cache.set('foo', 1)
+            cache.get('foo')
+
+    def test_budget_exceeded(self):
+        app = models.Addon(key="foo").save()
+        with self.assertRaises(AssertionError) as ctx:
+            with self.assertBudget(queries=1, cache=0):
+                for _ in range(3):
+                    models.Addon.objects.get(id=app.id)
+                cache.get('foo')
+        message = str(ctx.exception)
+        self.assertTrue("3 queries executed, 1 expected" in message)
+        self.assertTrue("1 cache calls made, 0 expected" in message)
+        self.assertTrue("[x3] SELECT" in message)
+        self.assertTrue("get('foo')" in message)
+
+    def test_expected_queries_diff(self):
+        with self.assertRaises(AssertionError) as ctx:
+            with self.assertBudget(expected_queries=['SELECT 1']):
+                models.Addon.objects.count()
+        message = str(ctx.exception)
+        self.assertTrue("--- expected" in message)
+        self.assertTrue("-SELECT ?" in message)
+        self.assertTrue('+SELECT COUNT(?) AS "__count" FROM "hipchat_addon"' in message)
+
+    def test_cache_restored(self):
+        backend = caches['default']
+        with self.assertBudget():
+            self.assertTrue('get' in vars(backend))
+        self.assertFalse('get' in vars(backend))
+
+
+class ModelBudgetTests(QueryBudgetMixin, TestCase):
+
+    """Query budgets for model methods."""
+
+    fixtures = ['scopes.json']
+
+    def setUp(self):
+        cache.clear()
+        models.get_domain()
+        self.app = create_addon("foo")
+
+    def test_addon_descriptor(self):
+        app = models.Addon.objects.get(id=self.app.id)
+        # scopes + glances + webhooks, regardless of the number of each
+        with self.assertBudget(queries=3, cache=0):
+            app.descriptor(base_url=BASE_URL)
+        app = models.Addon.objects.get(id=create_addon("bar", 10, 5).id)
+        with self.assertBudget(queries=3, cache=0):
+            app.descriptor(base_url=BASE_URL)
+
+    def test_addon_descriptor_domain(self):
+        app = models.Addon.objects.get(id=self.app.id)
+        # the Site domain is cached after the first lookup
+        with self.assertBudget(queries=3, cache=0):
+            app.descriptor()
+
+    def test_get_access_token_cached(self):
+        install = models.Install(app=self.app, oauth_id="abc", group_id=1).save()
+        cache.set(install.cache_key, {'access_token': 'foo', 'expires_in': 3600})
+        with self.assertBudget(queries=0, cache=1):
+            install.get_access_token()
+
+    def test_get_access_token_refresh(self):
+        install = models.Install.objects.get(
+            id=models.Install(app=self.app, oauth_id="abc", group_id=1).save().id
+        )
+        token = {
+            'access_token': 'foo',
+            'expires_in': 3600,
+            'group_id': 1,
+            'group_name': 'bar',
+            'scope': 'send_notification',
+            'token_type': 'bearer'
+        }
+        resp = mock.Mock(status_code=200, json=mock.Mock(return_value=token))
+        # scopes (for the token request), cache get + set
+        with mock.patch('requests.post', return_value=resp):
+            with self.assertBudget(queries=1, cache=2):
+                install.get_access_token()
+        # the scopes are memoized for other installs of the same app
+        install = models.Install.objects.get(
+            id=models.Install(app=self.app, oauth_id="def", group_id=1).save().id
+        )
+        with mock.patch('requests.post', return_value=resp):
+            with self.assertBudget(queries=0, cache=2):
+                install.get_access_token()
+
+
+class ViewBudgetTests(QueryBudgetMixin, TestCase):
+
+    """Query budgets for the HipChat callback views."""
+
+    fixtures = ['scopes.json']
+
+    def setUp(self):
+        cache.clear()
+        signed_requests.secrets_cache.clear()
+        signed_requests.tokens_cache.clear()
+        models.get_domain()
+        self.factory = RequestFactory()
+        self.app = create_addon("foo")
+
+    def test_descriptor_uncached(self):
+        request = self.factory.get('/')
+        # addon + scopes + glances + webhooks, cache get generation + get + set
+        with self.assertBudget(queries=4, cache=3):
+            views.descriptor(request, app_id=self.app.id)
+
+    def test_descriptor_cached(self):
+        request = self.factory.get('/')
+        views.descriptor(request, app_id=self.app.id)
+        # cache get generation + get
+        with self.assertBudget(queries=0, cache=2):
+            views.descriptor(request, app_id=self.app.id)
+
+    def test_glance(self):
+        install = models.Install(
+            app=self.app, oauth_id="abc", oauth_secret="secret", group_id=1
+        ).save()
+        glance = self.app.glances.first()
+        token = jwt.encode(
+            {'iss': install.oauth_id, 'exp': int(time.time()) + 3600},
+            install.oauth_secret
+        )
+        request = self.factory.get('/', {'signed_request': token})
+        # secret lookup, glance, insert update
+        with self.assertBudget(queries=3, cache=0):
+            views.glance(request, glance_id=glance.id)
+        # secret now cached in-process
+        with self.assertBudget(queries=2, cache=0):
+            views.glance(request, glance_id=glance.id)
+
+    def test_install(self):
+        data = {
+            "capabilitiesUrl": "https://api.hipchat.com/v2/capabilities",
+            "oauthId": "abc",
+            "oauthSecret": "secret",
+            "groupId": 1,
+        }
+        request = self.factory.post('/', json.dumps(data), content_type='application/json')
+        # addon, then (on sqlite) the fallback upsert: UPDATE, then INSERT,
+        # each in a savepoint
+        with mock.patch('hipchat.tasks.schedule'):
+            with self.assertBudget(queries=7, cache=0):
+                resp = views.install(request, app_id=self.app.id)
+        self.assertEqual(resp.status_code, 201)
+
+
+class AdminBudgetTests(QueryBudgetMixin, TestCase):
+
+    """Query budgets for the admin changelists."""
+
+    fixtures = ['scopes.json']
+
+    def setUp(self):
+        cache.clear()
+        models.get_domain()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+    def create_data(self, num):
+        for _ in range(num):
+            i = models.Addon.objects.count()
+            app = create_addon("addon-%s" % i, num_glances=1)
+            glance = app.glances.get()
+            models.Install(app=app, oauth_id="install-%s" % i, group_id=1).save()
+            models.GlanceUpdate(glance=glance, label_value="update").save()
+
+    def assertChangelistBudget(self, model_name, queries, cache=0, cache_per_row=0):
+        url = reverse('admin:hipchat_%s_changelist' % model_name)
+        # the query budget must not depend on the number of rows
+        for num in (1, 5):
+            self.create_data(num - models.Addon.objects.count())
+            with self.assertBudget(queries=queries, cache=cache + cache_per_row * num):
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+
+    def test_addon_changelist(self):
+        # session, user, count, addons
+        self.assertChangelistBudget('addon', queries=4)
+
+    def test_install_changelist(self):
+        # session, user, count, installs + addons; tokens fetched in one go
+        self.assertChangelistBudget('install', queries=4, cache=1)
+
+    def test_glance_changelist(self):
+        # session, user, count, glances + addons
+        self.assertChangelistBudget('glance', queries=4)
+
+    def test_glanceupdate_changelist(self):
+        # session, user, glance filter choices, bounded count,
+        # updates + glances + addons
+        self.assertChangelistBudget('glanceupdate', queries=5)
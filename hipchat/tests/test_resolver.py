@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from hipchat import dispatch
+from hipchat import models
+from hipchat import notifications
+from hipchat import resolver
+from hipchat.testing import FakeHipChatServer
+
+ROOMS = {u"Lounge": 123, u"Ünïcode room": 456}
+USERS = {u"fred@example.com": 789}
+
+
+@override_settings(HIPCHAT_RESOLVE_NAMES=True)
+class ResolverTests(TestCase):
+
+    """Test suite for room / user name resolution."""
+
+    @classmethod
+    def setUpClass(cls):
+        super(ResolverTests, cls).setUpClass()
+        # the server is shared, as stopping it takes ~0.5s
+        cls.server = FakeHipChatServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super(ResolverTests, cls).tearDownClass()
+
+    def setUp(self):
+        resolver.ids_cache.clear()
+        self.server.reset()
+        self.server.rooms = dict(ROOMS)
+        self.server.users = dict(USERS)
+        self.server.error_rate = 0
+        self.settings = self.server.settings()
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def test_is_id(self):
+        self.assertTrue(resolver.is_id(123))
+        self.assertTrue(resolver.is_id("123"))
+        self.assertFalse(resolver.is_id("Lounge"))
+        self.assertFalse(resolver.is_id("@fred"))
+
+    def test_resolve_room(self):
+        self.assertEqual(resolver.resolve_room("Lounge", "token"), 123)
+        self.assertEqual(resolver.resolve_room("Lounge", "token"), 123)
+        self.assertEqual(resolver.resolve_room(u"Ünïcode room", "token"), 456)
+        # ids are not resolved
+        self.assertEqual(resolver.resolve_room(999, "token"), 999)
+        self.assertEqual(len(self.server.requests_to('room')), 2)
+
+    def test_resolve_user(self):
+        self.assertEqual(resolver.resolve_user("fred@example.com", "token"), 789)
+        self.assertEqual(self.server.requests_to('user')[0].path, '/v2/user/fred@example.com')
+
+    def test_not_found(self):
+        self.assertRaises(resolver.RecipientNotFound, resolver.resolve_room, "Nope", "token")
+        self.assertRaises(resolver.RecipientNotFound, resolver.resolve_room, "Nope", "token")
+        # the second lookup is cached
+        self.assertEqual(len(self.server.requests_to('room')), 1)
+
+    def test_not_found_timeout(self):
+        with override_settings(HIPCHAT_RESOLVER_NOT_FOUND_TIMEOUT=-1):
+            self.assertRaises(resolver.RecipientNotFound, resolver.resolve_room, "Nope", "token")
+        self.server.rooms["Nope"] = 321
+        self.assertEqual(resolver.resolve_room("Nope", "token"), 321)
+
+    def test_api_error(self):
+        # errors other than 404 return the name unchanged, and are not cached
+        self.server.error_rate = 1
+        self.assertEqual(resolver.resolve_room("Lounge", "token"), "Lounge")
+        self.server.error_rate = 0
+        self.assertEqual(resolver.resolve_room("Lounge", "token"), 123)
+
+    def test_group_id(self):
+        resolver.resolve_room("Lounge", "token", group_id=1)
+        resolver.resolve_room("Lounge", "token", group_id=2)
+        self.assertEqual(len(self.server.requests_to('room')), 2)
+
+    @override_settings(HIPCHAT_RESOLVE_NAMES=False)
+    def test_disabled(self):
+        self.assertEqual(resolver.resolve_room("Lounge", "token"), "Lounge")
+        self.assertEqual(self.server.requests, [])
+
+    def test_send_room_message(self):
+        notifications.send_room_message("Lounge", "Hello", auth_token="token")
+        notifications.send_room_message("Lounge", "Hello", auth_token="token")
+        self.assertEqual(
+            [r.path for r in self.server.requests_to('room_notification')],
+            ['/v2/room/123/notification'] * 2
+        )
+        self.assertEqual(len(self.server.requests_to('room')), 1)
+        self.assertRaises(
+            resolver.RecipientNotFound,
+            notifications.send_room_message, "Nope", "Hello", auth_token="token"
+        )
+
+    def test_send_user_message(self):
+        notifications.send_user_message("fred@example.com", "Hello", auth_token="token")
+        self.assertEqual(self.server.requests_to('user_message')[0].path, '/v2/user/789/message')
+
+    @mock.patch('hipchat.models.post_json')
+    def test_glance_update_room(self, post_json):
+        cache.clear()
+        app = models.Addon(key="foo").save()
+        glance = models.Glance(app=app, key="bar").save()
+        install = models.Install(app=app, oauth_id="abc", group_id=1).save()
+        cache.set(install.cache_key, {'access_token': 'token'})
+        glance.update_room("Lounge", "foo")
+        self.assertEqual(post_json.call_args[0][0], models.api_url("addon/ui/room/123"))
+        self.assertEqual(resolver.ids_cache.get((resolver.ROOM, 1, "Lounge")), 123)
+
+    @override_settings(
+        HIPCHAT_DISPATCH_BACKEND='hipchat.dispatch.RQBackend',
+        HIPCHAT_DISPATCH_OPTIONS={'queue': 'hipchat.testing.FakeQueue'}
+    )
+    def test_resolved_by_worker(self):
+        cache.clear()
+        queue = dispatch.get_backend().queue
+        queue.empty()
+        app = models.Addon(key="foo").save()
+        glance = models.Glance(app=app, key="bar").save()
+        install = models.Install(app=app, oauth_id="abc", group_id=1).save()
+        cache.set(install.cache_key, {'access_token': 'token'})
+        notifications.send_room_message("Lounge", "Hello", auth_token="token")
+        notifications.send_user_message("fred@example.com", "Hello", auth_token="token")
+        notifications.send_room_message("Nope", "Hello", auth_token="token")
+        glance.update_room("Lounge", "foo")
+        # nothing is looked up by the caller
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(queue.work(), 4)
+        self.assertEqual(len(queue.failed), 1)
+        # (the glance resolves the name for the install's group_id)
+        self.assertEqual(
+            sorted(r.path for r in self.server.requests),
+            [
+                '/v2/addon/ui/room/123',
+                '/v2/room/123/notification',
+                '/v2/room/Lounge',
+                '/v2/room/Lounge',
+                '/v2/room/Nope',
+                '/v2/user/789/message',
+                '/v2/user/fred@example.com',
+            ]
+        )
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from hipchat import models
+
+TOKEN = {
+    'access_token': 'foo',
+    'expires_in': 3600,
+    'group_id': 1,
+    'group_name': 'bar',
+    'scope': 'send_notification',
+    'token_type': 'bearer'
+}
+
+
+class ScopeStringTests(TestCase):
+
+    """Test suite for the memoized add-on scope strings."""
+
+    def setUp(self):
+        cache.clear()
+        models.scope_strings_cache.clear()
+        self.app = models.Addon(key="foo").save()
+        self.x = models.Scope(name="x").save()
+        self.y = models.Scope(name="y").save()
+        self.app.scopes.add(self.y, self.x)
+
+    def test_get_scope_string(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(models.Addon.get_scope_string(self.app.id), "x y")
+        with self.assertNumQueries(0):
+            self.assertEqual(models.Addon.get_scope_string(self.app.id), "x y")
+        self.assertEqual(models.Addon.get_scope_string(0), "")
+
+    def test_invalidate_on_m2m_changed(self):
+        models.Addon.get_scope_string(self.app.id)
+        self.app.scopes.remove(self.x)
+        self.assertEqual(models.Addon.get_scope_string(self.app.id), "y")
+        self.x.addon_set.add(self.app)
+        self.assertEqual(models.Addon.get_scope_string(self.app.id), "x y")
+        self.x.addon_set.clear()
+        self.assertEqual(models.Addon.get_scope_string(self.app.id), "y")
+        self.app.scopes.clear()
+        self.assertEqual(models.Addon.get_scope_string(self.app.id), "")
+
+    def test_invalidate_on_scope_changed(self):
+        models.Addon.get_scope_string(self.app.id)
+        self.x.name = "z"
+        self.x.save()
+        self.assertEqual(models.Addon.get_scope_string(self.app.id), "y z")
+
+    def test_token_request_payload(self):
+        install = models.Install.objects.get(
+            id=models.Install(app=self.app, oauth_id="abc", group_id=1).save().id
+        )
+        models.Addon.get_scope_string(self.app.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                install.token_request_payload(),
+                {'grant_type': 'client_credentials', 'scope': "x y"}
+            )
+
+    def test_get_access_tokens(self):
+        installs = [
+            models.Install(app=self.app, oauth_id=oauth_id, group_id=1).save()
+            for oauth_id in ("abc", "def", "ghi")
+        ]
+        cache.set(installs[0].cache_key, dict(TOKEN, access_token='cached'))
+        resp = mock.Mock(status_code=200, json=mock.Mock(return_value=TOKEN))
+        with mock.patch('requests.post', return_value=resp) as post:
+            # just the scopes, once for both token requests
+            with self.assertNumQueries(1):
+                tokens = models.Install.get_access_tokens(installs)
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args[1]['data']['scope'], "x y")
+        self.assertEqual(models.get_token_string(tokens["abc"]), 'cached')
+        self.assertEqual(models.get_token_string(tokens["def"]), 'foo')
+        self.assertEqual(models.get_token_string(tokens["ghi"]), 'foo')
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import sys
+import types
+
+import mock
+
+from django.test import TestCase, override_settings
+
+from hipchat import serialization
+
+
+class SerializationTests(TestCase):
+
+    """Test suite for the JSON serialization functions."""
+
+    def setUp(self):
+        serialization.reset_library()
+
+    def tearDown(self):
+        serialization.reset_library()
+
+    @override_settings(HIPCHAT_JSON_LIBRARY='json')
+    def test_library_setting(self):
+        self.assertIs(serialization.get_library(), json)
+
+    @override_settings(HIPCHAT_JSON_LIBRARY='does_not_exist')
+    def test_library_missing(self):
+        self.assertIs(serialization.get_library(), json)
+
+    def test_library_preference(self):
+        ujson = types.ModuleType('ujson')
+        ujson.dumps = mock.Mock(return_value='{}')
+        with mock.patch.dict(sys.modules, {'ujson': ujson}):
+            self.assertIs(serialization.get_library(), ujson)
+            self.assertEqual(serialization.dumps({'url': 'http://x'}), '{}')
+        ujson.dumps.assert_called_once_with({'url': 'http://x'}, escape_forward_slashes=False)
+
+    def test_dumps_loads(self):
+        data = {'foo': [1, 2, u"∂ƒ©"], 'bar': None}
+        self.assertEqual(serialization.loads(serialization.dumps(data)), data)
+
+    def test_dumps_fallback(self):
+        data = {'date': datetime.date(2016, 1, 2)}
+        self.assertEqual(serialization.dumps(data), '{"date": "2016-01-02"}')
+
+    def test_json_response(self):
+        resp = serialization.json_response({'foo': 'bar'}, status=201)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(resp.content), {'foo': 'bar'})
+
+    def test_pretty_is_lazy(self):
+        with mock.patch('json.dumps', return_value='{}') as dumps:
+            pretty = serialization.pretty({'foo': 'bar'})
+            self.assertEqual(dumps.call_count, 0)
+            str(pretty)
+            self.assertEqual(dumps.call_count, 1)
+        self.assertEqual(str(serialization.pretty({'foo': 1})), '{\n    "foo": 1\n}')
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+import time
+
+import jwt
+
+from django.test import TransactionTestCase, override_settings
+
+from hipchat import models
+from hipchat import signed_requests
+from hipchat.signed_requests import InvalidSignedRequest
+
+
+def make_token(oauth_id, secret, expires_in=60, algorithm='HS256'):
+    claims = {'iss': oauth_id, 'prn': '123', 'context': {'room_id': 1}}
+    if expires_in is not None:
+        claims['exp'] = int(time.time()) + expires_in
+    return jwt.encode(claims, secret, algorithm=algorithm)
+
+
+class SignedRequestTests(TransactionTestCase):
+
+    """Test suite for JWT signed_request verification."""
+
+    def setUp(self):
+        signed_requests.secrets_cache.clear()
+        signed_requests.tokens_cache.clear()
+        self.app = models.Addon(key=u"∂ƒ©˙∆˚").save()
+        self.install = models.Install(
+            app=self.app,
+            oauth_id="abc",
+            oauth_secret="xyz",
+            group_id=0
+        ).save()
+
+    def test_parse_token(self):
+        token = make_token('abc', 'xyz')
+        header, claims, signing_input, signature = signed_requests.parse_token(token)
+        self.assertEqual(header['alg'], 'HS256')
+        self.assertEqual(claims['iss'], 'abc')
+        self.assertEqual(signing_input, token.rsplit('.', 1)[0])
+        for token in ('', 'foo', 'foo.bar', 'a.b.c', u'∂ƒ©.˙∆˚.x'):
+            self.assertRaises(InvalidSignedRequest, signed_requests.parse_token, token)
+
+    def test_parse_token_wrong_types(self):
+        def b64(obj):
+            return base64.urlsafe_b64encode(json.dumps(obj)).rstrip('=')
+
+        header = b64({'alg': 'HS256'})
+        for token in (
+            '.'.join([header, b64([]), 'sig']),
+            '.'.join([b64([]), b64({'iss': 'abc'}), 'sig']),
+            '.'.join([header, b64("abc"), 'sig']),
+            '.'.join([header, b64({'iss': [1]}), 'sig']),
+            '.'.join([header, b64({'iss': {'a': 1}}), 'sig']),
+            '.'.join([b64({'alg': ['HS256']}), b64({'iss': 'abc'}), 'sig']),
+            '.'.join([header, b64({'iss': 'abc', 'exp': "soon"}), 'sig']),
+            '.'.join([header, b64({'iss': 'abc', 'nbf': [1]}), 'sig']),
+            None,
+        ):
+            self.assertRaises(InvalidSignedRequest, signed_requests.parse_token, token)
+            self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, token)
+
+    def test_verify_token(self):
+        for algorithm in ('HS256', 'HS384', 'HS512'):
+            token = make_token('abc', 'xyz', algorithm=algorithm)
+            claims = signed_requests.verify_token(token)
+            self.assertEqual(claims['iss'], 'abc')
+            self.assertEqual(claims['context'], {'room_id': 1})
+
+    def test_verify_token_cached(self):
+        token = make_token('abc', 'xyz')
+        with self.assertNumQueries(1):
+            signed_requests.verify_token(token)
+        with self.assertNumQueries(0):
+            signed_requests.verify_token(token)
+        # a new token from the same issuer reuses the cached secret
+        with self.assertNumQueries(0):
+            signed_requests.verify_token(make_token('abc', 'xyz', expires_in=120))
+
+    def test_verify_token_no_expiry(self):
+        token = make_token('abc', 'xyz', expires_in=None)
+        signed_requests.verify_token(token)
+        # tokens without an 'exp' claim are never memoized
+        self.assertIsNone(signed_requests.tokens_cache.get(token))
+
+    def test_verify_token_expired(self):
+        token = make_token('abc', 'xyz', expires_in=-10)
+        self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, token)
+
+    def test_verify_token_invalid_signature(self):
+        token = make_token('abc', 'wrong')
+        self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, token)
+
+    def test_verify_token_unknown_issuer(self):
+        token = make_token('def', 'xyz')
+        self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, token)
+
+    def test_verify_token_unsupported_algorithm(self):
+        token = jwt.encode({'iss': 'abc'}, None, algorithm='none')
+        self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, token)
+
+    def test_secret_invalidated_on_save(self):
+        signed_requests.verify_token(make_token('abc', 'xyz'))
+        self.install.oauth_secret = 'uvw'
+        self.install.save()
+        self.assertIsNone(signed_requests.secrets_cache.get('abc'))
+        self.assertEqual(len(signed_requests.tokens_cache), 0)
+        self.assertRaises(
+            InvalidSignedRequest,
+            signed_requests.verify_token,
+            make_token('abc', 'xyz')
+        )
+        signed_requests.verify_token(make_token('abc', 'uvw'))
+
+    def test_invalid_signature_no_query(self):
+        signed_requests.verify_token(make_token('abc', 'xyz'))
+        # a bad signature is checked against the cached secret only
+        with self.assertNumQueries(0):
+            self.assertRaises(
+                InvalidSignedRequest,
+                signed_requests.verify_token,
+                make_token('abc', 'wrong')
+            )
+
+    def test_unknown_issuer_cached(self):
+        with self.assertNumQueries(1):
+            for i in range(3):
+                self.assertRaises(
+                    InvalidSignedRequest,
+                    signed_requests.verify_token,
+                    make_token('def', 'xyz', expires_in=60 + i)
+                )
+        # until the issuer is installed (in this process)
+        models.Install(app=self.app, oauth_id='def', oauth_secret='xyz', group_id=1).save()
+        self.assertEqual(signed_requests.verify_token(make_token('def', 'xyz'))['iss'], 'def')
+
+    def test_unknown_issuer_expires(self):
+        with override_settings(HIPCHAT_JWT_UNKNOWN_ISSUER_TIMEOUT=-1):
+            self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, make_token('def', 'xyz'))
+        with self.assertNumQueries(1):
+            self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, make_token('def', 'xyz'))
+
+    def test_verify_token_not_before(self):
+        token = jwt.encode({'iss': 'abc', 'nbf': int(time.time()) + 60, 'exp': int(time.time()) + 120}, 'xyz')
+        self.assertRaises(InvalidSignedRequest, signed_requests.verify_token, token)
+        self.assertIsNone(signed_requests.tokens_cache.get(token))
+        with override_settings(HIPCHAT_JWT_LEEWAY=120):
+            self.assertEqual(signed_requests.verify_token(token)['iss'], 'abc')
+        token = jwt.encode({'iss': 'abc', 'nbf': int(time.time()) - 10}, 'xyz')
+        self.assertEqual(signed_requests.verify_token(token)['iss'], 'abc')
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+import mock
+
+from django.core.cache import cache
+from django.test import TransactionTestCase, RequestFactory, override_settings
+
+from hipchat import models
+from hipchat import tasks
+from hipchat import views
+
+TOKEN_DATA = {
+    'access_token': '52363462337245724',
+    'expires_in': 3599,
+    'group_id': 123,
+    'group_name': 'Example Company',
+    'scope': 'send_notification',
+    'token_type': 'bearer'
+}
+
+
+class ScheduleTests(TransactionTestCase):
+
+    """Test suite for the background task scheduler."""
+
+    @override_settings(HIPCHAT_RUN_TASKS_SYNC=True)
+    def test_schedule_sync(self):
+        func = mock.Mock(return_value='foo')
+        self.assertEqual(tasks.schedule(func, 1, bar=2), 'foo')
+        func.assert_called_once_with(1, bar=2)
+
+    @override_settings(HIPCHAT_RUN_TASKS_SYNC=False)
+    def test_schedule_async(self):
+        event = threading.Event()
+        thread = tasks.schedule(event.set)
+        thread.join(5)
+        self.assertTrue(event.is_set())
+
+    @override_settings(HIPCHAT_RUN_TASKS_SYNC=False)
+    def test_schedule_async_error(self):
+        def raise_error():
+            raise Exception("Task error")
+        with mock.patch('hipchat.tasks.logger') as logger:
+            tasks.schedule(raise_error).join(5)
+            self.assertEqual(logger.exception.call_count, 1)
+
+
+@override_settings(HIPCHAT_RUN_TASKS_SYNC=True)
+class InstallTaskTests(TransactionTestCase):
+
+    """Test suite for the post-install access token request."""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.app = models.Addon().save()
+
+    def install(self):
+        data = {
+            "capabilitiesUrl": "https://api.hipchat.com/v2/capabilities",
+            "oauthId": "abc",
+            "oauthSecret": "xyz",
+            "groupId": 123,
+            "roomId": "1234"
+        }
+        request = self.factory.post('/', json.dumps(data), content_type='application/json')
+        return views.install(request, app_id=self.app.id)
+
+    @mock.patch('hipchat.models.Install.request_access_token', lambda x: TOKEN_DATA)
+    def test_install_token_acquired(self):
+        resp = self.install()
+        self.assertEqual(resp.status_code, 201)
+        install = models.Install.objects.get()
+        self.assertEqual(install.capabilities_url, "https://api.hipchat.com/v2/capabilities")
+        self.assertEqual(install.token_status, models.Install.TOKEN_STATUS_ACQUIRED)
+        self.assertIsNotNone(install.token_status_at)
+        self.assertIsNotNone(install.get_access_token(auto_refresh=False))
+
+    @mock.patch('hipchat.models.Install.request_access_token', lambda x: {'error': 'foo'})
+    def test_install_token_failed(self):
+        resp = self.install()
+        self.assertEqual(resp.status_code, 201)
+        install = models.Install.objects.get()
+        self.assertEqual(install.token_status, models.Install.TOKEN_STATUS_FAILED)
+        self.assertNotEqual(install.token_status_message, '')
+
+    @override_settings(HIPCHAT_FETCH_CAPABILITIES=True)
+    @mock.patch('hipchat.models.Install.request_access_token', lambda x: TOKEN_DATA)
+    def test_install_fetch_capabilities(self):
+        resp = mock.Mock(text='{"foo": "bar"}')
+        with mock.patch('requests.get', return_value=resp):
+            self.install()
+        install = models.Install.objects.get()
+        self.assertEqual(install.capabilities, '{"foo": "bar"}')
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+
+import mock
+
+from django.template import TemplateDoesNotExist
+from django.test import TestCase, override_settings
+
+from hipchat import dispatch
+from hipchat import notifications
+
+TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'DIRS': [os.path.join(os.path.dirname(__file__), 'templates')],
+}]
+
+
+@override_settings(TEMPLATES=TEMPLATES, HIPCHAT_API_TOKEN='token')
+class TemplateMessageTests(TestCase):
+
+    """Test suite for templated messages."""
+
+    def setUp(self):
+        notifications.templates_cache.clear()
+        dispatch.rate_limit.clear()
+
+    def tearDown(self):
+        notifications.templates_cache.clear()
+        dispatch.rate_limit.clear()
+
+    def test_render_message(self):
+        self.assertEqual(
+            notifications.render_message('hipchat/deploy.html', {'user': '<Fred>', 'version': 1}),
+            u"<b>&lt;Fred&gt;</b> deployed 1"
+        )
+
+    def test_template_cache(self):
+        with mock.patch('django.template.loader.get_template') as get_template:
+            get_template.return_value.render.return_value = u"Hello"
+            notifications.render_message('hipchat/deploy.html')
+            notifications.render_message('hipchat/deploy.html')
+        self.assertEqual(get_template.call_count, 1)
+        self.assertEqual(get_template.return_value.render.call_count, 2)
+        self.assertIn('hipchat/deploy.html', notifications.templates_cache)
+
+    def test_invalid_message(self):
+        self.assertRaises(
+            notifications.InvalidMessage,
+            notifications.render_message, 'hipchat/long.html', {'lines': []}
+        )
+        self.assertRaises(
+            notifications.InvalidMessage,
+            notifications.render_message, 'hipchat/long.html', {'lines': ['x' * 1000] * 11}
+        )
+        self.assertRaises(TemplateDoesNotExist, notifications.render_message, 'hipchat/missing.html')
+
+    @mock.patch('requests.post')
+    def test_send_room_template(self, post):
+        post.return_value = mock.Mock(status_code=204, headers={})
+        notifications.send_room_template(
+            123, 'hipchat/deploy.html', {'user': 'Fred', 'version': 1}, color='green'
+        )
+        data = post.call_args[1]['data']
+        self.assertIn('"message": "<b>Fred</b> deployed 1"', data)
+        self.assertIn('"color": "green"', data)
+        # too long - the API is never called
+        self.assertRaises(
+            notifications.InvalidMessage,
+            notifications.send_room_template, 123, 'hipchat/long.html', {'lines': ['x'] * 10001}
+        )
+        self.assertEqual(post.call_count, 1)
+
+    @mock.patch('requests.post')
+    def test_color_helper_errors(self, post):
+        # colour helper messages are formatted by the caller
+        self.assertRaises(TypeError, notifications.red, 123, "%s and %s", 1)
+        self.assertEqual(post.call_count, 0)
@@ -3,6 +3,7 @@ import json
 import mock
 
 # from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.http import Http404
 from django.test import TransactionTestCase, RequestFactory
 
@@ -122,3 +123,40 @@ class ViewTests(TransactionTestCase):
     def test_glance_404(self):
         request = self.factory.get('/')
         self.assertRaises(Http404, views.glance, request, glance_id=0)
+
+    def test_glance_403_invalid_token(self):
+        request = self.factory.get('/', {'signed_request': 'foo.bar.baz'})
+        resp = views.glance(request, glance_id=0)
+        self.assertEqual(resp.status_code, 403)
+
+    def test_install_422_updates_install(self):
+        app = models.Addon().save()
+        models.Install(app=app, oauth_id="abc", oauth_secret="old", group_id=0).save()
+        data = {"oauthId": "abc", "oauthSecret": "xyz", "groupId": 123, "roomId": "1234"}
+        request = self.factory.post('/', json.dumps(data), content_type='application/json')
+        # the duplicate must not break the surrounding transaction
+        with transaction.atomic():
+            resp = views.install(request, app_id=app.id)
+            self.assertEqual(models.Install.objects.count(), 1)
+        self.assertEqual(resp.status_code, 422)
+        install = models.Install.objects.get()
+        self.assertEqual(install.oauth_secret, "xyz")
+        self.assertEqual(install.group_id, 123)
+        self.assertEqual(install.room_id, 1234)
+
+    def test_install_upsert(self):
+        app = models.Addon().save()
+        install, created = models.Install.objects.upsert(
+            models.Install(app=app, oauth_id="abc", oauth_secret="xyz", group_id=0)
+        )
+        self.assertTrue(created)
+        self.assertIsNotNone(install.installed_at)
+        with mock.patch('hipchat.receivers.invalidate_secret') as invalidate:
+            install2, created = models.Install.objects.upsert(
+                models.Install(app=app, oauth_id="abc", oauth_secret="uvw", group_id=1)
+            )
+            invalidate.assert_called_once_with("abc")
+        self.assertFalse(created)
+        self.assertEqual(install2.id, install.id)
+        self.assertEqual(install2.oauth_secret, "uvw")
+        self.assertEqual(install2.installed_at, install.installed_at)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+import jwt
+import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import Http404
+from django.test import TestCase, RequestFactory, override_settings
+
+from hipchat import models
+from hipchat import signals
+from hipchat import signed_requests
+from hipchat import views
+from hipchat import webhooks
+
+PAYLOAD = json.dumps({'event': 'room_message', 'item': {'message': {'message': "/hello"}}})
+
+
+@override_settings(HIPCHAT_RUN_TASKS_SYNC=True)
+class WebhookTests(TestCase):
+
+    """Test suite for webhook receipt and processing."""
+
+    def setUp(self):
+        cache.clear()
+        signed_requests.secrets_cache.clear()
+        signed_requests.tokens_cache.clear()
+        webhooks.webhooks_cache.clear()
+        self.factory = RequestFactory()
+        self.app = models.Addon(key="foo").save()
+        self.webhook = models.Webhook(
+            app=self.app, key="hello", event='room_message', pattern="^/hello"
+        ).save()
+        self.install = models.Install(
+            app=self.app, oauth_id="abc", oauth_secret="secret", group_id=1
+        ).save()
+        self.received = []
+        signals.webhook_events.connect(self.receiver)
+
+    def tearDown(self):
+        signals.webhook_events.disconnect(self.receiver)
+
+    def receiver(self, sender, webhook, events, **kwargs):
+        self.received.append((webhook, [e.data for e in events]))
+
+    def token(self, oauth_id="abc", secret="secret"):
+        return jwt.encode({'iss': oauth_id, 'exp': int(time.time()) + 3600}, secret)
+
+    def post(self, webhook_id=None, token=None, payload=PAYLOAD):
+        request = self.factory.post(
+            '/',
+            payload,
+            content_type='application/json',
+            HTTP_AUTHORIZATION="JWT %s" % (token or self.token())
+        )
+        if webhook_id is None:
+            webhook_id = self.webhook.id
+        return views.webhook(request, webhook_id=webhook_id)
+
+    def test_descriptor(self):
+        descriptor = self.app.descriptor(base_url="https://example.com")
+        self.assertEqual(
+            descriptor['capabilities']['webhook'],
+            [{
+                'key': "hello",
+                'event': 'room_message',
+                'pattern': "^/hello",
+                'url': "https://example.com" + self.webhook.get_absolute_url(),
+                'authentication': 'jwt',
+            }]
+        )
+
+    def test_webhook_200(self):
+        with self.assertNumQueries(9):
+            # secret, webhook, insert event, then processing: pending ids,
+            # claim, claimed events, installs, update, check for more events
+            resp = self.post()
+        self.assertEqual(resp.status_code, 200)
+        event = models.WebhookEvent.objects.get()
+        self.assertEqual(event.oauth_id, "abc")
+        self.assertEqual(event.payload, PAYLOAD)
+        self.assertEqual(event.status, models.WebhookEvent.STATUS_PROCESSED)
+        self.assertEqual(self.received, [(self.webhook, [json.loads(PAYLOAD)])])
+
+    def test_webhook_signed_request(self):
+        request = self.factory.post(
+            '/?signed_request=%s' % self.token(), PAYLOAD, content_type='application/json'
+        )
+        self.assertEqual(views.webhook(request, webhook_id=self.webhook.id).status_code, 200)
+
+    def test_webhook_cached(self):
+        self.post()
+        with mock.patch.object(webhooks, 'schedule_processing') as schedule:
+            # the secret and webhook are cached - the event insert only
+            with self.assertNumQueries(1):
+                self.post(token=self.token())
+            self.assertEqual(schedule.call_count, 1)
+
+    def test_webhook_403(self):
+        request = self.factory.post('/', PAYLOAD, content_type='application/json')
+        self.assertEqual(views.webhook(request, webhook_id=self.webhook.id).status_code, 403)
+        self.assertEqual(self.post(token=self.token(secret="wrong")).status_code, 403)
+        self.assertEqual(self.post(token=self.token(oauth_id="xyz")).status_code, 403)
+        self.assertFalse(models.WebhookEvent.objects.exists())
+
+    def test_webhook_404(self):
+        self.assertRaises(Http404, self.post, webhook_id=0)
+
+    def test_schedule_once(self):
+        with mock.patch('hipchat.tasks.schedule') as schedule:
+            self.post()
+            self.post()
+            self.post()
+        self.assertEqual(schedule.call_count, 1)
+        self.assertEqual(schedule.call_args[0][0], webhooks.process_events)
+        # processing clears the marker
+        self.assertEqual(webhooks.process_events(), 3)
+        self.assertEqual(self.received, [(self.webhook, [json.loads(PAYLOAD)] * 3)])
+        self.assertIsNone(cache.get(webhooks.SCHEDULED_CACHE_KEY))
+
+    def test_batches(self):
+        other = models.Webhook(app=self.app, key="bye", event='room_exit').save()
+        with mock.patch.object(webhooks, 'schedule_processing'):
+            for webhook in (self.webhook, other, self.webhook):
+                webhooks.receive(webhook, "abc", PAYLOAD)
+        self.assertEqual(webhooks.process_batch(limit=2), 2)
+        self.assertEqual(
+            [(w, len(e)) for w, e in self.received],
+            [(self.webhook, 1), (other, 1)]
+        )
+        self.assertEqual(webhooks.process_events(), 1)
+        self.assertEqual(webhooks.process_batch(), 0)
+        self.assertFalse(
+            models.WebhookEvent.objects.filter(status=models.WebhookEvent.STATUS_PENDING).exists()
+        )
+
+    def test_unknown_install(self):
+        other = models.Addon(key="bar").save()
+        models.Install(app=other, oauth_id="xyz", oauth_secret="secret", group_id=1).save()
+        # a valid token, but from an install of a different app
+        self.post(token=self.token(oauth_id="xyz"))
+        self.assertEqual(models.WebhookEvent.objects.get().status, models.WebhookEvent.STATUS_FAILED)
+        self.assertEqual(self.received, [])
+
+    def test_receiver_error(self):
+        def fail(**kwargs):
+            raise Exception("Boom")
+
+        signals.webhook_events.connect(fail)
+        try:
+            self.post()
+        finally:
+            signals.webhook_events.disconnect(fail)
+        self.assertEqual(models.WebhookEvent.objects.get().status, models.WebhookEvent.STATUS_FAILED)
+
+    def test_webhook_changed(self):
+        webhooks.get_webhook(self.webhook.id)
+        self.webhook.event = 'room_enter'
+        self.webhook.save()
+        self.assertEqual(webhooks.get_webhook(self.webhook.id).event, 'room_enter')
+        self.assertEqual(
+            json.loads(views.descriptor(self.factory.get('/'), app_id=self.app.id).content)
+            ['capabilities']['webhook'][0]['event'],
+            'room_enter'
+        )
+
+    def test_process_webhooks_command(self):
+        with mock.patch.object(webhooks, 'schedule_processing'):
+            webhooks.receive(self.webhook, "abc", PAYLOAD)
+            models.WebhookEvent(
+                webhook=self.webhook, oauth_id="abc", payload=PAYLOAD,
+                status=models.WebhookEvent.STATUS_FAILED
+            ).save()
+        call_command('process_webhooks', stdout=mock.Mock())
+        self.assertEqual(len(self.received[0][1]), 1)
+        call_command('process_webhooks', retry_failed=True, stdout=mock.Mock())
+        self.assertEqual(len(self.received), 2)
+        self.assertEqual(
+            models.WebhookEvent.objects.filter(status=models.WebhookEvent.STATUS_PROCESSED).count(), 2
+        )
+
+    def test_overlapping_process_events(self):
+        with mock.patch.object(webhooks, 'schedule_processing'):
+            events = [webhooks.receive(self.webhook, "abc", PAYLOAD) for _ in range(5)]
+        nested = []
+
+        def overlap(sender, webhook, events, **kwargs):
+            # another process starts while the first batch is being handled
+            if not nested:
+                nested.append(None)
+                nested[0] = webhooks.process_events(limit=2)
+
+        signals.webhook_events.connect(overlap)
+        try:
+            count = webhooks.process_events(limit=2)
+        finally:
+            signals.webhook_events.disconnect(overlap)
+        self.assertEqual((count, nested), (2, [3]))
+        self.assertEqual(sum(len(e) for _, e in self.received), 5)
+        self.assertEqual(
+            models.WebhookEvent.objects.filter(status=models.WebhookEvent.STATUS_PROCESSED).count(),
+            len(events)
+        )
+
+    def test_claim_race(self):
+        with mock.patch.object(webhooks, 'schedule_processing'):
+            for _ in range(3):
+                webhooks.receive(self.webhook, "abc", PAYLOAD)
+        claim = webhooks._claim
+
+        def racing_claim(ids, token):
+            # another process claims the same events between the SELECT
+            # and the UPDATE - so none are claimed here
+            self.assertEqual(claim(ids, "other"), 3)
+            return claim(ids, token)
+
+        with mock.patch.object(webhooks, '_claim', racing_claim):
+            self.assertEqual(webhooks.process_batch(), 0)
+        self.assertEqual(self.received, [])
+        self.assertEqual(models.WebhookEvent.objects.filter(claim="other").count(), 3)
+
+    def test_process_webhooks_command_running(self):
+        with mock.patch.object(webhooks, 'schedule_processing'):
+            webhooks.receive(self.webhook, "abc", PAYLOAD)
+        cache.add(webhooks.SCHEDULED_CACHE_KEY, True)
+        call_command('process_webhooks', stdout=mock.Mock())
+        self.assertEqual(self.received, [])
+        cache.delete(webhooks.SCHEDULED_CACHE_KEY)
+        call_command('process_webhooks', stdout=mock.Mock())
+        self.assertEqual(len(self.received), 1)
+
+    def test_release_stale(self):
+        with mock.patch.object(webhooks, 'schedule_processing'):
+            webhooks.receive(self.webhook, "abc", PAYLOAD)
+        # claimed by a process that then died
+        self.assertEqual(len(webhooks.claim_batch()), 1)
+        self.assertEqual(webhooks.release_stale(), 0)
+        self.assertEqual(webhooks.release_stale(timeout=-1), 1)
+        call_command('process_webhooks', stdout=mock.Mock())
+        self.assertEqual(len(self.received), 1)
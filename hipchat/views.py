@@ -1,26 +1,55 @@
 # -*- coding:utf-8 -*-
 """net_promoter_score views."""
-import json
-import jwt
 import logging
 
-from django.db import IntegrityError
-from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from django.conf import settings
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotModified
+)
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from hipchat import descriptors
+from hipchat import metrics as api_metrics
 from hipchat import models
+from hipchat import profiling
+from hipchat import serialization
 from hipchat import signals
+from hipchat import signed_requests
+from hipchat import tasks
+from hipchat import webhooks
 
 logger = logging.getLogger(__name__)
 
+# valid responses from the initialise_glance signal receivers
+UPDATE_CLASSES = (models.GlanceUpdate, models.GlanceContent)
+
 
 @require_http_methods(['GET'])
 def descriptor(request, app_id):
-    """Return the app descriptor JSON to HipChat."""
-    app = get_object_or_404(models.Addon, id=app_id)
-    return JsonResponse(app.descriptor())
+    """Return the app descriptor JSON to HipChat.
+
+    The serialized descriptor is cached (see hipchat.descriptors), and
+    a 304 is returned if the request ETag matches.
+
+    """
+    try:
+        content, etag = descriptors.get_serialized_descriptor(
+            app_id,
+            base_url=models.get_base_url(request)
+        )
+    except models.Addon.DoesNotExist:
+        raise Http404("No Addon matches the given query.")
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    return response
 
 
 @csrf_exempt
@@ -28,24 +57,28 @@ def descriptor(request, app_id):
 def install(request, app_id):
     """Handle the HipChat post-install callback.
 
-    This function creates a new Install object for the app.
+    This function creates a new Install object for the app, and then
+    schedules the access token request in the background (see
+    hipchat.tasks) so that HipChat gets a response as soon as possible.
+    The outcome of the token request is recorded on the Install.
 
     Returns a 201 if the Install is created successfully, else
     a 422 if the Install already exists for the oauth_id sent
-    by HipChat (as duplicates aren't allowed).
+    by HipChat (as duplicates aren't allowed). Duplicate callbacks
+    update the existing Install's secret and group / room ids.
 
     """
     app = get_object_or_404(models.Addon, id=app_id)
-    data = json.loads(request.body)
-    logger.debug("Install data received from HipChat:")
-    logger.debug(json.dumps(data, indent=4))
-    try:
-        install = models.Install(app=app).parse_json(data).save()
-        token = install.get_access_token()
+    data = serialization.loads(request.body)
+    logger.debug("Install data received from HipChat: %s", serialization.pretty(data))
+    install, created = models.Install.objects.upsert(
+        models.Install(app=app).parse_json(data)
+    )
+    if created:
         logger.debug("Successful install: %s", install)
-        logger.debug("Acquired access token: %s", token)
+        tasks.schedule(tasks.acquire_access_token, install)
         return HttpResponse("Thank you for installing our app", status=201)
-    except IntegrityError:
+    else:
         logger.warning("Duplicate HipChat app install oauthId value.")
         return HttpResponse("Thank you for installing our app (again)", status=422)
 
@@ -73,7 +106,8 @@ def glance(request, glance_id):
     If the glance was set up without an explicit external data_url,
     this function is the default endpoint. It uses signals to connect
     to external data - so that a project can import the signal, and
-    return a GlanceUpdate object that will be returned to HipChat.
+    return a GlanceUpdate (or GlanceContent) object that will be returned
+    to HipChat. The update is recorded as a GlanceUpdate.
 
     https://ecosystem.atlassian.net/wiki/display/HIPDEV/HipChat+Glances
 
@@ -81,12 +115,21 @@ def glance(request, glance_id):
     if 'signed_request' not in request.GET:
         return HttpResponseForbidden("Missing signed_request")
     logging.debug('Initial request to load glance: %s', glance_id)
-    validate_jwt_token(request)
+    try:
+        validate_jwt_token(request)
+    except signed_requests.InvalidSignedRequest:
+        return HttpResponseForbidden("Invalid signed_request")
     glance = get_object_or_404(models.Glance, id=glance_id)
-    # this returns a list of 2-tuples (receiver, response)
-    data = signals.initialise_glance.send(sender=None, glance=glance)
+    # this returns a list of 2-tuples (receiver, response), and records
+    # the time taken by each receiver - see hipchat.profiling
+    data = profiling.send_timed(
+        signals.initialise_glance,
+        UPDATE_CLASSES,
+        sender=None,
+        glance=glance
+    )
     # extract out responses that are Updates
-    updates = [d[1] for d in data if isinstance(d[1], models.GlanceUpdate)]
+    updates = [d[1] for d in data if isinstance(d[1], UPDATE_CLASSES)]
     if len(updates) == 0:
         # we received the request, but there's nothing listening,
         # create an empty update
@@ -98,30 +141,94 @@ def glance(request, glance_id):
     else:
         # return the response from the first signal receiver
         update = updates[0]
+    if isinstance(update, models.GlanceContent):
+        update = update.to_model(glance)
     update.save()
-    response = JsonResponse(update.content(), status=200)
+    response = serialization.json_response(update.content())
     response['Access-Control-Allow-Origin'] = '*'
     return response
 
 
+@csrf_exempt
+@require_http_methods(['POST'])
+def webhook(request, webhook_id):
+    """Receive a webhook event from HipChat.
+
+    HipChat retries webhooks that are slow to respond, so this view does
+    as little as possible - it verifies the JWT token (sent in the
+    Authorization header, or as the signed_request querystring param),
+    stores the event, and returns. The event is sent to the
+    webhook_events signal receivers in the background - see
+    hipchat.webhooks.
+
+    Returns a 200 if the event is stored, a 403 if the token is missing
+    or invalid, or a 404 if the webhook doesn't exist.
+
+    """
+    token = get_signed_request(request)
+    if token is None:
+        return HttpResponseForbidden("Missing signed_request")
+    try:
+        claims = signed_requests.verify_token(token)
+    except signed_requests.InvalidSignedRequest as ex:
+        logger.warning("Unable to verify webhook JWT token: %s", ex)
+        return HttpResponseForbidden("Invalid signed_request")
+    try:
+        hook = webhooks.get_webhook(webhook_id)
+    except models.Webhook.DoesNotExist:
+        raise Http404("No Webhook matches the given query.")
+    webhooks.receive(hook, claims['iss'], request.body)
+    return HttpResponse(status=200)
+
+
+def get_signed_request(request):
+    """Return the JWT token sent with a request, or None.
+
+    HipChat sends the token as an 'Authorization: JWT <token>' header,
+    or as the signed_request querystring param.
+
+    """
+    auth = request.META.get('HTTP_AUTHORIZATION', '')
+    if auth.startswith('JWT '):
+        return auth[4:].strip()
+    return request.GET.get('signed_request')
+
+
 def validate_jwt_token(request):
     """Validate that the JWT token matches the install.
 
-    Returns a access_token related to the install.
+    The token is verified against the install's oauth_secret - see
+    hipchat.signed_requests for details of the caching involved.
+
+    Returns the verified token claims. Raises InvalidSignedRequest if the
+    token cannot be verified.
 
     """
     # code taken from docs:
     # https://ecosystem.atlassian.net/wiki/display/HIPDEV/HipChat+Glances
-    jwt_data = request.GET['signed_request']
     try:
-        oauth_id = jwt.decode(jwt_data, verify=False)['iss']
-        client = models.Install.objects.get(oauth_id=oauth_id)
-        data = jwt.decode(jwt_data, client.oauth_secret)
-        logger.debug("JWT signed_request data: %s", json.dumps(data, indent=4))
-        return client
-    except jwt.exceptions.DecodeError:
-        logger.exception("Unable to decode JWT token")
-        raise Exception()
+        claims = signed_requests.verify_token(request.GET['signed_request'])
+    except signed_requests.InvalidSignedRequest as ex:
+        logger.warning("Unable to verify JWT token: %s", ex)
+        raise
+    logger.debug("JWT signed_request data: %s", serialization.pretty(claims))
+    return claims
+
+
+@require_http_methods(['GET'])
+def metrics(request):
+    """Return outbound API metrics in the Prometheus text format.
+
+    This is only available if HIPCHAT_METRICS_VIEW_ENABLED is True, and
+    the in-memory metrics backend is in use (see hipchat.metrics).
+
+    """
+    backend = api_metrics.get_backend()
+    if not getattr(settings, 'HIPCHAT_METRICS_VIEW_ENABLED', False):
+        raise Http404("Metrics are not enabled.")
+    if not hasattr(backend, 'render'):
+        raise Http404("Metrics backend cannot be rendered.")
+    return HttpResponse(backend.render(), content_type='text/plain; version=0.0.4')
 
 
 # ----- experimental ---------------
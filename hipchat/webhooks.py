@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Webhook event handling.
+
+HipChat posts room events (messages, enter / exit, etc.) to each webhook
+declared in the add-on descriptor, and retries if the response is slow -
+so a handler that runs inside the request amplifies the load it is under.
+
+Instead the webhook view only verifies the JWT (using the cached secrets,
+see hipchat.signed_requests), stores the raw payload as a WebhookEvent
+(a single INSERT) and returns. Pending events are then processed in the
+background, in batches, and sent to the project's handlers using the
+webhook_events signal:
+
+    from django.dispatch import receiver
+    from hipchat.signals import webhook_events
+
+    @receiver(webhook_events)
+    def on_webhook_events(sender, webhook, events, **kwargs):
+        for event in events:
+            handle_message(event.data)
+
+Each batch contains the events (in the order received) for a single
+webhook. If any receiver raises an exception the batch is marked as
+'failed' - it can be retried using the process_webhooks command.
+
+Only one processing task is scheduled at a time (using a marker in the
+Django cache), and it runs until there are no pending events, so a burst
+of events is handled in batches, rather than as a task per event.
+
+The marker is only an optimisation - with a per-process cache, or when
+the process_webhooks command overlaps a task, several processes may be
+fetching events at once. Each batch is therefore claimed (pending ->
+processing, with a unique claim id) by a conditional UPDATE, and only
+the events claimed are sent, so each event reaches the receivers once.
+Events left 'processing' by a process that died are returned to pending
+by release_stale (see the process_webhooks command).
+
+The following settings are used:
+
+    HIPCHAT_WEBHOOK_BATCH_SIZE - max number of events fetched at a time,
+        defaults to 100.
+    HIPCHAT_WEBHOOK_SCHEDULE_TIMEOUT - seconds after which a scheduled
+        task is assumed to have died (so another is scheduled), default 300.
+    HIPCHAT_WEBHOOK_CACHE_SIZE - max number of Webhooks held in memory by
+        the view, defaults to 1000.
+
+"""
+from collections import OrderedDict
+import datetime
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.timezone import now as tz_now
+
+from hipchat import signals
+from hipchat import tasks
+from hipchat.caching import BoundedCache
+from hipchat.models import Install, Webhook, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_CACHE_KEY = "hipchat-webhooks:scheduled"
+
+# webhook_id -> Webhook, invalidated in hipchat.receivers
+webhooks_cache = BoundedCache(
+    maxsize=getattr(settings, 'HIPCHAT_WEBHOOK_CACHE_SIZE', 1000)
+)
+
+
+def batch_size():
+    """Return the max number of events processed in each batch."""
+    return getattr(settings, 'HIPCHAT_WEBHOOK_BATCH_SIZE', 100)
+
+
+def schedule_timeout():
+    """Return the number of seconds for which a scheduled task is trusted."""
+    return getattr(settings, 'HIPCHAT_WEBHOOK_SCHEDULE_TIMEOUT', 300)
+
+
+def get_webhook(webhook_id):
+    """Return a Webhook, from the in-process cache if possible.
+
+    Raises Webhook.DoesNotExist if the webhook does not exist.
+
+    """
+    webhook_id = int(webhook_id)
+    webhook = webhooks_cache.get(webhook_id)
+    if webhook is None:
+        webhook = Webhook.objects.get(id=webhook_id)
+        webhooks_cache.set(webhook_id, webhook)
+    return webhook
+
+
+def invalidate_webhook(webhook_id):
+    """Remove a Webhook from the in-process cache."""
+    webhooks_cache.delete(webhook_id)
+
+
+def receive(webhook, oauth_id, payload):
+    """Store a posted event, and schedule processing.
+
+    Args:
+        webhook: the Webhook that received the event.
+        oauth_id: string, the JWT issuer.
+        payload: string, the raw request body.
+
+    Returns the new WebhookEvent.
+
+    """
+    event = WebhookEvent.objects.create(
+        webhook_id=webhook.id,
+        oauth_id=oauth_id,
+        payload=payload
+    )
+    schedule_processing()
+    return event
+
+
+def schedule_processing():
+    """Schedule process_events in the background, unless already scheduled.
+
+    Returns True if a task was scheduled.
+
+    """
+    if cache.add(SCHEDULED_CACHE_KEY, True, schedule_timeout()):
+        tasks.schedule(process_events)
+        return True
+    return False
+
+
+def process_events(limit=None):
+    """Process pending events, in batches, until there are none left.
+
+    This is the background task scheduled by schedule_processing - it
+    clears the scheduled marker once it has finished.
+
+    Kwargs:
+        limit: int, the batch size, defaults to HIPCHAT_WEBHOOK_BATCH_SIZE.
+
+    Returns the number of events processed (or failed).
+
+    """
+    limit = limit or batch_size()
+    count = 0
+    while True:
+        processed = process_batch(limit)
+        count += processed
+        if processed == limit:
+            continue
+        cache.delete(SCHEDULED_CACHE_KEY)
+        # events received after the last batch was fetched, but before
+        # the marker was deleted, were not scheduled - so check again.
+        if not WebhookEvent.objects.filter(status=WebhookEvent.STATUS_PENDING).exists():
+            return count
+        if not cache.add(SCHEDULED_CACHE_KEY, True, schedule_timeout()):
+            # another task has been scheduled.
+            return count
+
+
+def claim_batch(limit=None):
+    """Claim the next batch of pending events for processing.
+
+    The ids of the oldest pending events are fetched (skipping rows locked
+    by another claim, where the database supports it), and then claimed
+    with a single conditional UPDATE - events claimed by another process
+    in the meantime are not updated, so are not returned.
+
+    Kwargs:
+        limit: int, the batch size, defaults to HIPCHAT_WEBHOOK_BATCH_SIZE.
+
+    Returns a list of the claimed events, in the order received.
+
+    """
+    claim = uuid.uuid4().hex
+    pending = (
+        WebhookEvent.objects
+        .filter(status=WebhookEvent.STATUS_PENDING)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    if getattr(connection.features, 'has_select_for_update_skip_locked', False):
+        # the row locks are held until the claim is committed
+        with transaction.atomic():
+            ids = list(pending.select_for_update(skip_locked=True)[:limit or batch_size()])
+            claimed = _claim(ids, claim)
+    else:
+        ids = list(pending[:limit or batch_size()])
+        claimed = _claim(ids, claim)
+    if not claimed:
+        return []
+    return list(
+        WebhookEvent.objects
+        # the ids limit this to a primary key lookup - claim isn't indexed
+        .filter(id__in=ids, claim=claim)
+        .select_related('webhook')
+        .order_by('id')
+    )
+
+
+def _claim(ids, claim):
+    """Mark those of the events that are still pending as claimed."""
+    if not ids:
+        return 0
+    return (
+        WebhookEvent.objects
+        .filter(id__in=ids, status=WebhookEvent.STATUS_PENDING)
+        .update(status=WebhookEvent.STATUS_PROCESSING, claim=claim, processed_at=tz_now())
+    )
+
+
+def release_stale(timeout=None):
+    """Return events left 'processing' (e.g. by a process that died) to pending.
+
+    Kwargs:
+        timeout: int, seconds after which a claimed event is assumed to
+            have been abandoned, defaults to HIPCHAT_WEBHOOK_SCHEDULE_TIMEOUT.
+
+    Returns the number of events released.
+
+    """
+    timeout = schedule_timeout() if timeout is None else timeout
+    return WebhookEvent.objects.filter(
+        status=WebhookEvent.STATUS_PROCESSING,
+        processed_at__lt=tz_now() - datetime.timedelta(seconds=timeout)
+    ).update(status=WebhookEvent.STATUS_PENDING, claim='', processed_at=None)
+
+
+def process_batch(limit=None):
+    """Send the next batch of pending events to the webhook_events receivers.
+
+    The batch is claimed first (see claim_batch), so events are never
+    sent by two processes. Events whose JWT issuer is not an install of
+    the webhook's app are marked as failed, without being sent.
+
+    Kwargs:
+        limit: int, the batch size, defaults to HIPCHAT_WEBHOOK_BATCH_SIZE.
+
+    Returns the number of events in the batch.
+
+    """
+    events = claim_batch(limit)
+    if not events:
+        return 0
+
+    installs = set(
+        Install.objects
+        .filter(oauth_id__in=set(e.oauth_id for e in events))
+        .values_list('oauth_id', 'app_id')
+    )
+    batches = OrderedDict()
+    failed = []
+    for event in events:
+        if (event.oauth_id, event.webhook.app_id) in installs:
+            batches.setdefault(event.webhook_id, []).append(event)
+        else:
+            logger.warning("Webhook event %s sent by unknown install %s", event.id, event.oauth_id)
+            failed.append(event.id)
+
+    processed = []
+    for batch in batches.values():
+        webhook = batch[0].webhook
+        responses = signals.webhook_events.send_robust(
+            sender=Webhook,
+            webhook=webhook,
+            events=batch
+        )
+        errors = [r for _, r in responses if isinstance(r, Exception)]
+        for error in errors:
+            logger.error("Error processing %s events: %r", webhook, error)
+        (failed if errors else processed).extend(e.id for e in batch)
+
+    now = tz_now()
+    if processed:
+        WebhookEvent.objects.filter(id__in=processed).update(
+            status=WebhookEvent.STATUS_PROCESSED, processed_at=now
+        )
+    if failed:
+        WebhookEvent.objects.filter(id__in=failed).update(
+            status=WebhookEvent.STATUS_FAILED, processed_at=now
+        )
+    return len(events)